@@ -0,0 +1,99 @@
+"""Add OFF category tags to analyses stored before category rankings existed.
+
+Usage (from backend/, with the same .env as the server):
+    python backfill_categories.py [--batch-size 200]
+
+Category rankings only group analyses that have categories_tags. Tags are taken
+from the product data in db.raw_products when it has them, else fetched like a
+new analysis (local OFF mirror first, then the live API, at BATCH_OFF_CONCURRENCY)
+and written back to raw_products too. Products OFF no longer has get an empty
+list; products that could not be fetched are left for the next run. Running
+servers pick the tags up on their next restart. Safe to re-run.
+"""
+import argparse
+import asyncio
+import sys
+from collections import Counter
+from typing import List, Optional
+
+from fastapi import HTTPException
+from pymongo import UpdateOne
+
+import server
+from server import client, db, decompress_raw_product, ensure_indexes, product_categories_tags, raw_product_update
+
+
+async def fetch_tags(barcode: str, semaphore: asyncio.Semaphore) -> Optional[List[str]]:
+    """The product's tags from OFF; [] if OFF does not know it, None if it could not be fetched"""
+    async with semaphore:
+        try:
+            product = await server.fetch_product_from_openfoodfacts(barcode)
+        except HTTPException as e:
+            if e.status_code == 404:
+                return []
+            print(f"\n{barcode}: {e.detail}", file=sys.stderr)
+            return None
+    return product_categories_tags(product)
+
+
+async def backfill(batch_size: int) -> Counter:
+    counts = Counter()
+    semaphore = asyncio.Semaphore(server.BATCH_OFF_CONCURRENCY)
+    last_id = None
+    while True:
+        query = {"categories_tags": {"$exists": False}}
+        if last_id is not None:
+            # Keyset over _id, so products left for the next run are not fetched again in this one
+            query["_id"] = {"$gt": last_id}
+        docs = await db.analyses.find(query, {"_id": 1, "barcode": 1}).sort("_id", 1) \
+            .limit(batch_size).to_list(batch_size)
+        if not docs:
+            return counts
+        last_id = docs[-1]["_id"]
+        raw = {
+            doc["barcode"]: decompress_raw_product(doc)
+            async for doc in db.raw_products.find({"barcode": {"$in": [d["barcode"] for d in docs]}})
+        }
+
+        stored = {barcode: data["categories_tags"] for barcode, data in raw.items() if "categories_tags" in data}
+        missing = [doc["barcode"] for doc in docs if doc["barcode"] not in stored]
+        fetched = dict(zip(missing, await asyncio.gather(*(fetch_tags(b, semaphore) for b in missing))))
+
+        updates, raw_updates = [], []
+        for doc in docs:
+            barcode = doc["barcode"]
+            tags = stored.get(barcode, fetched.get(barcode))
+            if tags is None:
+                counts["failed"] += 1
+                continue
+            counts["from_raw_products" if barcode in stored else "fetched" if tags else "without_tags"] += 1
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"categories_tags": tags}}))
+            if barcode in raw and barcode not in stored:
+                raw_updates.append(raw_product_update(barcode, {**raw[barcode], "categories_tags": tags}))
+        if updates:
+            await db.analyses.bulk_write(updates, ordered=False)
+        if raw_updates:
+            await db.raw_products.bulk_write(raw_updates, ordered=False)
+        print(f"\r{dict(counts)}", end="", file=sys.stderr, flush=True)
+
+
+async def main(args) -> int:
+    await ensure_indexes()
+    try:
+        counts = await backfill(args.batch_size)
+    finally:
+        await server.get_off_client().aclose()
+    print(file=sys.stderr)
+    print(f"Tagged {counts['from_raw_products']} analyses from raw_products and {counts['fetched']} from "
+          f"Open Food Facts; {counts['without_tags']} have no tags, {counts['failed']} could not be fetched")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+    try:
+        sys.exit(asyncio.run(main(args)))
+    finally:
+        client.close()
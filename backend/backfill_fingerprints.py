@@ -0,0 +1,56 @@
+"""Add ingredient fingerprints to analyses stored before analysis reuse existed.
+
+Usage (from backend/, with the same .env as the server):
+    python backfill_fingerprints.py [--batch-size 500]
+
+Fingerprints are computed from the full product data in db.raw_products (see
+migrate_raw_products.py); analyses without it, or without an ingredient list,
+are marked with fingerprint: null and never offered for reuse. Safe to re-run.
+"""
+import argparse
+import asyncio
+import sys
+from collections import Counter
+
+from pymongo import UpdateOne
+
+from server import client, db, decompress_raw_product, ensure_indexes, product_fingerprint
+
+
+async def backfill(batch_size: int) -> Counter:
+    counts = Counter()
+    while True:
+        docs = await db.analyses.find({"fingerprint": {"$exists": False}}, {"_id": 1, "barcode": 1}) \
+            .limit(batch_size).to_list(batch_size)
+        if not docs:
+            return counts
+        raw = {
+            doc["barcode"]: decompress_raw_product(doc)
+            async for doc in db.raw_products.find({"barcode": {"$in": [d["barcode"] for d in docs]}})
+        }
+        updates = []
+        for doc in docs:
+            product_data = raw.get(doc["barcode"])
+            fingerprint = product_fingerprint(product_data) if product_data else None
+            counts["fingerprinted" if fingerprint else "skipped"] += 1
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"fingerprint": fingerprint}}))
+        await db.analyses.bulk_write(updates, ordered=False)
+        print(f"\r{dict(counts)}", end="", file=sys.stderr, flush=True)
+
+
+async def main(args) -> int:
+    await ensure_indexes()
+    counts = await backfill(args.batch_size)
+    print(file=sys.stderr)
+    print(f"Fingerprinted {counts['fingerprinted']} analyses, skipped {counts['skipped']}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    try:
+        sys.exit(asyncio.run(main(args)))
+    finally:
+        client.close()
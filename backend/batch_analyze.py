@@ -0,0 +1,72 @@
+"""Analyze a catalogue of barcodes offline, e.g. to pre-warm db.analyses.
+
+Usage (from backend/, with the same .env as the server):
+    python batch_analyze.py barcodes.txt           # one barcode per line
+    python batch_analyze.py --jsonl products.jsonl # OFF JSONL export; skips the OFF fetch
+    python batch_analyze.py --resume JOB_ID        # continue an interrupted job
+
+Concurrency is set with BATCH_OFF_CONCURRENCY / BATCH_LLM_CONCURRENCY.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+import server
+
+
+def read_barcodes(path):
+    with open(path) as f:
+        return [(line.strip(), None) for line in f if line.strip() and not line.startswith("#")]
+
+
+def read_off_jsonl(path):
+    items = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                product = json.loads(line)
+                if product.get("code"):
+                    items.append((product["code"], product))
+    return items
+
+
+def print_progress(job):
+    handled = job["done"] + job["failed"] + job["skipped"]
+    print(
+        f"\r{handled}/{job['total']} done={job['done']} skipped={job['skipped']} "
+        f"failed={job['failed']} ({job.get('per_second') or 0:.2f}/s)",
+        end="", file=sys.stderr, flush=True
+    )
+
+
+async def main(args):
+    await server.ensure_indexes()
+    if args.resume:
+        job = await server.get_batch_job(args.resume)
+        if not job:
+            sys.exit(f"No batch job {args.resume}")
+    else:
+        items = read_off_jsonl(args.jsonl) if args.jsonl else read_barcodes(args.barcodes)
+        job = await server.create_batch_job(items, source="cli")
+        print(f"Created batch job {job['id']} with {job['total']} barcodes", file=sys.stderr)
+
+    try:
+        job = await server.run_batch_job(job["id"], on_progress=print_progress)
+    finally:
+        print(file=sys.stderr)
+        await server.get_off_client().aclose()
+    print(json.dumps(job, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("barcodes", nargs="?", help="file with one barcode per line")
+    source.add_argument("--jsonl", help="Open Food Facts JSONL export")
+    source.add_argument("--resume", metavar="JOB_ID", help="resume an existing batch job")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    finally:
+        server.client.close()
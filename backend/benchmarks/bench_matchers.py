@@ -0,0 +1,113 @@
+"""Per-document cost of allergen / food-type matching on long OFF ingredient strings.
+
+Compares the compiled KeywordMatcher against the previous nested substring loops.
+Run from backend/:  python benchmarks/bench_matchers.py [--docs 2000] [--length 3000]
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ingredient_matcher import (  # noqa: E402
+    ALLERGEN_KEYWORDS, ALLERGEN_MATCHER, FOOD_TYPE_KEYWORDS, FOOD_TYPE_MATCHER,
+)
+
+# Typical OFF ingredient fragments, mixed languages and percentages
+FRAGMENTS = [
+    "sugar", "wheat flour", "palm oil", "hazelnuts (13%)", "skimmed milk powder", "cocoa butter",
+    "emulsifier: soy lecithin", "salt", "natural flavouring", "glucose syrup", "nutmeg", "coconut",
+    "graham flour", "farine de blé", "sucre", "huile de tournesol", "lait écrémé en poudre", "noix de coco",
+    "Weizenmehl", "Zucker", "Vollmilchpulver", "Haselnüsse", "harina de trigo", "azúcar", "leche desnatada",
+    "farina di frumento", "zucchero", "latte scremato in polvere", "raising agents (E500, E503)",
+    "acidity regulator: citric acid", "dried egg yolk", "rapeseed oil", "may contain traces of peanuts",
+]
+
+LEGACY_ALLERGENS = {
+    "nuts": ["nut", "almond", "cashew", "walnut", "pecan", "pistachio", "hazelnut", "macadamia"],
+    "dairy": ["milk", "cream", "cheese", "butter", "lactose", "whey", "casein", "yogurt"],
+    "gluten": ["wheat", "gluten", "barley", "rye", "oat", "semolina", "spelt"],
+    "soy": ["soy", "soya", "lecithin"],
+    "eggs": ["egg", "albumin", "lysozyme"],
+    "shellfish": ["shrimp", "crab", "lobster", "shellfish", "prawn", "crawfish"],
+}
+LEGACY_NON_VEG = ["meat", "chicken", "beef", "pork", "fish", "seafood", "mutton", "lamb",
+                  "bacon", "ham", "turkey", "duck", "gelatin", "lard", "anchovies"]
+LEGACY_EGG = ["egg", "eggs", "albumin", "lysozyme", "mayonnaise", "meringue"]
+
+
+def legacy_check(text: str, allergens):
+    lower = text.lower()
+    found = []
+    for allergen in allergens:
+        for keyword in LEGACY_ALLERGENS[allergen]:
+            if keyword in lower:
+                found.append(allergen)
+                break
+    for keyword in LEGACY_NON_VEG:
+        if keyword in lower:
+            return found, "non-veg"
+    for keyword in LEGACY_EGG:
+        if keyword in lower:
+            return found, "egg"
+    return found, "veg"
+
+
+def substring_multilingual_check(text: str, allergens):
+    """The old loop shape over the current multilingual tables, for a like-for-like cost"""
+    lower = text.lower()
+    found = [a for a in allergens if any(k.rstrip("*") in lower for k in ALLERGEN_KEYWORDS[a])]
+    for group in ("non-veg", "egg"):
+        if any(k.rstrip("*") in lower for k in FOOD_TYPE_KEYWORDS[group]):
+            return found, group
+    return found, "veg"
+
+
+def compiled_check(text: str, allergens):
+    found = ALLERGEN_MATCHER.groups_in(text)
+    food = FOOD_TYPE_MATCHER.groups_in(text)
+    food_type = "non-veg" if "non-veg" in food else "egg" if "egg" in food else "veg"
+    return [a for a in allergens if a in found], food_type
+
+
+def make_documents(count: int, length: int, seed: int = 7):
+    rng = random.Random(seed)
+    docs = []
+    for _ in range(count):
+        parts, size = [], 0
+        while size < length:
+            fragment = rng.choice(FRAGMENTS)
+            parts.append(fragment)
+            size += len(fragment) + 2
+        docs.append(", ".join(parts))
+    return docs
+
+
+def bench(name, fn, docs, allergens):
+    start = time.perf_counter()
+    for doc in docs:
+        fn(doc, allergens)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {elapsed / len(docs) * 1e6:9.1f} us/doc  ({len(docs)} docs, {elapsed * 1e3:.0f} ms)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--length", type=int, default=3000, help="approximate characters per ingredient list")
+    args = parser.parse_args()
+
+    docs = make_documents(args.docs, args.length)
+    allergens = list(ALLERGEN_KEYWORDS)
+    bench("legacy", legacy_check, docs, allergens)
+    bench("substring", substring_multilingual_check, docs, allergens)
+    bench("compiled", compiled_check, docs, allergens)
+    # Cached analyses re-check the same ingredient strings on every request
+    bench("hot", compiled_check, docs, allergens)
+
+    sample = "nutmeg, coconut, graham flour, cocoa butter, noix de coco"
+    print(f"\nfalse positives on {sample!r}:")
+    print(f"  legacy   {legacy_check(sample, allergens)}")
+    print(f"  compiled {compiled_check(sample, allergens)}")
@@ -0,0 +1,57 @@
+"""Throughput of the Nutri-Score engine: one vectorized call vs one call per product.
+
+Run from backend/:  python benchmarks/bench_nutriscore.py [--products 100000]
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from nutriscore import compute, nutrient_columns, score_product, score_products  # noqa: E402
+
+CATEGORIES = [
+    "Snacks, Sweet snacks, Biscuits", "Beverages, Carbonated drinks, Sodas", "Dairies, Cheeses, Hard cheeses",
+    "Fats, Vegetable fats, Olive oils", "Breakfasts, Cereals", "Beverages, Waters, Spring waters",
+]
+
+
+def synthetic_products(count: int, rng: random.Random):
+    products = []
+    for _ in range(count):
+        nutriments = {
+            "energy-kcal_100g": rng.uniform(0, 900), "sugars_100g": rng.uniform(0, 60),
+            "saturated-fat_100g": rng.uniform(0, 20), "fat_100g": rng.uniform(20, 100),
+            "salt_100g": rng.uniform(0, 3), "fiber_100g": rng.uniform(0, 8), "proteins_100g": rng.uniform(0, 30),
+            "fruits-vegetables-nuts-estimate-from-ingredients_100g": rng.uniform(0, 100),
+        }
+        if rng.random() < 0.1:
+            del nutriments["sugars_100g"]
+        products.append({"categories": rng.choice(CATEGORIES), "nutriments": nutriments})
+    return products
+
+
+def timed(label: str, func, count: int):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms  ({count / elapsed:,.0f} products/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100000)
+    args = parser.parse_args()
+    products = synthetic_products(args.products, random.Random(7))
+
+    loop_count = min(args.products, 10000)
+    timed("score_product, one by one", lambda: [score_product(p) for p in products[:loop_count]], loop_count)
+    timed("score_products, one call", lambda: score_products(products), args.products)
+    columns = nutrient_columns(products)
+    timed("compute() on columns only", lambda: compute(**columns), args.products)
+
+
+if __name__ == "__main__":
+    main()
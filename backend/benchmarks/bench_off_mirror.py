@@ -0,0 +1,119 @@
+"""Import time, on-disk size and lookup latency of the local Open Food Facts mirror.
+
+Generates a synthetic OFF JSONL dump (full-size product documents, most of whose
+keys the mirror drops), imports it, applies a delta, then times random lookups.
+Run from backend/:  python benchmarks/bench_off_mirror.py [--products 100000] [--lookups 20000]
+"""
+import argparse
+import gzip
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from off_mirror import ProductMirror  # noqa: E402
+
+WORDS = [
+    "sugar", "wheat flour", "palm oil", "hazelnuts", "skimmed milk powder", "cocoa butter", "soy lecithin",
+    "salt", "natural flavouring", "glucose syrup", "farine de blé", "sucre", "Weizenmehl", "Zucker",
+    "harina de trigo", "azúcar", "farina di frumento", "rapeseed oil", "dried egg yolk", "citric acid",
+]
+
+
+def synthetic_product(code: str, rng: random.Random, modified: int) -> dict:
+    ingredients = rng.sample(WORDS, rng.randint(4, 14))
+    return {
+        "code": code,
+        "last_modified_t": modified,
+        "product_name": f"Product {code}",
+        "brands": rng.choice(["Acme", "Ferrero", "Nestlé", "Danone", "Lidl"]),
+        "quantity": f"{rng.randint(1, 20) * 50} g",
+        "ingredients_text": ", ".join(ingredients),
+        "ingredients": [
+            {"id": f"en:{w.replace(' ', '-')}", "text": w, "percent_estimate": rng.random() * 40,
+             "vegan": "maybe", "vegetarian": "yes", "rank": i + 1, "ciqual_food_code": "31016",
+             "percent_min": 0, "percent_max": 100}
+            for i, w in enumerate(ingredients)
+        ],
+        "nutriments": {
+            **{f"{n}{suffix}": round(rng.random() * 50, 2)
+               for n in ("energy-kcal", "fat", "saturated-fat", "carbohydrates", "sugars", "fiber",
+                         "proteins", "salt", "sodium")
+               for suffix in ("", "_100g", "_serving", "_value")},
+            **{f"{n}_unit": "g" for n in ("fat", "sugars", "salt")},
+        },
+        "categories": "Snacks, Sweet snacks, Biscuits",
+        "labels": "Green Dot",
+        "nutriscore_grade": rng.choice("abcde"),
+        "nova_group": rng.randint(1, 4),
+        # A sample of the keys a real dump carries that the mirror drops
+        "images": {str(i): {"sizes": {"100": {"h": 100, "w": 75}, "400": {"h": 400, "w": 300}}} for i in range(4)},
+        "ingredients_tags": [f"en:{w.replace(' ', '-')}" for w in ingredients],
+        "categories_hierarchy": ["en:snacks", "en:sweet-snacks", "en:biscuits-and-cakes", "en:biscuits"],
+        "countries_tags": ["en:france", "en:germany", "en:spain"],
+        "states_tags": ["en:to-be-checked", "en:complete", "en:nutrition-facts-completed"],
+        "editors_tags": [f"user{rng.randint(1, 9999)}" for _ in range(5)],
+    }
+
+
+def write_dump(path: Path, codes, rng: random.Random, modified: int):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for code in codes:
+            f.write(json.dumps(synthetic_product(code, rng, modified)) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    codes = [f"{3000000000000 + i * 7919}" for i in range(args.products)]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        dump = tmp / "products.jsonl.gz"
+        write_dump(dump, codes, rng, modified=1_700_000_000)
+        (tmp / "deltas").mkdir()
+        changed = rng.sample(codes, max(1, args.products // 100))
+        write_dump(tmp / "deltas" / "delta_0001.json.gz", changed, rng, modified=1_700_086_400)
+        raw_size = sum(len(json.dumps(synthetic_product(c, random.Random(0), 0))) + 1 for c in codes[:1000])
+
+        mirror = ProductMirror(str(tmp / "mirror.sqlite3"))
+        imported = mirror.import_file(str(dump))
+        deltas = mirror.apply_deltas(str(tmp / "deltas"))
+        mirror._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        described = mirror.describe()
+
+        sample = [rng.choice(codes) for _ in range(args.lookups)]
+        timings = []
+        for code in sample:
+            started = time.perf_counter()
+            mirror.get(code)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        missing = [str(9000000000000 + i) for i in range(2000)]
+        started = time.perf_counter()
+        for code in missing:
+            mirror.get(code)
+        miss_us = (time.perf_counter() - started) / len(missing) * 1e6
+        mirror.close()
+
+    print(f"products:            {args.products}")
+    print(f"import:              {imported['seconds']:.2f}s ({args.products / imported['seconds']:.0f} products/s)")
+    print(f"delta:               {deltas[0]['written']} updated in {deltas[0]['seconds']:.3f}s")
+    print(f"raw JSON (est.):     {raw_size * args.products / 1000 / 1e6:.1f} MB")
+    print(f"mirror on disk:      {described['size_bytes'] / 1e6:.1f} MB "
+          f"({described['size_bytes'] / args.products:.0f} B/product)")
+    print(f"lookup hit p50/p99:  {statistics.median(timings) * 1e6:.1f} / "
+          f"{timings[int(len(timings) * 0.99)] * 1e6:.1f} us")
+    print(f"lookup miss mean:    {miss_us:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
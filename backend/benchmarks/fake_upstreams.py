@@ -0,0 +1,179 @@
+"""Local stand-ins for Open Food Facts and an OpenAI-compatible endpoint, for load tests.
+
+Point the server at it with OFF_BASE_URL=http://127.0.0.1:PORT and
+OPENAI_BASE_URL=http://127.0.0.1:PORT/v1. Products are synthesized from the
+barcode (same barcode, same product); barcodes starting with 404 are unknown.
+Completions wait --llm-latency seconds before the first token and stream the
+rest in --llm-chunks chunks spread over --llm-stream-seconds.
+
+Run from backend/:  python benchmarks/fake_upstreams.py --port 9100 [--off-latency 0.05] [--llm-latency 0.4]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+INGREDIENTS = [
+    "sugar", "wheat flour", "palm oil", "hazelnuts", "skimmed milk powder", "cocoa butter", "soy lecithin",
+    "salt", "natural flavouring", "glucose syrup", "rapeseed oil", "dried egg yolk", "citric acid", "peanuts",
+    "whole milk", "oat flakes", "tomato paste", "sunflower oil", "yeast extract", "vanillin",
+]
+CATEGORIES = [
+    "Snacks, Sweet snacks, Biscuits", "Beverages, Carbonated drinks, Sodas", "Dairies, Cheeses, Hard cheeses",
+    "Breakfasts, Cereals", "Spreads, Sweet spreads, Hazelnut spreads", "Meals, Pasta dishes",
+]
+
+config = argparse.Namespace(off_latency=0.05, llm_latency=0.4, llm_stream_seconds=1.0, llm_chunks=40)
+stats = {"off_requests": 0, "llm_requests": 0, "llm_streams": 0}
+
+
+def synthetic_product(barcode: str) -> dict:
+    rng = random.Random(barcode)
+    ingredients = rng.sample(INGREDIENTS, rng.randint(4, 12))
+    categories = rng.choice(CATEGORIES)
+    return {
+        "code": barcode,
+        "product_name": f"Product {barcode}",
+        "brands": rng.choice(["Acme", "Nutrico", "Bonfood", "Globex"]),
+        "categories": categories,
+        "categories_tags": ["en:" + "-".join(c.strip().lower().split()) for c in categories.split(",")],
+        "quantity": f"{rng.choice([200, 250, 400, 500, 750])} g",
+        "ingredients_text": ", ".join(ingredients),
+        "allergens": "en:milk,en:nuts" if "hazelnuts" in ingredients else "",
+        "nova_group": rng.randint(1, 4),
+        "image_url": f"https://images.example.org/{barcode}.jpg",
+        "last_modified_t": 1700000000,
+        "nutriments": {
+            "energy-kcal_100g": round(rng.uniform(20, 600), 1),
+            "energy_100g": round(rng.uniform(80, 2500), 1),
+            "fat_100g": round(rng.uniform(0, 40), 1),
+            "saturated-fat_100g": round(rng.uniform(0, 15), 1),
+            "carbohydrates_100g": round(rng.uniform(0, 80), 1),
+            "sugars_100g": round(rng.uniform(0, 50), 1),
+            "fiber_100g": round(rng.uniform(0, 8), 1),
+            "proteins_100g": round(rng.uniform(0, 25), 1),
+            "salt_100g": round(rng.uniform(0, 3), 2),
+        },
+    }
+
+
+async def off_product(request: Request):
+    stats["off_requests"] += 1
+    await asyncio.sleep(config.off_latency)
+    barcode = request.path_params["barcode"]
+    if barcode.startswith("404"):
+        return JSONResponse({"status": 0, "status_verbose": "product not found"}, status_code=404)
+    return JSONResponse({"status": 1, "code": barcode, "product": synthetic_product(barcode)})
+
+
+def analysis_content(prompt: str) -> str:
+    rng = random.Random(prompt)
+    ingredients = rng.sample(INGREDIENTS, 6)
+    return json.dumps({
+        "product_summary": {"name": "Synthetic product", "brand": "Acme", "categories": ["Snacks"]},
+        "relevant_ingredients": [
+            {"name": name, "estimated_concentration": f"{rng.randint(1, 40)}%",
+             "health_impact": f"{name} adds energy with few micronutrients.",
+             "long_term_effects": "Frequent high intake is associated with weight gain."}
+            for name in ingredients[:3]
+        ],
+        "all_ingredients": [{"name": name, "percentage": None} for name in ingredients],
+        "minority_ingredients": [
+            {"name": ingredients[-1], "reason_for_attention": "Additive present in small amounts.",
+             "potential_long_term_risk": "No established risk at typical intake."}
+        ],
+        "nutritional_insights": {
+            "overall_assessment": "An energy-dense processed product best eaten occasionally.",
+            "who_should_limit_consumption": "People limiting sugar or saturated fat.",
+            "usage_recommendation": "Occasional treat within a balanced diet.",
+        },
+        "confidence_meter": {"confidence_percentage": "80%",
+                             "confidence_explanation": "Based on the listed ingredients and nutrition facts."},
+    })
+
+
+def completion_content(messages: list) -> str:
+    system = messages[0].get("content", "") if messages else ""
+    if "Ingredient & Health Impact Analyst" in system:
+        return analysis_content(messages[-1].get("content", ""))
+    return "Based on the analysis, this product is fine occasionally but high in sugar. " * 3
+
+
+def usage(messages: list, content: str) -> dict:
+    prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+    completion_tokens = len(content) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+async def chat_completions(request: Request):
+    stats["llm_requests"] += 1
+    body = await request.json()
+    messages = body.get("messages", [])
+    content = completion_content(messages)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    await asyncio.sleep(config.llm_latency)
+
+    if not body.get("stream"):
+        # Same total time as the streamed answer
+        await asyncio.sleep(config.llm_stream_seconds)
+        return JSONResponse({
+            "id": completion_id, "object": "chat.completion", "created": created, "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage(messages, content),
+        })
+
+    stats["llm_streams"] += 1
+
+    def chunk(delta: dict, finish_reason=None, with_usage=None) -> str:
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                   "model": body.get("model"), "choices": [], "usage": with_usage}
+        if with_usage is None:
+            payload["choices"] = [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def events():
+        size = max(1, len(content) // max(1, config.llm_chunks))
+        pause = config.llm_stream_seconds / max(1, config.llm_chunks)
+        yield chunk({"role": "assistant", "content": ""})
+        for start in range(0, len(content), size):
+            await asyncio.sleep(pause)
+            yield chunk({"content": content[start:start + size]})
+        yield chunk({}, finish_reason="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk({}, with_usage=usage(messages, content))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+async def health(request: Request):
+    return JSONResponse({"ok": True, **stats})
+
+
+app = Starlette(routes=[
+    Route("/api/v2/product/{barcode}.json", off_product),
+    Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+    Route("/health", health),
+])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--off-latency", type=float, default=config.off_latency)
+    parser.add_argument("--llm-latency", type=float, default=config.llm_latency, help="seconds to first token")
+    parser.add_argument("--llm-stream-seconds", type=float, default=config.llm_stream_seconds)
+    parser.add_argument("--llm-chunks", type=int, default=config.llm_chunks)
+    args = parser.parse_args()
+    config.__dict__.update({k: v for k, v in vars(args).items() if k != "port"})
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
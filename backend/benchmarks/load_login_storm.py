@@ -0,0 +1,82 @@
+"""/api/analyze latency with and without a concurrent login storm, against a running server.
+
+Registers (or reuses) a load-test account, measures cached /api/analyze/{barcode}
+latency on its own, then again while --storm concurrent clients log in as fast as
+they can, backing off on 503 as a real client would. With bcrypt on the event loop
+/analyze queues behind every hash; with the password executor it stays within a
+small factor of the baseline and excess logins are shed with 503.
+
+Run from backend/ (the barcode should already be analyzed, so only the cache is hit):
+    python benchmarks/load_login_storm.py --base-url http://localhost:8001 --barcode 3017620422003
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+EMAIL = "loadtest-login-storm@example.com"
+PASSWORD = "load-test-password"
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000  # noqa: E731
+    return f"p50={statistics.median(ordered) * 1000:.1f}ms p95={pick(0.95):.1f}ms p99={pick(0.99):.1f}ms"
+
+
+async def measure_analyze(client: httpx.AsyncClient, barcode: str, seconds: float, concurrency: int):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+
+    async def probe():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await client.post(f"/api/analyze/{barcode}")
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(probe() for _ in range(concurrency)))
+    return latencies
+
+
+async def login_storm(client: httpx.AsyncClient, stop: asyncio.Event, concurrency: int, statuses: Counter):
+    async def hammer():
+        while not stop.is_set():
+            response = await client.post("/api/auth/login", json={"email": EMAIL, "password": PASSWORD})
+            statuses[response.status_code] += 1
+            if response.status_code == 503:
+                await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+    await asyncio.gather(*(hammer() for _ in range(concurrency)))
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.storm + args.probes + 4)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        await client.post("/api/auth/register", json={"email": EMAIL, "password": PASSWORD, "name": "Load test"})
+        (await client.post(f"/api/analyze/{args.barcode}")).raise_for_status()
+
+        baseline = await measure_analyze(client, args.barcode, args.seconds, args.probes)
+        print(f"analyze alone:        {len(baseline)} requests, {percentiles(baseline)}")
+
+        stop, statuses = asyncio.Event(), Counter()
+        storm = asyncio.create_task(login_storm(client, stop, args.storm, statuses))
+        await asyncio.sleep(0.5)
+        loaded = await measure_analyze(client, args.barcode, args.seconds, args.probes)
+        stop.set()
+        await storm
+        print(f"analyze during storm: {len(loaded)} requests, {percentiles(loaded)}")
+        print(f"logins ({args.storm} clients): {dict(statuses)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--barcode", required=True, help="an already analyzed barcode")
+    parser.add_argument("--storm", type=int, default=50, help="concurrent login clients")
+    parser.add_argument("--probes", type=int, default=4, help="concurrent /analyze clients")
+    parser.add_argument("--seconds", type=float, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,327 @@
+"""Reproducible load test of the API against local stand-ins for OFF, OpenAI and MongoDB.
+
+Starts benchmarks/fake_upstreams.py and the API server (uvicorn, one process), then
+drives each scenario for --seconds with --concurrency clients and reports request
+count, errors, RPS and p50/p95/p99 latency. Results (with the git commit and the
+settings) are written as JSON so runs can be compared across commits.
+
+Scenarios: analyze_cold (uncached barcodes, full OFF + LLM pipeline), analyze_hot,
+analyze_stream_cold, compare, chat, history, login (bcrypt storm) and mixed.
+
+MongoDB: --mongo-url uses an existing server (a throwaway database is created and
+dropped); otherwise a temporary mongod is started if one is on PATH, else the
+in-memory mongomock-motor is used when installed (numbers then mostly reflect
+Python overhead, not database latency).
+
+Run from backend/:
+    python benchmarks/loadtest.py [--scenarios analyze_hot,compare] [--seconds 10] [--concurrency 16]
+    python benchmarks/loadtest.py diff benchmarks/results/OLD.json benchmarks/results/NEW.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+SCENARIOS = ["analyze_cold", "analyze_hot", "analyze_stream_cold", "compare", "chat", "history", "login", "mixed"]
+ADMIN_KEY = "loadtest-admin"
+EMAIL = "loadtest@example.com"
+PASSWORD = "load-test-password"
+# Weights of the mixed workload: mostly cached scans, like real traffic
+MIXED = {"analyze_hot": 60, "analyze_cold": 5, "compare": 10, "chat": 10, "history": 15}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(latencies, statuses: Counter, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 2) if ordered else None  # noqa: E731
+    errors = sum(count for status, count in statuses.items() if not 200 <= int(status) < 300)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2) if ordered else None,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+    }
+
+
+class Harness:
+    """Fake upstreams + API server as subprocesses, and the clients driving them"""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.tmpdir = tempfile.mkdtemp(prefix="nutridive-loadtest-")
+        self.db_name = f"loadtest_{int(time.time())}"
+        self.mongo_url = args.mongo_url
+        self.mongo_mode = "url" if args.mongo_url else None
+        self.api_url = None
+        self.token = None
+        self.warm_barcodes = []
+        self.cold_counter = random.Random(args.seed).randrange(10 ** 9, 2 * 10 ** 9)
+
+    def spawn(self, command, env=None, log_name="process"):
+        log = open(Path(self.tmpdir) / f"{log_name}.log", "w")
+        process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        return process
+
+    def start_mongo(self):
+        if self.mongo_mode:
+            return
+        if shutil.which("mongod"):
+            port = free_port()
+            dbpath = Path(self.tmpdir) / "mongo"
+            dbpath.mkdir()
+            self.spawn(["mongod", "--dbpath", str(dbpath), "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+                       log_name="mongod")
+            self.mongo_url, self.mongo_mode = f"mongodb://127.0.0.1:{port}", "mongod"
+            return
+        try:
+            import mongomock_motor  # noqa: F401
+        except ImportError:
+            sys.exit("No MongoDB: pass --mongo-url, put mongod on PATH, or pip install mongomock-motor")
+        self.mongo_url, self.mongo_mode = "mongodb://127.0.0.1:1", "memory"
+
+    async def wait_ready(self, url: str, seconds: float = 30):
+        deadline = time.monotonic() + seconds
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                try:
+                    if (await client.get(url)).status_code < 500:
+                        return
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.2)
+        sys.exit(f"{url} did not come up; logs in {self.tmpdir}")
+
+    async def start(self):
+        self.start_mongo()
+        fake_port, api_port = free_port(), free_port()
+        self.spawn([sys.executable, "benchmarks/fake_upstreams.py", "--port", str(fake_port),
+                    "--off-latency", str(self.args.off_latency), "--llm-latency", str(self.args.llm_latency),
+                    "--llm-stream-seconds", str(self.args.llm_stream_seconds)], log_name="fake_upstreams")
+        env = {
+            **os.environ,
+            "MONGO_URL": self.mongo_url,
+            "DB_NAME": self.db_name,
+            "OFF_BASE_URL": f"http://127.0.0.1:{fake_port}",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+            "OPENAI_API_KEY": "loadtest",
+            "ADMIN_API_KEY": ADMIN_KEY,
+            "OFF_MIRROR_PATH": "",
+            "BCRYPT_ROUNDS": str(self.args.bcrypt_rounds),
+        }
+        self.spawn([sys.executable, __file__, "serve", "--port", str(api_port), "--mongo", self.mongo_mode],
+                   env=env, log_name="api")
+        self.api_url = f"http://127.0.0.1:{api_port}"
+        await self.wait_ready(f"http://127.0.0.1:{fake_port}/health")
+        await self.wait_ready(f"{self.api_url}/api/")
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.mongo_mode == "url" and not self.args.keep_db:
+            from pymongo import MongoClient
+            MongoClient(self.mongo_url).drop_database(self.db_name)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def cold_barcode(self) -> str:
+        self.cold_counter += 1
+        return f"2{self.cold_counter:012d}"
+
+    async def setup(self, client: httpx.AsyncClient):
+        """An account with scan history, and warm analyses for the hot scenarios"""
+        response = await client.post("/api/auth/register", json={"email": EMAIL, "password": PASSWORD, "name": "Load test"})
+        if response.status_code == 400:
+            response = await client.post("/api/auth/login", json={"email": EMAIL, "password": PASSWORD})
+        response.raise_for_status()
+        self.token = response.json()["token"]
+        self.warm_barcodes = [self.cold_barcode() for _ in range(self.args.warm)]
+        semaphore = asyncio.Semaphore(16)
+
+        async def warm(barcode):
+            async with semaphore:
+                (await client.post(f"/api/analyze/{barcode}", headers=self.auth)).raise_for_status()
+
+        await asyncio.gather(*(warm(b) for b in self.warm_barcodes))
+
+    @property
+    def auth(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def request(self, scenario: str):
+        """(method, path, kwargs) of one request of a scenario"""
+        if scenario == "analyze_cold":
+            return "POST", f"/api/analyze/{self.cold_barcode()}", {}
+        if scenario == "analyze_hot":
+            return "POST", f"/api/analyze/{random.choice(self.warm_barcodes)}", {"headers": self.auth}
+        if scenario == "analyze_stream_cold":
+            return "POST", f"/api/analyze/{self.cold_barcode()}/stream", {}
+        if scenario == "compare":
+            return "POST", "/api/compare", {"json": {"barcodes": random.sample(self.warm_barcodes, 3)}}
+        if scenario == "chat":
+            return "POST", "/api/chat", {"json": {
+                "barcode": random.choice(self.warm_barcodes), "message": "Is this a healthy snack for kids?",
+                "history": [{"role": "user", "content": "What is in it?"},
+                            {"role": "assistant", "content": "Mostly sugar, flour and palm oil."}],
+            }}
+        if scenario == "history":
+            return "GET", "/api/history", {"headers": self.auth}
+        if scenario == "login":
+            return "POST", "/api/auth/login", {"json": {"email": EMAIL, "password": PASSWORD}}
+        if scenario == "mixed":
+            return self.request(random.choices(list(MIXED), weights=list(MIXED.values()))[0])
+        raise ValueError(f"Unknown scenario {scenario}")
+
+    async def run_scenario(self, client: httpx.AsyncClient, scenario: str) -> dict:
+        latencies, statuses, transport_errors = [], Counter(), Counter()
+        started = time.perf_counter()
+        deadline = started + self.args.seconds
+
+        async def user():
+            while time.perf_counter() < deadline:
+                method, path, kwargs = self.request(scenario)
+                sent = time.perf_counter()
+                try:
+                    response = await client.request(method, path, **kwargs)
+                    await response.aread()
+                except httpx.HTTPError as e:
+                    transport_errors[type(e).__name__] += 1
+                    continue
+                latencies.append(time.perf_counter() - sent)
+                statuses[response.status_code] += 1
+
+        await asyncio.gather(*(user() for _ in range(self.args.concurrency)))
+        result = summarize(latencies, statuses, time.perf_counter() - started)
+        result["transport_errors"] = dict(transport_errors)
+        return result
+
+
+async def run(args) -> dict:
+    harness = Harness(args)
+    random.seed(args.seed)
+    try:
+        await harness.start()
+        limits = httpx.Limits(max_connections=args.concurrency + 8)
+        async with httpx.AsyncClient(base_url=harness.api_url, timeout=args.timeout, limits=limits) as client:
+            await harness.setup(client)
+            results = {}
+            for scenario in args.scenarios:
+                results[scenario] = await harness.run_scenario(client, scenario)
+                r = results[scenario]
+                print(f"{scenario:<20} {r['requests']:>7} req {r['rps']:>9.1f} rps  p50={r['p50_ms']}ms "
+                      f"p95={r['p95_ms']}ms p99={r['p99_ms']}ms errors={r['errors']}", file=sys.stderr)
+            server_metrics = (await client.get("/metrics")).text
+    finally:
+        harness.stop()
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "mongo": harness.mongo_mode,
+        "settings": {k: v for k, v in vars(args).items() if k not in ("command", "output")},
+        "scenarios": results,
+        "token_usage": [line for line in server_metrics.splitlines() if line.startswith("nutridive_llm_tokens_total")],
+    }
+
+
+def diff(old_path: str, new_path: str):
+    old, new = (json.loads(Path(p).read_text()) for p in (old_path, new_path))
+    print(f"{old['commit']} -> {new['commit']}")
+    for scenario in new["scenarios"]:
+        if scenario not in old["scenarios"]:
+            continue
+        before, after = old["scenarios"][scenario], new["scenarios"][scenario]
+        cells = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            a, b = before.get(key), after.get(key)
+            change = f"{(b - a) / a * 100:+.0f}%" if a and b is not None else "n/a"
+            cells.append(f"{key} {a} -> {b} ({change})")
+        print(f"{scenario:<20} " + "  ".join(cells))
+
+
+def serve(args):
+    """The API server as the harness runs it; --mongo memory swaps in mongomock-motor"""
+    sys.path.insert(0, str(BACKEND_DIR))
+    import uvicorn
+    import server
+    if args.mongo == "memory":
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[os.environ["DB_NAME"]]
+    uvicorn.run(server.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", nargs="?", default="run", choices=("run", "diff", "serve"))
+    parser.add_argument("paths", nargs="*", help="diff: the two result files")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        type=lambda value: [s for s in value.split(",") if s])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warm", type=int, default=50, help="products analyzed before the hot scenarios")
+    parser.add_argument("--off-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="seconds to the first token")
+    parser.add_argument("--llm-stream-seconds", type=float, default=1.0)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mongo-url", help="existing MongoDB; a throwaway database is used")
+    parser.add_argument("--keep-db", action="store_true")
+    parser.add_argument("--mongo", choices=("url", "mongod", "memory"), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="result file (default benchmarks/results/<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args)
+    elif args.command == "diff":
+        if len(args.paths) != 2:
+            parser.error("diff needs two result files")
+        diff(*args.paths)
+    else:
+        unknown = set(args.scenarios) - set(SCENARIOS)
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+        result = asyncio.run(run(args))
+        output = Path(args.output) if args.output else \
+            RESULTS_DIR / f"{result['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(result, indent=2))
+        print(output)
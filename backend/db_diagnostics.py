@@ -0,0 +1,45 @@
+"""Report MongoDB index usage and the query plan of each API route.
+
+Usage (from backend/, with the same .env as the server):
+    python db_diagnostics.py            # print the report as JSON
+    python db_diagnostics.py --ensure   # create missing indexes first
+    python db_diagnostics.py --check    # exit 1 if an index is missing or a route query does a collection scan
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from server import client, collect_db_diagnostics, ensure_indexes
+
+
+async def main(args) -> int:
+    if args.ensure:
+        await ensure_indexes()
+    report = await collect_db_diagnostics()
+    print(json.dumps(report, indent=2, default=str))
+
+    if not args.check:
+        return 0
+    failed = False
+    if report["missing_indexes"]:
+        # A unique index blocked by old duplicates is only logged at startup
+        print(f"Missing indexes: {', '.join(report['missing_indexes'])}", file=sys.stderr)
+        failed = True
+    scans = [route for route, plan in report["queries"].items() if plan.get("collection_scan")]
+    if scans:
+        print(f"Collection scans in: {', '.join(scans)}", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ensure", action="store_true", help="create missing indexes before reporting")
+    parser.add_argument("--check", action="store_true",
+                        help="fail if an index is missing or a route query is a collection scan")
+    args = parser.parse_args()
+    try:
+        sys.exit(asyncio.run(main(args)))
+    finally:
+        client.close()
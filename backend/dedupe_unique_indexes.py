@@ -0,0 +1,82 @@
+"""Remove the duplicates that block the unique indexes, keeping the newest document per key.
+
+Usage (from backend/, with the same .env as the server):
+    python dedupe_unique_indexes.py --dry-run   # only report the duplicates
+    python dedupe_unique_indexes.py             # dedupe, then create the indexes
+
+Databases written before the unique indexes existed (analyses.barcode, users.email...)
+can hold several documents per key, and ensure_indexes() cannot build those indexes
+until only one is left. Per key the newest document (latest created_at, then _id) is
+kept; the others are copied to <collection>_duplicates before they are deleted, so
+they can be inspected or restored. Exits 1 if an index is still missing. Safe to re-run.
+"""
+import argparse
+import asyncio
+import sys
+from typing import List
+
+from pymongo import ReplaceOne
+
+from server import INDEX_SPECS, client, db, ensure_indexes, missing_indexes
+
+
+async def duplicate_groups(collection: str, keys: list, options: dict) -> List[dict]:
+    """Per key with more than one document: the documents' _ids, newest first"""
+    pipeline = [
+        # A partial unique index only constrains the documents it covers
+        {"$match": options.get("partialFilterExpression", {})},
+        {"$sort": {"created_at": -1, "_id": -1}},
+        {"$group": {"_id": {f"k{i}": f"${field}" for i, (field, _) in enumerate(keys)}, "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ]
+    return await db[collection].aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+
+async def dedupe(collection: str, keys: list, options: dict, dry_run: bool, batch_size: int) -> int:
+    groups = await duplicate_groups(collection, keys, options)
+    extra = [_id for group in groups for _id in group["ids"][1:]]
+    if not extra:
+        return 0
+    print(f"{collection}.{options['name']}: {len(groups)} keys with duplicates, "
+          f"{len(extra)} older documents {'to remove' if dry_run else 'removed'}")
+    if dry_run:
+        return len(extra)
+    for start in range(0, len(extra), batch_size):
+        ids = extra[start:start + batch_size]
+        docs = await db[collection].find({"_id": {"$in": ids}}).to_list(None)
+        # Keyed by _id, so a re-run after an interruption does not copy twice
+        await db[f"{collection}_duplicates"].bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False
+        )
+        await db[collection].delete_many({"_id": {"$in": ids}})
+    return len(extra)
+
+
+async def main(args) -> int:
+    removed = 0
+    for collection, specs in INDEX_SPECS.items():
+        for keys, options in specs:
+            if options.get("unique"):
+                removed += await dedupe(collection, keys, options, args.dry_run, args.batch_size)
+    if args.dry_run:
+        print(f"{removed} documents would be removed")
+        return 0
+
+    await ensure_indexes()
+    missing = await missing_indexes()
+    print(f"Removed {removed} documents")
+    if missing:
+        print(f"Still missing: {', '.join(missing)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="report the duplicates without removing them")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    try:
+        sys.exit(asyncio.run(main(args)))
+    finally:
+        client.close()
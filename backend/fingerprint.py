@@ -0,0 +1,116 @@
+"""Ingredient fingerprints for reusing LLM analyses across near-identical products.
+
+Pack-size and regional variants of a product usually share their ingredient list
+and nutrition facts. fingerprint() reduces a product to
+
+- exact: a hash of the normalized ingredient list plus the rounded nutriments,
+  equal for products whose analysis can be copied as-is;
+- nutrients: the hash of the rounded nutriments alone;
+- bands: MinHash LSH band keys of the ingredient text's character shingles.
+  Products whose ingredient lists are near-duplicates (a changed percentage, a
+  typo, "E322" vs "e 322") share at least one band with high probability.
+
+similarity() estimates the Jaccard similarity of two ingredient lists from their
+MinHash signatures, to confirm an LSH candidate before reusing it.
+"""
+import hashlib
+import re
+import unicodedata
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows: pairs above ~0.7 Jaccard similarity almost always share a band
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = 5
+MERSENNE_PRIME = (1 << 31) - 1
+
+# Fixed seed: signatures must be comparable across processes and releases
+_rng = np.random.default_rng(20240611)
+_A = _rng.integers(1, MERSENNE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, MERSENNE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+
+# Nutriments that shape the analysis; others (vitamins, minerals) rarely differ between variants
+FINGERPRINT_NUTRIMENTS = (
+    "energy-kcal_100g", "fat_100g", "saturated-fat_100g", "carbohydrates_100g", "sugars_100g",
+    "fiber_100g", "proteins_100g", "salt_100g",
+)
+
+# Commas and dots separate items unless they sit between digits ("8,7%" is one number)
+SEPARATORS = re.compile(r"\s*(?:[;:()\[\]{}*_/|]|(?<!\d)[,.]|[,.](?!\d))+\s*")
+NUMBER = re.compile(r"(\d+)[.,](\d+)")
+PERCENT = re.compile(r"(\d)\s+%")
+# Hyphens and runs of whitespace: "fat-reduced" == "fat reduced"
+SPACES = re.compile(r"[\s-]+")
+# "e 322", "e-322" -> "e322"
+E_NUMBER = re.compile(r"\be[\s-]+(\d{3}[a-z]?)\b")
+
+
+def normalize_ingredients(text: str) -> str:
+    """Lowercase, accent-free ingredient list with uniform separators, numbers and E-numbers"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    text = PERCENT.sub(r"\1%", NUMBER.sub(r"\1.\2", text))
+    text = E_NUMBER.sub(r"e\1", text)
+    items = [SPACES.sub(" ", item).strip(" -") for item in SEPARATORS.split(text)]
+    return ", ".join(item for item in items if item)
+
+
+def rounded(value) -> Optional[str]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    # Two significant digits: 512 and 508 kcal match, 5.2 g and 6.1 g of sugar do not
+    return f"{number:.2g}"
+
+
+def nutrient_key(nutriments: dict) -> str:
+    values = [rounded(nutriments.get(key)) for key in FINGERPRINT_NUTRIMENTS]
+    return "|".join(value or "-" for value in values)
+
+
+def shingles(normalized: str) -> List[str]:
+    if len(normalized) <= SHINGLE_SIZE:
+        return [normalized]
+    return [normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)]
+
+
+def minhash(normalized: str) -> np.ndarray:
+    """MinHash signature (NUM_PERMUTATIONS uint32 values) of the text's character shingles"""
+    hashes = np.fromiter((zlib.crc32(s.encode()) for s in set(shingles(normalized))), dtype=np.uint64)
+    # (a * x + b) mod p stays below 2^63 for 31-bit a, b and 32-bit x
+    permuted = (np.outer(hashes, _A) + _B) % MERSENNE_PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def band_keys(signature: np.ndarray) -> List[str]:
+    return [
+        f"{band}:{hashlib.blake2b(signature[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).hexdigest()}"
+        for band in range(BANDS)
+    ]
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(first == second))
+
+
+def digest(*parts: str) -> str:
+    return hashlib.blake2b("\n".join(parts).encode(), digest_size=16).hexdigest()
+
+
+def fingerprint(ingredients_text: str, nutriments: dict) -> Optional[Dict[str, object]]:
+    """exact / nutrients / bands of a product; None without an ingredient list to compare"""
+    normalized = normalize_ingredients(ingredients_text)
+    if len(normalized) < SHINGLE_SIZE or normalized in ("not available", "unknown"):
+        return None
+    nutrients = nutrient_key(nutriments or {})
+    return {
+        "exact": digest(normalized, nutrients),
+        "nutrients": digest(nutrients),
+        "bands": band_keys(minhash(normalized)),
+    }
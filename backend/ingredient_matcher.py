@@ -0,0 +1,232 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Pattern, Tuple
+
+
+class KeywordMatch(NamedTuple):
+    group: str
+    keyword: str
+    start: int
+    end: int
+
+
+SEPARATOR = r"[\s-]+"
+NEGATION_PATTERN = re.compile(r"[\s-]*(?:free|frei)(?!\w)")
+PLURAL = r"(?:e?s)?"
+TOKEN_CACHE_LIMIT = 50000
+
+
+def lower_preserving_offsets(text: str) -> str:
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    # A few characters ("İ") grow when lowercased; leave those as-is so positions stay valid
+    return "".join(char if len(char.lower()) != 1 else char.lower() for char in text)
+
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """Regex alternation factored by common prefixes, so the engine never retries a shared stem"""
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        optional = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if optional else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Token-level multi-keyword matcher, built once per keyword table.
+
+    Keywords match whole tokens only (so "nut" does not hit "nutmeg" or "coconut"),
+    with an optional plural suffix on the last word. A trailing "*" matches a token
+    prefix instead, for compounding languages ("weizen*" -> "Weizenmehl"). Words of
+    a phrase may be separated by any run of whitespace/hyphens. Neutral phrases are
+    matched and discarded, which stops e.g. "cocoa butter" from counting as dairy,
+    and a keyword directly followed by "free"/"frei" is ignored.
+
+    A regex built from a character trie of every keyword's first word finds the
+    candidate tokens in one C-level scan; each distinct candidate token is then
+    classified once (memoized) against the exact keyword tables. Results are
+    memoized per text too, since hot products are re-checked on every request.
+    """
+
+    def __init__(self, groups: Dict[str, Iterable[str]], neutral: Iterable[str] = (), cache_size: int = 4096):
+        entries: Dict[str, Optional[str]] = {}
+        for phrase in neutral:
+            entries[phrase.lower()] = None
+        for group, keywords in groups.items():
+            for keyword in keywords:
+                entries.setdefault(keyword.lower(), group)
+
+        self._words: Dict[str, Optional[str]] = {}
+        self._prefixes: Dict[str, Optional[str]] = {}
+        # first word -> [(regex for the remaining words, group, word count)]
+        self._phrases: Dict[str, List[Tuple[Pattern, Optional[str], int]]] = {}
+        for phrase, group in entries.items():
+            words = re.split(SEPARATOR, phrase.rstrip("*"))
+            if phrase.endswith("*"):
+                self._prefixes[words[0]] = group
+            elif len(words) == 1:
+                self._words[words[0]] = group
+            else:
+                tail = "".join(SEPARATOR + re.escape(word) for word in words[1:])
+                self._phrases.setdefault(words[0], []).append(
+                    (re.compile(tail + PLURAL + r"(?!\w)"), group, len(words))
+                )
+        for candidates in self._phrases.values():
+            candidates.sort(key=lambda c: c[2], reverse=True)
+        self._prefix_lengths = sorted({len(p) for p in self._prefixes}, reverse=True)
+        self._token_cache: Dict[str, list] = {}
+        heads = set(self._words) | set(self._prefixes) | set(self._phrases)
+        self._scanner = re.compile(rf"(?<!\w){trie_pattern(heads)}\w*")
+        self.find_all = lru_cache(maxsize=cache_size)(self._find_all)
+
+    def _candidates(self, token: str) -> list:
+        """[(tail regex or None, group)] that may start at this token, longest first"""
+        cached = self._token_cache.get(token)
+        if cached is not None:
+            return cached
+
+        candidates = [(tail, group) for tail, group, _ in self._phrases.get(token, ())]
+        forms = (token, token[:-1], token[:-2]) if token.endswith("es") else \
+            (token, token[:-1]) if token.endswith("s") else (token,)
+        for form in forms:
+            if form in self._words:
+                candidates.append((None, self._words[form]))
+                break
+        else:
+            if not token.endswith(("free", "frei")):
+                for length in self._prefix_lengths:
+                    if token[:length] in self._prefixes:
+                        candidates.append((None, self._prefixes[token[:length]]))
+                        break
+
+        if len(self._token_cache) >= TOKEN_CACHE_LIMIT:
+            self._token_cache.clear()
+        self._token_cache[token] = candidates
+        return candidates
+
+    def _find_all(self, text: str) -> Tuple[KeywordMatch, ...]:
+        """Every keyword occurrence, with its position, in one left-to-right pass"""
+        text = lower_preserving_offsets(text or "")
+        matches = []
+        resume_at = 0
+        for token in self._scanner.finditer(text):
+            if token.start() < resume_at:
+                continue
+            for tail, group in self._candidates(token.group()):
+                end = token.end()
+                if tail is not None:
+                    rest = tail.match(text, end)
+                    if rest is None:
+                        continue
+                    end = rest.end()
+                negation = NEGATION_PATTERN.match(text, end)
+                if negation is not None:
+                    resume_at = negation.end()
+                else:
+                    resume_at = end
+                    if group is not None:
+                        matches.append(KeywordMatch(group, text[token.start():end], token.start(), end))
+                break
+        return tuple(matches)
+
+    def groups_in(self, text: str) -> Dict[str, List[KeywordMatch]]:
+        found: Dict[str, List[KeywordMatch]] = {}
+        for match in self.find_all(text):
+            found.setdefault(match.group, []).append(match)
+        return found
+
+
+# ============== KEYWORD TABLES ==============
+# English first, then French, German, Spanish and Italian synonyms
+ALLERGEN_KEYWORDS = {
+    "nuts": [
+        "nut", "almond", "cashew", "walnut", "pecan", "pistachio", "hazelnut", "macadamia", "peanut",
+        "peanut butter", "almond milk", "praline",
+        "noix", "amande", "noisette", "pistache", "cajou", "arachide", "cacahuète",
+        "nuss", "nüsse", "mandel*", "haselnuss*", "haselnüss*", "walnuss*", "walnüss*", "erdnuss*", "erdnüss*",
+        "nuez", "nueces", "almendra", "avellana", "pistacho", "anacardo", "cacahuete", "maní",
+        "noce", "noci", "mandorla", "mandorle", "nocciola", "nocciole", "pistacchio", "arachidi",
+    ],
+    "dairy": [
+        "milk", "cream", "cheese", "butter", "buttermilk", "lactose", "whey", "casein", "caseinate",
+        "yogurt", "yoghurt", "ghee",
+        "lait", "crème", "fromage", "beurre", "lactosérum", "petit-lait",
+        "milch*", "vollmilch*", "magermilch*", "sahne", "käse", "molke*", "joghurt", "laktose",
+        "leche", "nata", "queso", "mantequilla", "lactosa",
+        "latte", "panna", "formaggio", "burro", "siero di latte", "lattosio",
+    ],
+    "gluten": [
+        "wheat", "gluten", "barley", "rye", "oat", "oatmeal", "semolina", "spelt", "malt", "durum", "triticale",
+        "oat milk",
+        "blé", "orge", "seigle", "avoine", "épeautre", "semoule",
+        "weizen*", "gerste*", "roggen*", "hafer*", "dinkel*",
+        "trigo", "cebada", "centeno", "avena", "espelta", "sémola",
+        "frumento", "orzo", "segale", "farro", "semola", "glutine",
+    ],
+    "soy": [
+        "soy", "soya", "soybean", "lecithin", "soy milk",
+        "lécithine", "soja*", "lecitina", "soia",
+    ],
+    "eggs": [
+        "egg", "albumin", "albumen", "ovalbumin", "lysozyme",
+        "oeuf", "œuf",
+        "eier", "eigelb", "vollei*",
+        "huevo", "yema",
+        "uovo", "uova", "tuorlo",
+    ],
+    "shellfish": [
+        "shrimp", "crab", "lobster", "shellfish", "prawn", "crawfish", "crayfish", "krill",
+        "crevette", "crabe", "homard", "langoustine",
+        "garnele*", "krabbe*", "hummer", "krebs*",
+        "gamba", "camarón", "cangrejo", "langosta",
+        "gambero", "gamberi", "granchio", "aragosta",
+    ],
+}
+
+ALLERGEN_NEUTRAL_PHRASES = [
+    "cocoa butter", "shea butter", "coconut milk", "coconut cream", "rice milk", "cream of tartar",
+    "sunflower lecithin", "buckwheat",
+    "beurre de cacao", "lait de coco", "noix de coco", "sans gluten", "lécithine de tournesol",
+    "kakaobutter",
+    "manteca de cacao", "nuez de coco", "nata de coco", "sin gluten", "lecitina de girasol",
+    "burro di cacao", "noce di cocco", "senza glutine", "lecitina di girasole",
+]
+
+FOOD_TYPE_KEYWORDS = {
+    "non-veg": [
+        "meat", "chicken", "beef", "pork", "fish", "fish sauce", "seafood", "mutton", "lamb", "bacon", "ham",
+        "turkey", "duck", "gelatin", "gelatine", "lard", "anchovy", "anchovies", "tuna", "salmon",
+        "viande", "poulet", "boeuf", "bœuf", "porc", "poisson", "jambon", "gélatine", "anchois", "canard",
+        "dinde", "agneau",
+        # Not "rind*": English "lemon rind" and "cheese (rind removed)" are not beef
+        "fleisch*", "huhn", "hähnchen*", "rindfleisch*", "rinder*", "schwein*", "fisch*", "schinken", "speck",
+        "sardellen", "ente", "pute", "lamm*",
+        "carne", "pollo", "cerdo", "pescado", "jamón", "tocino", "gelatina", "anchoas", "pato", "pavo",
+        "cordero",
+        "manzo", "maiale", "pesce", "prosciutto", "pancetta", "acciughe", "anatra", "tacchino", "agnello",
+    ],
+    "egg": [
+        "egg", "albumin", "albumen", "lysozyme", "mayonnaise", "meringue",
+        "oeuf", "œuf", "eier", "eigelb", "vollei*", "huevo", "uovo", "uova",
+    ],
+    "veg": ["vegan", "vegetarian", "végétarien", "végétalien", "vegetarisch", "vegetariano"],
+}
+
+FOOD_TYPE_NEUTRAL_PHRASES = [
+    "meat alternative", "meat substitute", "meat analogue", "meat analog",
+]
+
+ALLERGEN_MATCHER = KeywordMatcher(ALLERGEN_KEYWORDS, ALLERGEN_NEUTRAL_PHRASES)
+FOOD_TYPE_MATCHER = KeywordMatcher(FOOD_TYPE_KEYWORDS, FOOD_TYPE_NEUTRAL_PHRASES)
@@ -0,0 +1,41 @@
+"""Process queued analysis jobs outside the API processes.
+
+Usage (from backend/, with the same .env as the server):
+    python job_worker.py --workers 4
+
+Each worker leases one job at a time from db.analysis_jobs, most urgent first, so the
+pool's LLM concurrency is the total worker count across processes. Set JOB_WORKERS=0
+on the API servers when the pool runs here. On Ctrl-C / SIGTERM, running jobs go back
+to the queue; jobs of a worker that crashed are retried once their lease lapses.
+"""
+import argparse
+import asyncio
+import signal
+import sys
+
+import server
+
+
+async def main(args):
+    await server.ensure_indexes()
+    workers = server.start_job_workers(args.workers)
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    print(f"{args.workers} job workers running as {server.WORKER_ID}", file=sys.stderr)
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        await server.stop_job_workers()
+        await server.get_off_client().aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="jobs processed at once by this process")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.client.close()
@@ -0,0 +1,249 @@
+"""Prometheus metrics, Server-Timing and a sampling profiler, with no client library or collector.
+
+Counters, gauges and histograms live in process memory and are rendered in the
+Prometheus text format (0.0.4) on demand; a function-backed metric reads its
+values (cache sizes, breaker stats) at scrape time instead. record_timing() adds
+to the Server-Timing header of the current request, which MetricsMiddleware
+sends along with the request latency it records. SamplingProfiler collects
+stacks of one thread for a bounded window, in the collapsed format that
+flamegraph tools read.
+"""
+import asyncio
+import bisect
+import contextvars
+import math
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from typing import Callable, Dict, List, Optional, Tuple
+
+# (name, seconds) of the stages run for the current request; None outside requests
+request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = \
+    contextvars.ContextVar("request_timings", default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 function: Optional[Callable[[], object]] = None, registry: Registry = REGISTRY):
+        """function, if given, returns the current value (or {label values tuple: value}) at scrape time"""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.values: Dict[tuple, float] = {}
+        registry.register(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def current(self) -> Dict[tuple, float]:
+        if self.function is None:
+            return dict(self.values)
+        value = self.function()
+        return value if isinstance(value, dict) else {(): value}
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+            for key, value in sorted(self.current().items())
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry=registry)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self.series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = format_labels(self.labelnames, key, f'le="{format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def record_timing(name: str, seconds: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    # Repeated stages (e.g. one allergen check per compared product) are summed
+    totals: Dict[str, float] = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency histogram, in-progress gauge and a Server-Timing header.
+
+    The header is sent with the response start, so it covers the stages finished by
+    then (for a stream, only those before the first byte).
+    """
+
+    def __init__(self, app, duration: Histogram, in_progress: Gauge, route_name: Callable[[dict], str]):
+        self.app = app
+        self.duration = duration
+        self.in_progress = in_progress
+        self.route_name = route_name
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing_header([*timings, ("total", time.perf_counter() - started)])
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode("latin-1"))]}
+            await send(message)
+
+        self.in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            self.in_progress.dec()
+            request_timings.reset(token)
+            self.duration.observe(time.perf_counter() - started, method=scope["method"],
+                                  route=self.route_name(scope), status=status)
+
+
+async def monitor_event_loop_lag(gauge: Gauge, histogram: Histogram, interval: float = 0.5):
+    """How late the loop wakes a sleeping task: time other tasks spent holding it"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        gauge.set(lag)
+        histogram.observe(lag)
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack from a background thread; one profile at a time"""
+
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.lock = threading.Lock()
+
+    def sample(self, seconds: float, interval: float = 0.005) -> StackCounter:
+        """Blocking: run it off the sampled thread. Raises RuntimeError if a profile is already running"""
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            stacks = StackCounter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None:
+                    stacks[self.collapse(frame)] += 1
+                time.sleep(interval)
+            return stacks
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            module = frame.f_globals.get("__name__", "?")
+            names.append(f"{module}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    @staticmethod
+    def render(stacks: StackCounter) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
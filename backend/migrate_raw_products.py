@@ -0,0 +1,95 @@
+"""Move embedded raw_product_data out of db.analyses into compressed db.raw_products.
+
+Usage (from backend/, with the same .env as the server):
+    python migrate_raw_products.py --dry-run   # only report the size / decode-time savings
+    python migrate_raw_products.py             # migrate in batches; safe to re-run
+
+Analyses keep the small summary (ingredients text, NOVA group) that allergen checks
+and chat read on every request; the full payload is served by /api/analysis/{barcode}/raw.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import bson
+from pymongo import UpdateOne
+
+from server import client, compress_raw_product, db, ensure_indexes, raw_product_summary, raw_product_update
+
+# Only documents still carrying the full payload need migrating
+LEGACY_FILTER = {"$or": [
+    {"raw_product_data.nutriments": {"$exists": True}},
+    {"raw_product_data.ingredients_list": {"$exists": True}},
+]}
+
+
+def decode_seconds(encoded: bytes, rounds: int = 200) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        bson.decode(encoded)
+    return (time.perf_counter() - started) / rounds
+
+
+def slimmed(doc: dict) -> dict:
+    return {**doc, "raw_product_data": raw_product_summary(doc["raw_product_data"])}
+
+
+async def report(sample_size: int):
+    sample = await db.analyses.find(LEGACY_FILTER).limit(sample_size).to_list(sample_size)
+    if not sample:
+        print("No analyses with embedded raw product data")
+        return
+    before = [bson.encode(doc) for doc in sample]
+    after = [bson.encode(slimmed(doc)) for doc in sample]
+    raw = [compress_raw_product(doc["raw_product_data"])["data"] for doc in sample]
+    size = lambda docs: sum(len(d) for d in docs) / len(docs)  # noqa: E731
+    decode = lambda docs: sum(decode_seconds(d) for d in docs) / len(docs) * 1e6  # noqa: E731
+    legacy = await db.analyses.count_documents(LEGACY_FILTER)
+    print(f"analyses to migrate:   {legacy}")
+    print(f"avg analysis size:     {size(before):.0f} B -> {size(after):.0f} B")
+    print(f"avg BSON decode:       {decode(before):.1f} us -> {decode(after):.1f} us")
+    print(f"avg compressed raw:    {size(raw):.0f} B (stored in raw_products)")
+    print(f"est. analyses shrink:  {(size(before) - size(after)) * legacy / 1e6:.1f} MB")
+
+
+async def migrate(batch_size: int) -> int:
+    migrated = 0
+    while True:
+        docs = await db.analyses.find(LEGACY_FILTER, {"_id": 1, "barcode": 1, "raw_product_data": 1}) \
+            .limit(batch_size).to_list(batch_size)
+        if not docs:
+            return migrated
+        # Raw payloads first: an interrupted run leaves analyses untouched, never payload-less
+        await db.raw_products.bulk_write(
+            [raw_product_update(doc["barcode"], doc["raw_product_data"]) for doc in docs], ordered=False
+        )
+        await db.analyses.bulk_write([
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"raw_product_data": raw_product_summary(doc["raw_product_data"])}})
+            for doc in docs
+        ], ordered=False)
+        migrated += len(docs)
+        print(f"\rmigrated {migrated}", end="", file=sys.stderr, flush=True)
+
+
+async def main(args) -> int:
+    await report(args.sample)
+    if args.dry_run:
+        return 0
+    await ensure_indexes()
+    migrated = await migrate(args.batch_size)
+    print(file=sys.stderr)
+    print(f"Migrated {migrated} analyses")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="report the expected savings without writing")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--sample", type=int, default=200, help="documents sampled for the size report")
+    args = parser.parse_args()
+    try:
+        sys.exit(asyncio.run(main(args)))
+    finally:
+        client.close()
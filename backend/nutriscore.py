@@ -0,0 +1,205 @@
+"""Nutri-Score computed from Open Food Facts nutriments (2017 algorithm).
+
+Implements the published scoring for general foods and its three variants:
+cheese (protein always counts), added fats (saturated fat is scored as a share
+of total fat) and beverages (own energy/sugar/fruit tables and grade bands;
+plain water is always A). Scoring works on NumPy arrays, so a whole catalogue
+is scored in one call; score_product() is the single-product wrapper.
+"""
+import math
+import re
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+GENERAL, CHEESE, FAT, BEVERAGE, WATER = range(5)
+KIND_NAMES = ("general", "cheese", "fat", "beverage", "water")
+
+# Points = number of thresholds the value strictly exceeds
+ENERGY_KJ = np.array([335, 670, 1005, 1340, 1675, 2010, 2345, 2680, 3015, 3350], dtype=float)
+SUGARS = np.array([4.5, 9, 13.5, 18, 22.5, 27, 31, 36, 40, 45])
+SATURATED_FAT = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], dtype=float)
+SODIUM_MG = np.array([90, 180, 270, 360, 450, 540, 630, 720, 810, 900], dtype=float)
+FIBER = np.array([0.9, 1.9, 2.8, 3.7, 4.7])
+PROTEIN = np.array([1.6, 3.2, 4.8, 6.4, 8.0])
+# Added fats: saturated fat / total fat, in percent (points = thresholds reached)
+SATURATED_RATIO = np.array([10, 16, 22, 28, 34, 40, 46, 52, 58, 64], dtype=float)
+BEVERAGE_ENERGY_KJ = np.array([0, 30, 60, 90, 120, 150, 180, 210, 240, 270], dtype=float)
+BEVERAGE_SUGARS = np.array([0, 1.5, 3, 4.5, 6, 7.5, 9, 10.5, 12, 13.5])
+
+# Fruit, vegetable, legume and nut share: (lower bound %, points), general then beverages
+FRUIT_POINTS = ((40, 1), (60, 2), (80, 5))
+BEVERAGE_FRUIT_POINTS = ((40, 2), (60, 4), (80, 10))
+
+# Highest score of each grade A..D; anything above the last bound is E
+GENERAL_GRADE_BOUNDS = np.array([-1, 2, 10, 18])
+BEVERAGE_GRADE_BOUNDS = np.array([-np.inf, 1, 5, 9])
+GRADES = np.array(["A", "B", "C", "D", "E"])
+GRADE_TO_SCORE_OUT_OF_5 = {"A": "5", "B": "4", "C": "3", "D": "2", "E": "1"}
+
+# OFF category tags deciding the variant. Products carry every parent tag too, so an
+# olive oil has en:olive-oils, en:vegetable-oils and en:fats. Matching whole tags keeps
+# en:plant-based-foods-and-beverages (bread, oats...) out of the beverages.
+WATER_TAGS = {"en:waters"}
+BEVERAGE_TAGS = {"en:beverages", "en:waters"}
+# Milk and dairy drinks are scored as general foods under the 2017 rules
+NON_BEVERAGE_TAGS = {"en:milks", "en:dairies", "en:dairy-drinks"}
+CHEESE_TAGS = {"en:cheeses"}
+FAT_TAGS = {"en:fats", "en:vegetable-oils", "en:butters", "en:margarines"}
+
+TAG_SEPARATORS = re.compile(r"[^a-z0-9]+")
+
+
+def category_tags(product: dict) -> Set[str]:
+    """The product's OFF category tags; from the English category names if it has no tags"""
+    tags = product.get("categories_tags")
+    if tags:
+        return {tag.strip().lower() for tag in tags if isinstance(tag, str)}
+    # "Beverages, Waters" -> en:beverages, en:waters (names in other languages match nothing)
+    names = (product.get("categories") or "").split(",")
+    return {"en:" + TAG_SEPARATORS.sub("-", name.lower()).strip("-") for name in names if name.strip()}
+
+
+def product_kind(product: dict) -> int:
+    """Which Nutri-Score variant applies: beverage or water, then cheese, then added fat, else general"""
+    tags = category_tags(product)
+    if tags & BEVERAGE_TAGS and not tags & NON_BEVERAGE_TAGS:
+        nutriments = product.get("nutriments") or {}
+        plain = not any(nutriments.get(k) for k in ("energy_100g", "energy-kj_100g", "energy-kcal_100g", "sugars_100g"))
+        return WATER if tags & WATER_TAGS and plain else BEVERAGE
+    if tags & CHEESE_TAGS:
+        return CHEESE
+    if tags & FAT_TAGS:
+        return FAT
+    return GENERAL
+
+
+def first_number(nutriments: dict, *keys) -> float:
+    for key in keys:
+        value = nutriments.get(key)
+        if value not in (None, ""):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                continue
+    return math.nan
+
+
+def nutrient_columns(products: List[dict]) -> Dict[str, np.ndarray]:
+    """One float array per Nutri-Score input (NaN when missing), in the products' order"""
+    rows = []
+    for product in products:
+        n = product.get("nutriments") or {}
+        kcal = first_number(n, "energy-kcal_100g")
+        energy = first_number(n, "energy-kj_100g", "energy_100g")
+        sodium_g = first_number(n, "sodium_100g")
+        salt = first_number(n, "salt_100g")
+        rows.append((
+            energy if not math.isnan(energy) else kcal * 4.184,
+            first_number(n, "sugars_100g"),
+            first_number(n, "saturated-fat_100g"),
+            first_number(n, "fat_100g"),
+            (sodium_g if not math.isnan(sodium_g) else salt / 2.5) * 1000,
+            first_number(n, "fruits-vegetables-nuts_100g", "fruits-vegetables-nuts-estimate_100g",
+                         "fruits-vegetables-nuts-estimate-from-ingredients_100g"),
+            first_number(n, "fiber_100g"),
+            first_number(n, "proteins_100g"),
+            product_kind(product),
+        ))
+    names = ("energy_kj", "sugars", "saturated_fat", "fat", "sodium_mg", "fruits", "fiber", "proteins", "kind")
+    table = np.array(rows, dtype=float).reshape(len(rows), len(names))
+    return {name: table[:, i] for i, name in enumerate(names)}
+
+
+def threshold_points(values: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    return np.searchsorted(thresholds, values, side="left")
+
+
+def fruit_points(fruits: np.ndarray, table) -> np.ndarray:
+    points = np.zeros(len(fruits), dtype=int)
+    for bound, value in table:
+        points[fruits > bound] = value
+    return points
+
+
+def compute(energy_kj, sugars, saturated_fat, fat, sodium_mg, fruits, fiber, proteins, kind) -> Dict[str, np.ndarray]:
+    """Vectorized Nutri-Score over equally long arrays (NaN = missing).
+
+    Energy, sugars, saturated fat and sodium are required; products missing one
+    get valid=False. Missing fibre, protein and fruit/vegetable values score 0.
+    """
+    kind = np.asarray(kind, dtype=int)
+    beverage = kind == BEVERAGE
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = np.where(fat > 0, saturated_fat / fat * 100, 0)
+
+    energy_points = np.where(beverage, threshold_points(energy_kj, BEVERAGE_ENERGY_KJ),
+                             threshold_points(energy_kj, ENERGY_KJ))
+    sugar_points = np.where(beverage, threshold_points(sugars, BEVERAGE_SUGARS), threshold_points(sugars, SUGARS))
+    fat_points = np.where(kind == FAT, np.searchsorted(SATURATED_RATIO, ratio, side="right"),
+                          threshold_points(saturated_fat, SATURATED_FAT))
+    sodium_points = threshold_points(sodium_mg, SODIUM_MG)
+    negative = energy_points + sugar_points + fat_points + sodium_points
+
+    fruits = np.nan_to_num(fruits)
+    fruit = np.where(beverage, fruit_points(fruits, BEVERAGE_FRUIT_POINTS), fruit_points(fruits, FRUIT_POINTS))
+    fiber_points = threshold_points(np.nan_to_num(fiber), FIBER)
+    protein_points = threshold_points(np.nan_to_num(proteins), PROTEIN)
+    # From 11 negative points protein stops counting, unless fruit/veg maxes out or it is cheese
+    protein_counts = (negative < 11) | (fruit >= 5) | (kind == CHEESE)
+    positive = fruit + fiber_points + np.where(protein_counts, protein_points, 0)
+    score = negative - positive
+
+    grade_index = np.where(beverage, np.searchsorted(BEVERAGE_GRADE_BOUNDS, score, side="left"),
+                           np.searchsorted(GENERAL_GRADE_BOUNDS, score, side="left"))
+    grade_index = np.where(kind == WATER, 0, grade_index)
+    valid = ~(np.isnan(energy_kj) | np.isnan(sugars) | np.isnan(saturated_fat) | np.isnan(sodium_mg))
+    valid |= kind == WATER
+    if (kind == FAT).any():
+        valid &= ~((kind == FAT) & np.isnan(fat))
+    return {
+        "score": score, "grade": GRADES[grade_index], "valid": valid,
+        "negative": negative, "positive": positive,
+        "energy": energy_points, "sugars": sugar_points, "saturated_fat": fat_points, "sodium": sodium_points,
+        "fruits": fruit, "fiber": fiber_points, "proteins": np.where(protein_counts, protein_points, 0),
+    }
+
+
+def justification(r: Dict[str, list], i: int, kind: int) -> str:
+    if kind == WATER:
+        return "Plain water is always graded A by the Nutri-Score."
+    return (
+        f"Computed from the nutrition facts with the Nutri-Score algorithm ({KIND_NAMES[kind]} rules): "
+        f"{r['negative'][i]} unfavourable points (energy {r['energy'][i]}, sugars {r['sugars'][i]}, "
+        f"saturated fat {r['saturated_fat'][i]}, sodium {r['sodium'][i]}) minus {r['positive'][i]} favourable "
+        f"points (fruit/vegetables {r['fruits'][i]}, fibre {r['fiber'][i]}, protein {r['proteins'][i]}) "
+        f"give a score of {r['score'][i]}, grade {r['grade'][i]}."
+    )
+
+
+def score_products(products: List[dict]) -> List[Optional[dict]]:
+    """Nutri-Score of each OFF product (None when its nutriments are insufficient)"""
+    if not products:
+        return []
+    columns = nutrient_columns(products)
+    # Plain lists: per-item indexing of NumPy arrays would dominate the loop below
+    result = {key: value.tolist() for key, value in compute(**columns).items()}
+    scored = []
+    for i, kind in enumerate(columns["kind"].astype(int).tolist()):
+        if not result["valid"][i]:
+            scored.append(None)
+            continue
+        grade = result["grade"][i]
+        scored.append({
+            "grade": grade,
+            "score_out_of_5": GRADE_TO_SCORE_OUT_OF_5[grade],
+            "points": None if kind == WATER else result["score"][i],
+            "variant": KIND_NAMES[kind],
+            "justification": justification(result, i, kind),
+            "source": "computed",
+        })
+    return scored
+
+
+def score_product(product: dict) -> Optional[dict]:
+    return score_products([product])[0]
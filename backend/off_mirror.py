@@ -0,0 +1,295 @@
+"""Local Open Food Facts mirror: a compact SQLite store keyed by barcode.
+
+Only the product fields the analysis pipeline reads are kept, as zlib-compressed
+JSON, so a full OFF dump fits in a few GB and a lookup is one primary-key probe.
+
+Usage (from backend/):
+    python off_mirror.py import products.jsonl.gz      # full OFF JSONL dump (or .csv / .csv.gz)
+    python off_mirror.py delta deltas/                 # apply OFF delta files not applied yet
+    python off_mirror.py get 3017620422003             # print one product
+    python off_mirror.py stats
+
+The database path comes from --db or OFF_MIRROR_PATH.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# Product keys read by analyze_product / detect_food_type; also the OFF API `fields=`
+PRODUCT_FIELDS = (
+    "product_name", "brands", "quantity", "ingredients_text", "ingredients",
+    "nutriments", "categories", "categories_tags", "labels", "nutriscore_grade", "nova_group",
+)
+# Per-ingredient keys kept from the structured ingredient list
+INGREDIENT_KEYS = ("id", "text", "percent", "percent_estimate", "vegan", "vegetarian")
+NUMERIC_CSV_FIELDS = ("nova_group",)
+# Comma-separated in the CSV export, lists in the JSON API
+LIST_CSV_FIELDS = ("categories_tags",)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    code TEXT PRIMARY KEY,
+    last_modified INTEGER NOT NULL DEFAULT 0,
+    source TEXT NOT NULL,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# A newer (or equally new) copy wins, so re-applying a delta or a stale dump is harmless
+UPSERT = """
+INSERT INTO products (code, last_modified, source, data) VALUES (?, ?, ?, ?)
+ON CONFLICT(code) DO UPDATE SET
+    last_modified = excluded.last_modified, source = excluded.source, data = excluded.data
+WHERE excluded.last_modified >= products.last_modified
+"""
+
+
+def compact_product(product: dict) -> dict:
+    """Keep only the fields we use, trimming nutriments to per-100g values"""
+    compact = {}
+    for key in PRODUCT_FIELDS:
+        value = product.get(key)
+        if value in (None, "", [], {}):
+            continue
+        if key == "nutriments":
+            value = {k: v for k, v in value.items() if k.endswith("_100g") and v not in (None, "")}
+        elif key == "ingredients":
+            value = [{k: i[k] for k in INGREDIENT_KEYS if k in i} for i in value if isinstance(i, dict)]
+        compact[key] = value
+    return compact
+
+
+def encode_product(product: dict) -> bytes:
+    return zlib.compress(json.dumps(product, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def decode_product(data: bytes) -> dict:
+    return json.loads(zlib.decompress(data))
+
+
+def open_text(path: Path):
+    if path.suffix == ".gz":
+        return io.TextIOWrapper(gzip.open(path), encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def read_jsonl(path: Path) -> Iterator[dict]:
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def csv_number(value: str):
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def read_csv(path: Path) -> Iterator[dict]:
+    """The tab-separated OFF CSV export; nutriments come from its *_100g columns"""
+    csv.field_size_limit(sys.maxsize)
+    with open_text(path) as f:
+        for row in csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            product = {key: row[key] for key in PRODUCT_FIELDS if row.get(key)}
+            for key in NUMERIC_CSV_FIELDS:
+                if key in product:
+                    product[key] = csv_number(product[key])
+            for key in LIST_CSV_FIELDS:
+                if key in product:
+                    product[key] = [tag for tag in product[key].split(",") if tag]
+            product["nutriments"] = {
+                key: number for key, value in row.items()
+                if key and key.endswith("_100g") and value and (number := csv_number(value)) is not None
+            }
+            product["code"] = row.get("code")
+            product["last_modified_t"] = row.get("last_modified_t")
+            yield product
+
+
+def read_products(path: Path) -> Iterator[dict]:
+    name = path.name.lower()
+    if name.endswith((".csv", ".csv.gz", ".tsv", ".tsv.gz")):
+        return read_csv(path)
+    return read_jsonl(path)
+
+
+class ProductMirror:
+    """SQLite-backed barcode -> product store.
+
+    Reads go through one connection meant for the event-loop thread; writes
+    (API write-backs, imports) take a separate, lock-guarded connection so they
+    can run in worker threads. WAL mode lets readers proceed during a write.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._reader = self._connect()
+        self._write_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, code: str) -> Optional[dict]:
+        row = self._reader.execute("SELECT data FROM products WHERE code = ?", (code,)).fetchone()
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return decode_product(row[0])
+
+    def put(self, code: str, product: dict, source: str = "api") -> bool:
+        """Store one product (e.g. a live API response); False if a newer copy is already stored"""
+        last_modified = int(product.get("last_modified_t") or time.time())
+        with self._write_lock:
+            cursor = self._writer.execute(UPSERT, (code, last_modified, source, encode_product(compact_product(product))))
+        self.stats["writes"] += 1
+        return cursor.rowcount > 0
+
+    def import_file(self, path: str, source: Optional[str] = None, batch_size: int = 5000,
+                    on_progress: Optional[Callable[[dict], None]] = None) -> dict:
+        """Upsert every product of an OFF JSONL/CSV dump or delta file, in large transactions"""
+        path = Path(path)
+        source = source or path.name
+        result = {"file": path.name, "read": 0, "written": 0, "skipped": 0}
+        started = time.perf_counter()
+
+        def flush(rows: List[Tuple]):
+            with self._write_lock:
+                self._writer.execute("BEGIN")
+                before = self._writer.total_changes
+                self._writer.executemany(UPSERT, rows)
+                written = self._writer.total_changes - before
+                self._writer.execute("COMMIT")
+            result["written"] += written
+            result["skipped"] += len(rows) - written
+            if on_progress is not None:
+                on_progress(result)
+
+        rows = []
+        for product in read_products(path):
+            result["read"] += 1
+            code = str(product.get("code") or "").strip()
+            if not code:
+                result["skipped"] += 1
+                continue
+            try:
+                last_modified = int(float(product.get("last_modified_t") or 0))
+            except ValueError:
+                last_modified = 0
+            rows.append((code, last_modified, source, encode_product(compact_product(product))))
+            if len(rows) >= batch_size:
+                flush(rows)
+                rows = []
+        if rows:
+            flush(rows)
+
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        self.set_meta("last_import", json.dumps({**result, "at": int(time.time())}))
+        return result
+
+    def apply_deltas(self, directory: str, on_progress: Optional[Callable[[dict], None]] = None) -> List[dict]:
+        """Import the delta files in a directory that have not been applied yet, oldest name first"""
+        applied = set(json.loads(self.get_meta("applied_deltas") or "[]"))
+        results = []
+        for path in sorted(Path(directory).iterdir()):
+            if not path.is_file() or path.name in applied:
+                continue
+            results.append(self.import_file(str(path), source=f"delta:{path.name}", on_progress=on_progress))
+            applied.add(path.name)
+            self.set_meta("applied_deltas", json.dumps(sorted(applied)))
+        return results
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._reader.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._write_lock:
+            self._writer.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def describe(self) -> dict:
+        count, newest = self._reader.execute("SELECT COUNT(*), MAX(last_modified) FROM products").fetchone()
+        size = sum(p.stat().st_size for p in self.path.parent.glob(self.path.name + "*"))
+        return {
+            "path": str(self.path),
+            "products": count,
+            "newest_last_modified": newest,
+            "size_bytes": size,
+            "last_import": json.loads(self.get_meta("last_import") or "null"),
+            **self.stats,
+        }
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+
+
+def print_progress(result: dict):
+    print(f"\r{result['file']}: read={result['read']} written={result['written']} skipped={result['skipped']}",
+          end="", file=sys.stderr, flush=True)
+
+
+def main(args) -> int:
+    if not args.db:
+        print("Set OFF_MIRROR_PATH or pass --db", file=sys.stderr)
+        return 2
+    mirror = ProductMirror(args.db)
+    try:
+        if args.command == "import":
+            for path in args.paths:
+                result = mirror.import_file(path, on_progress=print_progress)
+                print(file=sys.stderr)
+                print(json.dumps(result))
+        elif args.command == "delta":
+            for result in mirror.apply_deltas(args.paths[0], on_progress=print_progress):
+                print(file=sys.stderr)
+                print(json.dumps(result))
+        elif args.command == "get":
+            product = mirror.get(args.paths[0])
+            if product is None:
+                print("Not in mirror", file=sys.stderr)
+                return 1
+            print(json.dumps(product, indent=2, ensure_ascii=False))
+        else:
+            print(json.dumps(mirror.describe(), indent=2))
+    finally:
+        mirror.close()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("import", "delta", "get", "stats"))
+    parser.add_argument("paths", nargs="*", help="dump files, a delta directory, or a barcode")
+    parser.add_argument("--db", default=os.environ.get("OFF_MIRROR_PATH"), help="mirror database path")
+    args = parser.parse_args()
+    if args.command != "stats" and not args.paths:
+        parser.error(f"{args.command} needs an argument")
+    sys.exit(main(args))
@@ -0,0 +1,210 @@
+"""Category-wide nutrient rankings over in-memory NumPy columns.
+
+Every analyzed product is a row of per-100g values (the nutrition facts shown on
+the analysis, plus Nutri-Score points) in one table per OFF category tag it
+carries; a product tagged en:breakfasts, en:cereals, en:corn-flakes is ranked
+among all breakfasts, all cereals and all corn flakes. Tags come straight from
+OFF, never from the LLM-translated category names, so grouping is stable. Rows are added, replaced or removed
+one product at a time, so the tables follow new analyses without rebuilding.
+
+Each column also keeps its rows in value order (rebuilt lazily after a write),
+so a percentile is a binary search and the products that beat one on a nutrient
+are a slice of that order. Neither touches the database.
+"""
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+NUTRIENTS = ("calories", "total_fat", "saturated_fat", "carbohydrates", "sugars", "fiber", "protein", "salt", "sodium")
+COLUMNS = NUTRIENTS + ("nutriscore_points",)
+COLUMN_INDEX = {name: i for i, name in enumerate(COLUMNS)}
+# Everything else is better when lower
+HIGHER_IS_BETTER = {"fiber", "protein"}
+UNITS = {"calories": "kcal", "sodium": "mg", "nutriscore_points": None}
+
+
+def category_key(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+def fact_slug(name: str) -> str:
+    return name.strip().lower().replace(" ", "_")
+
+
+def product_row(analysis: dict) -> Tuple[List[str], np.ndarray, dict]:
+    """(category keys, column values with NaN for missing, display info) of a stored analysis"""
+    values = np.full(len(COLUMNS), np.nan)
+    for fact in analysis.get("nutrition_facts") or []:
+        index = COLUMN_INDEX.get(fact_slug(fact.get("name", "")))
+        if index is not None:
+            try:
+                values[index] = float(fact.get("value"))
+            except (TypeError, ValueError):
+                pass
+    nutriscore = analysis.get("nutriscore") or {}
+    if isinstance(nutriscore.get("points"), (int, float)):
+        values[COLUMN_INDEX["nutriscore_points"]] = nutriscore["points"]
+
+    categories = list(dict.fromkeys(category_key(tag) for tag in analysis.get("categories_tags") or [] if tag.strip()))
+    summary = analysis.get("product_summary") or {}
+    info = {
+        "barcode": analysis["barcode"],
+        "name": summary.get("name", "Unknown"),
+        "brand": summary.get("brand", "Unknown"),
+        "nutriscore": nutriscore.get("grade", "N/A"),
+    }
+    return categories, values, info
+
+
+class CategoryTable:
+    """Rows of one category in a growable array; removal swaps the last row into the gap"""
+
+    def __init__(self):
+        self.values = np.empty((16, len(COLUMNS)))
+        self.size = 0
+        self.barcodes: List[str] = []
+        self.positions: Dict[str, int] = {}
+        # column -> (rows with a value in ascending value order, those values)
+        self.sorted_columns: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def upsert(self, barcode: str, values: np.ndarray):
+        position = self.positions.get(barcode)
+        if position is None:
+            if self.size == len(self.values):
+                self.values = np.concatenate([self.values, np.empty_like(self.values)])
+            position = self.positions[barcode] = self.size
+            self.barcodes.append(barcode)
+            self.size += 1
+        self.values[position] = values
+        self.sorted_columns.clear()
+
+    def remove(self, barcode: str):
+        position = self.positions.pop(barcode, None)
+        if position is None:
+            return
+        last = self.size - 1
+        if position != last:
+            moved = self.barcodes[last]
+            self.values[position] = self.values[last]
+            self.barcodes[position] = moved
+            self.positions[moved] = position
+        self.barcodes.pop()
+        self.size = last
+        self.sorted_columns.clear()
+
+    def column(self, index: int) -> np.ndarray:
+        return self.values[:self.size, index]
+
+    def sorted_column(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        cached = self.sorted_columns.get(index)
+        if cached is None:
+            values = self.column(index)
+            rows = np.flatnonzero(~np.isnan(values))
+            rows = rows[np.argsort(values[rows], kind="stable")]
+            cached = self.sorted_columns[index] = (rows, values[rows])
+        return cached
+
+
+class CategoryRanking:
+    def __init__(self, min_peers: int = 5):
+        self.min_peers = min_peers
+        self.tables: Dict[str, CategoryTable] = {}
+        # barcode -> (categories, values, info) as last added
+        self.products: Dict[str, Tuple[List[str], np.ndarray, dict]] = {}
+
+    def add(self, analysis: dict):
+        categories, values, info = product_row(analysis)
+        barcode = info["barcode"]
+        previous = self.products.get(barcode)
+        if previous is not None:
+            for category in set(previous[0]) - set(categories):
+                self._table_remove(category, barcode)
+        for category in categories:
+            self.tables.setdefault(category, CategoryTable()).upsert(barcode, values)
+        self.products[barcode] = (categories, values, info)
+
+    def remove(self, barcode: str):
+        previous = self.products.pop(barcode, None)
+        if previous is not None:
+            for category in previous[0]:
+                self._table_remove(category, barcode)
+
+    def _table_remove(self, category: str, barcode: str):
+        table = self.tables.get(category)
+        if table is not None:
+            table.remove(barcode)
+            if not table.size:
+                del self.tables[category]
+
+    def pick_category(self, barcode: str, category: Optional[str] = None) -> str:
+        """The requested category, else the most specific of the product's with enough peers"""
+        if barcode not in self.products:
+            raise KeyError(barcode)
+        categories = self.products[barcode][0]
+        if category is not None:
+            key = category_key(category)
+            if key not in categories:
+                raise ValueError(f"Product is not in category '{category}'")
+            return key
+        for key in reversed(categories):
+            if self.tables[key].size >= self.min_peers:
+                return key
+        raise ValueError(f"No category of this product has {self.min_peers} analyzed products yet")
+
+    def percentiles(self, barcode: str, category: Optional[str] = None) -> dict:
+        """Per nutrient: the product's value and the share of the category with a lower value"""
+        key = self.pick_category(barcode, category)
+        table = self.tables[key]
+        values = self.products[barcode][1]
+        result = {}
+        for name in COLUMNS:
+            index = COLUMN_INDEX[name]
+            value = values[index]
+            ranked = table.sorted_column(index)[1]
+            if math.isnan(value) or not len(ranked):
+                continue
+            below = np.searchsorted(ranked, value, side="left")
+            equal = np.searchsorted(ranked, value, side="right") - below
+            result[name] = {
+                "value": float(value),
+                "unit": UNITS.get(name, "g"),
+                # Ties count half, so a category of identical products sits at the 50th percentile
+                "percentile": round(float((below + equal / 2) / len(ranked) * 100), 1),
+                "category_median": float(ranked[(len(ranked) - 1) // 2] + ranked[len(ranked) // 2]) / 2,
+                "peers": int(len(ranked)),
+                "higher_is_better": name in HIGHER_IS_BETTER,
+            }
+        return {"barcode": barcode, "category": key, "products_in_category": table.size, "nutrients": result}
+
+    def alternatives(self, barcode: str, nutrient: str = "nutriscore_points", k: int = 5,
+                     category: Optional[str] = None) -> dict:
+        """Up to k products of the category that beat this one on a nutrient, best first"""
+        if nutrient not in COLUMN_INDEX:
+            raise ValueError(f"Unknown nutrient '{nutrient}'; use one of {', '.join(COLUMNS)}")
+        key = self.pick_category(barcode, category)
+        table = self.tables[key]
+        index = COLUMN_INDEX[nutrient]
+        rows, ranked = table.sorted_column(index)
+        own = self.products[barcode][1][index]
+        # Rows with a strictly better value; all rows with a value if this product has none
+        if nutrient in HIGHER_IS_BETTER:
+            start = 0 if math.isnan(own) else np.searchsorted(ranked, own, side="right")
+            better = rows[start:][::-1][:k]
+        else:
+            end = len(ranked) if math.isnan(own) else np.searchsorted(ranked, own, side="left")
+            better = rows[:min(end, k)]
+
+        return {
+            "barcode": barcode,
+            "category": key,
+            "nutrient": nutrient,
+            "value": None if math.isnan(own) else float(own),
+            "alternatives": [
+                {**self.products[table.barcodes[row]][2], "value": float(table.values[row, index])}
+                for row in better.tolist()
+            ],
+        }
+
+    def stats(self) -> dict:
+        return {"products": len(self.products), "categories": len(self.tables)}
@@ -0,0 +1,224 @@
+"""Deadlines, retries, circuit breakers and hedged calls for upstream services.
+
+A deadline is an absolute monotonic time in a context variable: set once per
+request (or per background analysis) and inherited by every task started from
+it, so each upstream call only gets the budget that is actually left. call()
+wraps one upstream operation with a breaker, bounded retries with full-jitter
+backoff and, optionally, a hedged second attempt. PriorityLimiter caps how many
+calls run at once, admitting the most urgent waiters first.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional, Tuple, Type
+
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """The request budget ran out before (or while) calling an upstream"""
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} circuit is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current deadline; None without one"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def set_deadline(seconds: float):
+    """Start a budget for the rest of this context (e.g. from a request dependency)"""
+    request_deadline.set(time.monotonic() + seconds)
+
+
+@contextmanager
+def deadline(seconds: float, inherit: bool = True):
+    """Budget for a block; with inherit, an outer deadline that ends sooner still wins"""
+    until = time.monotonic() + seconds
+    outer = request_deadline.get()
+    if inherit and outer is not None:
+        until = min(until, outer)
+    token = request_deadline.set(until)
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open probe -> closed.
+
+    After failure_threshold failures in a row calls fail fast for reset_timeout
+    seconds; then one probe call at a time is let through, and its outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return
+        self.stats["rejected"] += 1
+        retry_after = self.reset_timeout - (time.monotonic() - self.opened_at)
+        raise CircuitOpenError(self.name, max(retry_after, 0.0))
+
+    def record_success(self):
+        self.stats["successes"] += 1
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.stats["failures"] += 1
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.probing:
+                self.stats["opened"] += 1
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, **self.stats}
+
+
+class PriorityLimiter:
+    """Semaphore that hands free slots to the waiter with the lowest priority value, FIFO within one"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiters = []  # heap of (priority, sequence, future)
+        self.sequence = itertools.count()
+
+    async def acquire(self, priority: int = 0):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled: pass it on
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # The slot moves to the waiter, so active stays the same
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def snapshot(self) -> dict:
+        waiting = sum(1 for _, _, future in self.waiters if not future.done())
+        return {"limit": self.limit, "active": self.active, "waiting": waiting}
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Full jitter: uniform in [0, min(cap, base * 2^attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def hedged(make_call: Callable[[], Awaitable], hedge_after: float):
+    """Start a second identical call if the first has not finished after hedge_after seconds.
+
+    The first call to succeed wins and the other is cancelled; if both fail, the
+    last error is raised.
+    """
+    tasks = [asyncio.ensure_future(make_call())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            tasks.append(asyncio.ensure_future(make_call()))
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def call(operation: Callable[[], Awaitable], *, breaker: CircuitBreaker, timeout: float,
+               retries: int = 0, retry_on: Tuple[Type[BaseException], ...] = (), base_delay: float = 0.2,
+               max_delay: float = 2.0, hedge_after: Optional[float] = None):
+    """Run operation() under the breaker, per-attempt timeout and the current deadline.
+
+    Exceptions in retry_on (and timeouts) count as upstream failures: they trip the
+    breaker and are retried with jittered backoff while attempts and budget remain.
+    Anything else (e.g. a 404) passes straight through without touching the breaker.
+    """
+    attempt = 0
+    while True:
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded(f"{breaker.name}: request deadline exceeded")
+        budget = timeout if left is None else min(timeout, left)
+        breaker.allow()
+
+        async def attempt_once():
+            return await asyncio.wait_for(operation(), budget)
+
+        try:
+            if hedge_after is not None and hedge_after < budget:
+                result = await hedged(attempt_once, hedge_after)
+            else:
+                result = await attempt_once()
+        except (asyncio.TimeoutError, *retry_on) as e:
+            if isinstance(e, asyncio.TimeoutError) and budget < timeout:
+                # Cut short by the caller's deadline, which says nothing about upstream health
+                breaker.probing = False
+            else:
+                breaker.record_failure()
+            left = remaining()
+            delay = backoff(attempt, base_delay, max_delay)
+            if attempt >= retries or (left is not None and left <= delay):
+                if isinstance(e, asyncio.TimeoutError) and left is not None and left <= 0:
+                    raise DeadlineExceeded(f"{breaker.name}: request deadline exceeded") from e
+                raise
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Not an upstream health problem (cancellation, 4xx, bad input): release a probe slot
+            breaker.probing = False
+            raise
+        breaker.record_success()
+        return result
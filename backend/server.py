@@ -1,20 +1,53 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from bson import ObjectId
+from cachetools import LRUCache, TTLCache
+import tiktoken
+try:
+    import zstandard
+except ImportError:  # optional; raw product payloads fall back to zlib
+    zstandard = None
+from ingredient_matcher import ALLERGEN_MATCHER, FOOD_TYPE_MATCHER
+from off_mirror import PRODUCT_FIELDS, ProductMirror
+from nutriscore import GRADE_TO_SCORE_OUT_OF_5, score_product
+from fingerprint import fingerprint as ingredient_fingerprint, minhash, normalize_ingredients, similarity
+from ranking import COLUMNS as RANKING_COLUMNS, CategoryRanking
+import metrics
+from metrics import Counter, Gauge, Histogram, MetricsMiddleware, SamplingProfiler
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, PriorityLimiter
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 import uuid
+import asyncio
+import anyio
+import socket
+import contextvars
+import threading
+from contextlib import contextmanager
+import time
 from datetime import datetime, timezone, timedelta
 import httpx
+import openai
 from openai import AsyncOpenAI
 import jwt
 import bcrypt
 import json
+import orjson
+import base64
+import zlib
+import hmac
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -26,9 +59,16 @@ db = client[os.environ['DB_NAME']]
 
 # OpenAI API Key
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# Per-attempt bound; also the client's read timeout, which caps stalls mid-stream
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '60'))
+# Any OpenAI-compatible endpoint (e.g. the fake one in benchmarks/fake_upstreams.py); unset = api.openai.com
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or None
+# Retries are done by the resilience layer (see UPSTREAM RESILIENCE), not the SDK
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, timeout=LLM_TIMEOUT_SECONDS, max_retries=0)
 JWT_SECRET = os.environ.get('JWT_SECRET', 'nutridive-secret-key-2025')
 JWT_ALGORITHM = "HS256"
+# Enables the /api/admin endpoints when set
+ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY', '')
 
 # Create the main app
 app = FastAPI()
@@ -134,15 +174,53 @@ class ScanHistory(BaseModel):
     food_type: str
     created_at: str
 
+class ScanHistoryPage(BaseModel):
+    items: List[ScanHistory]
+    next_cursor: Optional[str] = None
+
 class CompareRequest(BaseModel):
     barcodes: List[str]
 
+class BatchAnalyzeRequest(BaseModel):
+    barcodes: List[str] = []
+    # Products from an OFF export, keyed by "code"; these skip the OFF fetch
+    products: List[dict] = []
+
 # ============== AUTH HELPERS ==============
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+# bcrypt cost factor; stored hashes with another cost are rehashed on the next login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Hash/verify calls allowed to wait for a worker before /auth answers 503
+PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', '32'))
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed.encode())
+# bcrypt releases the GIL, so a small thread pool keeps the event loop free during a login storm
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+password_jobs = 0
+
+async def run_password_job(func: Callable, *args):
+    """Run a bcrypt call on the password executor, shedding load once its queue is full"""
+    global password_jobs
+    if password_jobs >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_LIMIT:
+        raise HTTPException(status_code=503, detail="Too many sign-ins, please retry", headers={"Retry-After": "1"})
+    password_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_jobs -= 1
+
+async def hash_password(password: str) -> str:
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return (await run_password_job(bcrypt.hashpw, password.encode(), salt)).decode()
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await run_password_job(bcrypt.checkpw, password.encode(), hashed.encode())
+
+def password_needs_rehash(hashed: str) -> bool:
+    # "$2b$12$<salt+hash>": the cost is the second field
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
 
 def create_token(user_id: str) -> str:
     payload = {
@@ -167,41 +245,252 @@ async def require_auth(credentials: HTTPAuthorizationCredentials = Depends(secur
         raise HTTPException(status_code=401, detail="Authentication required")
     return user
 
+async def require_admin(x_admin_key: Optional[str] = Header(None)):
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_key or not hmac.compare_digest(x_admin_key, ADMIN_API_KEY):
+        raise HTTPException(status_code=403, detail="Admin key required")
+
+# ============== METRICS ==============
+# Exported at /metrics in the Prometheus text format; see metrics.py
+EVENT_LOOP_LAG_INTERVAL = float(os.environ.get('EVENT_LOOP_LAG_INTERVAL', '0.5'))
+# Enables /api/admin/profile, which samples the event-loop thread's stacks
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_MAX_SECONDS = 60
+
+HTTP_REQUEST_SECONDS = Histogram("nutridive_http_request_duration_seconds", "API request latency",
+                                 ("method", "route", "status"))
+HTTP_IN_PROGRESS = Gauge("nutridive_http_requests_in_progress", "API requests being served")
+STAGE_SECONDS = Histogram("nutridive_stage_duration_seconds",
+                          "Time spent in each analysis stage (OFF fetch, LLM, parse, store, allergens...)", ("stage",))
+UPSTREAM_ERRORS = Counter("nutridive_upstream_errors_total",
+                          "Upstream failures surfaced to callers, after retries", ("upstream", "kind"))
+LLM_TOKENS = Counter("nutridive_llm_tokens_total", "Tokens spent per route", ("route", "type"))
+EVENT_LOOP_LAG = Gauge("nutridive_event_loop_lag_seconds", "Most recent event-loop lag sample")
+EVENT_LOOP_LAG_SECONDS = Histogram("nutridive_event_loop_lag_histogram_seconds", "Event-loop lag samples",
+                                   buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+Counter("nutridive_analysis_cache_requests_total", "Analysis cache lookups", ("result",),
+        function=lambda: {("hit",): analysis_cache_stats["hits"], ("miss",): analysis_cache_stats["misses"]})
+Gauge("nutridive_analysis_cache_hit_ratio", "Analysis cache hits / lookups since start",
+      function=lambda: analysis_cache_stats["hits"] / max(1, analysis_cache_stats["hits"] + analysis_cache_stats["misses"]))
+Gauge("nutridive_analysis_cache_entries", "Analyses held in this worker's cache", function=lambda: len(analysis_cache))
+Counter("nutridive_off_mirror_requests_total", "Open Food Facts mirror lookups", ("result",),
+        function=lambda: {} if off_mirror is None else
+        {("hit",): off_mirror.stats["hits"], ("miss",): off_mirror.stats["misses"]})
+Counter("nutridive_circuit_breaker_events_total", "Attempt outcomes, rejections and openings per upstream breaker",
+        ("upstream", "event"),
+        function=lambda: {(b.name, event): b.stats[event] for b in (off_breaker, llm_breaker) for event in b.stats})
+Gauge("nutridive_circuit_open", "1 while an upstream circuit is open or half-open", ("upstream",),
+      function=lambda: {(b.name,): int(b.state != "closed") for b in (off_breaker, llm_breaker)})
+Gauge("nutridive_inflight_analyses", "Analyses running in this worker", function=lambda: len(inflight_analyses))
+Gauge("nutridive_llm_slots", "Analysis completions running and waiting for a slot", ("state",),
+      function=lambda: {("active",): llm_slots.active, ("waiting",): llm_slots.snapshot()["waiting"]})
+Gauge("nutridive_password_jobs", "bcrypt calls running or queued", function=lambda: password_jobs)
+Gauge("nutridive_batch_jobs_running", "Batch jobs running in this worker", function=lambda: len(batch_tasks))
+Gauge("nutridive_ranking_products", "Analyzed products held in this worker's category rankings",
+      function=lambda: len(category_ranking.products))
+
+event_loop_lag_task: Optional[asyncio.Task] = None
+profiler: Optional[SamplingProfiler] = None
+
+@contextmanager
+def stage(name: str):
+    """Time a block into the stage histogram and the current request's Server-Timing header"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        metrics.record_timing(name, elapsed)
+
+route_templates: Dict[Callable, str] = {}
+
+def route_template(scope: dict) -> str:
+    # Label requests by path template, not raw path, to keep the series count bounded
+    if not route_templates:
+        route_templates.update({route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")})
+    return route_templates.get(scope.get("endpoint"), "unmatched")
+
+# ============== UPSTREAM RESILIENCE ==============
+# Budget of each API request, inherited by the upstream calls it makes; clients may ask
+# for less with an X-Request-Timeout header (seconds)
+REQUEST_BUDGET_SECONDS = float(os.environ.get('REQUEST_BUDGET_SECONDS', '60'))
+# Budget of a shared background analysis; keep it below ANALYSIS_LEASE_SECONDS
+ANALYSIS_BUDGET_SECONDS = float(os.environ.get('ANALYSIS_BUDGET_SECONDS', '80'))
+OFF_TIMEOUT_SECONDS = float(os.environ.get('OFF_TIMEOUT_SECONDS', '8'))
+OFF_RETRIES = int(os.environ.get('OFF_RETRIES', '2'))
+# Send a second OFF GET when the first is slower than this (0 disables hedging)
+OFF_HEDGE_AFTER_SECONDS = float(os.environ.get('OFF_HEDGE_AFTER_SECONDS', '0'))
+LLM_RETRIES = int(os.environ.get('LLM_RETRIES', '1'))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', '30'))
+
+# Analysis completions running at once in this process, shared by scans, compares,
+# batches and queued jobs; waiting analyses get a slot by priority (lower first). The
+# limit is per process: the deployment-wide cap is this times the number of API
+# workers plus job_worker.py processes.
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '8'))
+PRIORITY_INTERACTIVE, PRIORITY_COMPARE, PRIORITY_BATCH = 0, 10, 20
+
+off_breaker = CircuitBreaker("open_food_facts", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+llm_breaker = CircuitBreaker("openai", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+
+class OffUpstreamError(Exception):
+    """Open Food Facts answered 429/5xx: retryable, and counts against the breaker"""
+
+class LLMError(HTTPException):
+    """An analysis or chat failure caused by the LLM, as opposed to OFF or the database"""
+
+llm_slots = PriorityLimiter(LLM_CONCURRENCY)
+# Priority of the analyses started from the current context (inherited by their tasks)
+analysis_priority: contextvars.ContextVar[int] = contextvars.ContextVar("analysis_priority", default=PRIORITY_INTERACTIVE)
+
+LLM_RETRY_ON = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+async def request_budget(x_request_timeout: Optional[float] = Header(None)):
+    budget = REQUEST_BUDGET_SECONDS
+    if x_request_timeout and x_request_timeout > 0:
+        budget = min(budget, x_request_timeout)
+    resilience.set_deadline(budget)
+
+async def llm_completion(**kwargs):
+    """chat.completions.create under the LLM breaker, retries and the current deadline"""
+    return await resilience.call(
+        lambda: openai_client.chat.completions.create(model=LLM_MODEL, **kwargs),
+        breaker=llm_breaker, timeout=LLM_TIMEOUT_SECONDS, retries=LLM_RETRIES, retry_on=LLM_RETRY_ON
+    )
+
+def llm_error(e: Exception) -> LLMError:
+    if isinstance(e, CircuitOpenError):
+        UPSTREAM_ERRORS.inc(upstream="openai", kind="circuit_open")
+        return LLMError(status_code=503, detail="AI service temporarily unavailable",
+                        headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    if isinstance(e, (asyncio.TimeoutError, openai.APITimeoutError)):
+        UPSTREAM_ERRORS.inc(upstream="openai", kind="timeout")
+        return LLMError(status_code=504, detail="AI service timed out")
+    UPSTREAM_ERRORS.inc(upstream="openai", kind="error")
+    logger.error(f"LLM request failed: {str(e)}")
+    return LLMError(status_code=502, detail="AI service unavailable")
+
 # ============== OPEN FOOD FACTS ==============
+OFF_BASE_URL = os.environ.get('OFF_BASE_URL', 'https://world.openfoodfacts.org').rstrip('/')
+OFF_HTTP2 = os.environ.get('OFF_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+OFF_USER_AGENT = os.environ.get('OFF_USER_AGENT', 'NutriDive/1.0 (https://github.com/utsavagg2007/NutriDive-Project)')
+
+# Only the product keys read by analyze_product / detect_food_type are requested
+OFF_PRODUCT_FIELDS = PRODUCT_FIELDS
+# Local mirror consulted before the live API (see off_mirror.py); disabled when unset
+OFF_MIRROR_PATH = os.environ.get('OFF_MIRROR_PATH', '')
+OFF_MIRROR_WRITEBACK = os.environ.get('OFF_MIRROR_WRITEBACK', 'true').lower() in ('1', 'true', 'yes')
+# Never call the live API; a mirror miss is a 404 (offline runs and tests)
+OFF_MIRROR_ONLY = os.environ.get('OFF_MIRROR_ONLY', 'false').lower() in ('1', 'true', 'yes')
+
+off_client: Optional[httpx.AsyncClient] = None
+
+def create_off_client() -> httpx.AsyncClient:
+    """Build the shared, keep-alive Open Food Facts client"""
+    http2 = OFF_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("OFF_HTTP2 is set but the 'h2' package is not installed, falling back to HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        base_url=OFF_BASE_URL,
+        http2=http2,
+        headers={"User-Agent": OFF_USER_AGENT},
+        timeout=httpx.Timeout(
+            connect=float(os.environ.get('OFF_CONNECT_TIMEOUT', '5')),
+            read=float(os.environ.get('OFF_READ_TIMEOUT', '15')),
+            write=float(os.environ.get('OFF_WRITE_TIMEOUT', '5')),
+            pool=float(os.environ.get('OFF_POOL_TIMEOUT', '5')),
+        ),
+        limits=httpx.Limits(
+            max_connections=int(os.environ.get('OFF_MAX_CONNECTIONS', '20')),
+            max_keepalive_connections=int(os.environ.get('OFF_MAX_KEEPALIVE', '10')),
+            keepalive_expiry=float(os.environ.get('OFF_KEEPALIVE_EXPIRY', '30')),
+        ),
+    )
+
+def get_off_client() -> httpx.AsyncClient:
+    global off_client
+    if off_client is None or off_client.is_closed:
+        # Scripts that import the server without running the startup hook
+        off_client = create_off_client()
+    return off_client
+
+off_mirror: Optional[ProductMirror] = None
+
+def get_off_mirror() -> Optional[ProductMirror]:
+    global off_mirror
+    if off_mirror is None and OFF_MIRROR_PATH:
+        off_mirror = ProductMirror(OFF_MIRROR_PATH)
+    return off_mirror
+
 async def fetch_product_from_openfoodfacts(barcode: str) -> dict:
-    url = f"https://world.openfoodfacts.org/api/v2/product/{barcode}.json"
-    async with httpx.AsyncClient() as http_client:
-        response = await http_client.get(url, timeout=30.0)
-        if response.status_code != 200:
-            raise HTTPException(status_code=404, detail="Product not found")
-        data = response.json()
-        if data.get("status") != 1:
-            raise HTTPException(status_code=404, detail="Product not found in Open Food Facts database")
-        return data.get("product", {})
+    """Product from the local mirror if present, else from the live API (written back to the mirror)"""
+    mirror = get_off_mirror()
+    if mirror is not None:
+        with stage("off_mirror"):
+            product = mirror.get(barcode)
+        if product is not None:
+            return product
+        if OFF_MIRROR_ONLY:
+            raise HTTPException(status_code=404, detail="Product not found in the local Open Food Facts mirror")
+
+    with stage("off_api"):
+        product = await fetch_product_from_api(barcode)
+    if mirror is not None and OFF_MIRROR_WRITEBACK:
+        try:
+            await anyio.to_thread.run_sync(mirror.put, barcode, product)
+        except sqlite3.Error as e:
+            logger.error(f"Open Food Facts mirror write failed: {str(e)}")
+    return product
+
+async def fetch_product_from_api(barcode: str) -> dict:
+    async def get_product() -> httpx.Response:
+        response = await get_off_client().get(
+            f"/api/v2/product/{barcode}.json",
+            params={"fields": ",".join(OFF_PRODUCT_FIELDS)},
+        )
+        if response.status_code == 429 or response.status_code >= 500:
+            raise OffUpstreamError(f"HTTP {response.status_code}")
+        return response
+
+    try:
+        response = await resilience.call(
+            get_product, breaker=off_breaker, timeout=OFF_TIMEOUT_SECONDS, retries=OFF_RETRIES,
+            retry_on=(httpx.TransportError, OffUpstreamError), hedge_after=OFF_HEDGE_AFTER_SECONDS or None
+        )
+    except CircuitOpenError as e:
+        UPSTREAM_ERRORS.inc(upstream="open_food_facts", kind="circuit_open")
+        raise HTTPException(status_code=503, detail="Open Food Facts temporarily unavailable",
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        UPSTREAM_ERRORS.inc(upstream="open_food_facts", kind="timeout")
+        raise HTTPException(status_code=504, detail="Open Food Facts timed out")
+    except (httpx.HTTPError, OffUpstreamError) as e:
+        UPSTREAM_ERRORS.inc(upstream="open_food_facts", kind="error")
+        logger.error(f"Open Food Facts request failed: {str(e)}")
+        raise HTTPException(status_code=502, detail="Open Food Facts unavailable")
+    if response.status_code != 200:
+        raise HTTPException(status_code=404, detail="Product not found")
+    data = response.json()
+    if data.get("status") != 1:
+        raise HTTPException(status_code=404, detail="Product not found in Open Food Facts database")
+    return data.get("product", {})
 
 def detect_food_type(product: dict) -> str:
     """Detect if product is veg, non-veg, or egg-containing"""
-    ingredients_text = (product.get("ingredients_text", "") or "").lower()
-    categories = (product.get("categories", "") or "").lower()
-    labels = (product.get("labels", "") or "").lower()
-    
-    non_veg_keywords = ["meat", "chicken", "beef", "pork", "fish", "seafood", "mutton", "lamb", 
-                        "bacon", "ham", "turkey", "duck", "gelatin", "lard", "anchovies"]
-    egg_keywords = ["egg", "eggs", "albumin", "lysozyme", "mayonnaise", "meringue"]
-    
-    combined = f"{ingredients_text} {categories} {labels}"
-    
-    for keyword in non_veg_keywords:
-        if keyword in combined:
-            return "non-veg"
-    
-    for keyword in egg_keywords:
-        if keyword in combined:
-            return "egg"
-    
-    if "vegan" in combined or "vegetarian" in combined:
-        return "veg"
+    combined = " ".join((product.get(key, "") or "") for key in ("ingredients_text", "categories", "labels"))
+    found = FOOD_TYPE_MATCHER.groups_in(combined)
     
+    if "non-veg" in found:
+        return "non-veg"
+    if "egg" in found:
+        return "egg"
     return "veg"
 
 def extract_nutrition_facts(nutriments: dict) -> List[dict]:
@@ -228,33 +517,25 @@ def extract_nutrition_facts(nutriments: dict) -> List[dict]:
 
 def check_allergens(ingredients_text: str, user_allergens: List[str]) -> List[dict]:
     """Check for allergens in ingredients"""
-    warnings = []
-    ingredients_lower = (ingredients_text or "").lower()
-    
-    allergen_keywords = {
-        "nuts": ["nut", "almond", "cashew", "walnut", "pecan", "pistachio", "hazelnut", "macadamia"],
-        "dairy": ["milk", "cream", "cheese", "butter", "lactose", "whey", "casein", "yogurt"],
-        "gluten": ["wheat", "gluten", "barley", "rye", "oat", "semolina", "spelt"],
-        "soy": ["soy", "soya", "lecithin"],
-        "eggs": ["egg", "albumin", "lysozyme"],
-        "shellfish": ["shrimp", "crab", "lobster", "shellfish", "prawn", "crawfish"]
-    }
+    if not user_allergens:
+        return []
+    found = ALLERGEN_MATCHER.groups_in(ingredients_text)
     
+    warnings = []
     for allergen in user_allergens:
-        allergen_lower = allergen.lower()
-        if allergen_lower in allergen_keywords:
-            for keyword in allergen_keywords[allergen_lower]:
-                if keyword in ingredients_lower:
-                    warnings.append({
-                        "allergen": allergen,
-                        "found_in": [keyword],
-                        "severity": "high"
-                    })
-                    break
+        matches = found.get(allergen.lower())
+        if matches:
+            warnings.append({
+                "allergen": allergen,
+                "found_in": list(dict.fromkeys(m.keyword for m in matches)),
+                "severity": "high"
+            })
     
     return warnings
 
 # ============== GPT ANALYSIS ==============
+LLM_MODEL = "gpt-4.1-mini"
+
 ANALYSIS_SYSTEM_PROMPT = """You are a Food Product Ingredient & Health Impact Analyst AI.
 
 IMPORTANT RULES:
@@ -264,24 +545,14 @@ IMPORTANT RULES:
 4. Do NOT give medical advice or exaggerate risks
 5. Use neutral, scientific tone
 
-NutriScore Mapping (CRITICAL):
-- Grade A = 5/5 (Excellent nutritional quality)
-- Grade B = 4/5 (Good nutritional quality)  
-- Grade C = 3/5 (Average nutritional quality)
-- Grade D = 2/5 (Poor nutritional quality)
-- Grade E = 1/5 (Bad nutritional quality)
-
-Determine the grade based on: sugar content, saturated fat, sodium, calories, fiber, protein, fruits/vegetables content.
+The Nutri-Score and nutrition facts are computed separately; do not grade the product.
 
 Output Format (STRICT JSON):
 {
   "product_summary": {
     "name": "Product name in English",
     "brand": "Brand name",
-    "barcode": "barcode",
-    "quantity": "quantity",
-    "categories": ["category1", "category2"],
-    "food_type": "veg|non-veg|egg"
+    "categories": ["category1", "category2"]
   },
   "relevant_ingredients": [
     {
@@ -307,11 +578,6 @@ Output Format (STRICT JSON):
     "who_should_limit_consumption": "Groups in English",
     "usage_recommendation": "Recommendation in English"
   },
-  "nutriscore": {
-    "score_out_of_5": "5|4|3|2|1",
-    "grade": "A|B|C|D|E",
-    "justification": "Justification in English"
-  },
   "confidence_meter": {
     "confidence_percentage": "X%",
     "confidence_explanation": "Explanation in English"
@@ -324,6 +590,1235 @@ ALWAYS respond in ENGLISH regardless of the question language.
 If information is missing, clearly say so.
 Be helpful, accurate, and concise."""
 
+# ============== INDEXES ==============
+# collection -> [(keys, options)]; created idempotently at startup
+INDEX_SPECS = {
+    "users": [
+        ([("email", 1)], {"name": "email_unique", "unique": True}),
+        ([("id", 1)], {"name": "id_unique", "unique": True}),
+    ],
+    "analyses": [
+        ([("barcode", 1)], {"name": "barcode_unique", "unique": True}),
+        ([("id", 1)], {"name": "id_unique", "unique": True}),
+        ([("created_at", -1)], {"name": "created_at_desc"}),
+        ([("fingerprint.exact", 1)], {"name": "fingerprint_exact", "sparse": True}),
+        ([("fingerprint.nutrients", 1), ("fingerprint.bands", 1)], {"name": "fingerprint_nutrients_bands", "sparse": True}),
+    ],
+    "batch_jobs": [
+        ([("id", 1)], {"name": "id_unique", "unique": True}),
+    ],
+    "batch_items": [
+        ([("job_id", 1), ("barcode", 1)], {"name": "job_barcode_unique", "unique": True}),
+        ([("job_id", 1), ("status", 1)], {"name": "job_status"}),
+    ],
+    "scans": [
+        ([("user_id", 1), ("barcode", 1)], {"name": "user_barcode_unique", "unique": True}),
+        ([("user_id", 1), ("created_at", -1), ("id", -1)], {"name": "user_created_at_id_desc"}),
+        ([("id", 1)], {"name": "id_unique", "unique": True}),
+    ],
+    "raw_products": [
+        ([("barcode", 1)], {"name": "barcode_unique", "unique": True}),
+    ],
+    "analysis_jobs": [
+        ([("id", 1)], {"name": "id_unique", "unique": True}),
+        # At most one queued/running job per barcode; finished jobs drop the flag
+        ([("barcode", 1)], {"name": "barcode_active_unique", "unique": True,
+                            "partialFilterExpression": {"active": True}}),
+        ([("status", 1), ("priority", 1), ("created_at", 1)], {"name": "status_priority_created_at"}),
+        ([("status", 1), ("lease_expires_at", 1)], {"name": "status_lease_expires_at"}),
+        ([("expires_at", 1)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+    "analysis_leases": [
+        ([("expires_at", 1)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+    "analysis_invalidations": [
+        ([("created_at", 1)], {"name": "created_at_ttl", "expireAfterSeconds": 3600}),
+    ],
+}
+
+# Representative query of each route, used by the diagnostics report
+ROUTE_QUERIES = {
+    "get_current_user": {"collection": "users", "filter": {"id": "00000000-0000-0000-0000-000000000000"}},
+    "login/register": {"collection": "users", "filter": {"email": "nobody@example.com"}},
+    "analyze/analysis/chat/compare": {"collection": "analyses", "filter": {"barcode": "0000000000000"}},
+    "analysis_reuse": {"collection": "analyses", "filter": {"fingerprint.exact": "00000000000000000000000000000000"}},
+    "analysis_raw": {"collection": "raw_products", "filter": {"barcode": "0000000000000"}},
+    "delete_history": {"collection": "scans", "filter": {"id": "00000000-0000-0000-0000-000000000000", "user_id": "00000000-0000-0000-0000-000000000000"}},
+    "jobs": {"collection": "analysis_jobs", "filter": {"id": "00000000-0000-0000-0000-000000000000"}},
+    "job_claim": {"collection": "analysis_jobs", "filter": {"status": "queued"}, "sort": [("priority", 1), ("created_at", 1)], "limit": 1},
+    "history": {"collection": "scans", "filter": {"user_id": "00000000-0000-0000-0000-000000000000"}, "sort": [("created_at", -1), ("id", -1)], "limit": 21},
+}
+
+async def ensure_indexes():
+    for collection, specs in INDEX_SPECS.items():
+        for keys, options in specs:
+            try:
+                await db[collection].create_index(keys, **options)
+            except DuplicateKeyError as e:
+                # Data from before the unique index; keep serving, dedupe_unique_indexes.py clears it
+                logger.error(f"Could not create index {collection}.{options['name']}: {str(e)}; "
+                             f"run dedupe_unique_indexes.py")
+            except PyMongoError as e:
+                logger.error(f"Could not create index {collection}.{options['name']}: {str(e)}")
+
+async def missing_indexes() -> List[str]:
+    """collection.name of every index in INDEX_SPECS the database does not have"""
+    missing = []
+    for collection, specs in INDEX_SPECS.items():
+        existing = await db[collection].index_information()
+        missing.extend(f"{collection}.{options['name']}" for _, options in specs if options["name"] not in existing)
+    return missing
+
+def summarize_plan(stage: dict) -> dict:
+    """Flatten a winning plan into its stage chain and the indexes it uses"""
+    stages, indexes = [], []
+    pending = [stage]
+    while pending:
+        current = pending.pop()
+        stages.append(current.get("stage"))
+        if current.get("indexName"):
+            indexes.append(current["indexName"])
+        if "inputStage" in current:
+            pending.append(current["inputStage"])
+        pending.extend(current.get("inputStages", []))
+    return {"stages": stages, "indexes": indexes, "collection_scan": "COLLSCAN" in stages}
+
+async def collect_db_diagnostics() -> dict:
+    """Missing indexes, index usage counters and explain plans for every route's query"""
+    report = {"missing_indexes": await missing_indexes(), "indexes": {}, "queries": {}}
+    for collection in INDEX_SPECS:
+        try:
+            stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+            report["indexes"][collection] = {
+                s["name"]: {"ops": s["accesses"]["ops"], "since": s["accesses"]["since"].isoformat()}
+                for s in stats
+            }
+        except PyMongoError as e:
+            report["indexes"][collection] = {"error": str(e)}
+
+    for route, query in ROUTE_QUERIES.items():
+        cursor = db[query["collection"]].find(query["filter"])
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        if query.get("limit"):
+            cursor = cursor.limit(query["limit"])
+        try:
+            explain = await cursor.explain()
+        except PyMongoError as e:
+            report["queries"][route] = {"error": str(e)}
+            continue
+        execution = explain.get("executionStats", {})
+        report["queries"][route] = {
+            "collection": query["collection"],
+            **summarize_plan(explain.get("queryPlanner", {}).get("winningPlan", {})),
+            "docs_examined": execution.get("totalDocsExamined"),
+            "keys_examined": execution.get("totalKeysExamined"),
+            "execution_ms": execution.get("executionTimeMillis"),
+        }
+    return report
+
+# ============== ANALYSIS CACHE ==============
+ANALYSIS_CACHE_SIZE = int(os.environ.get('ANALYSIS_CACHE_SIZE', '1024'))
+ANALYSIS_CACHE_TTL = float(os.environ.get('ANALYSIS_CACHE_TTL', '600'))
+ANALYSIS_CACHE_SYNC_SECONDS = float(os.environ.get('ANALYSIS_CACHE_SYNC_SECONDS', '5'))
+
+# barcode -> analysis document without per-user fields; treat entries as read-only
+analysis_cache: TTLCache = TTLCache(maxsize=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL)
+analysis_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+analysis_cache_generation = 0
+cache_sync_task: Optional[asyncio.Task] = None
+
+# Internal fields of stored analyses that API responses leave out
+ANALYSIS_PROJECTION = {"_id": 0, "fingerprint": 0}
+
+def cache_analysis(analysis: dict):
+    analysis.pop("allergen_warnings", None)
+    analysis_cache[analysis["barcode"]] = analysis
+
+def invalidate_cached_analysis(barcode: str):
+    global analysis_cache_generation
+    analysis_cache_generation += 1
+    if analysis_cache.pop(barcode, None) is not None:
+        analysis_cache_stats["invalidations"] += 1
+    # Invalidations are only published for deleted analyses
+    category_ranking.remove(barcode)
+
+async def find_analysis(barcode: str) -> Optional[dict]:
+    """Cached lookup of the shared analysis for a barcode; returns a shallow copy safe to personalize"""
+    cached = analysis_cache.get(barcode)
+    if cached is not None:
+        analysis_cache_stats["hits"] += 1
+        return dict(cached)
+
+    analysis_cache_stats["misses"] += 1
+    generation = analysis_cache_generation
+    with stage("db_lookup"):
+        analysis = await db.analyses.find_one({"barcode": barcode}, ANALYSIS_PROJECTION)
+    if not analysis:
+        return None
+    # Skip caching if an invalidation raced with the read
+    if generation == analysis_cache_generation:
+        cache_analysis(analysis)
+    return dict(analysis)
+
+async def find_analyses(barcodes: List[str]) -> Dict[str, dict]:
+    """Cached lookup of several barcodes; the misses are fetched with a single $in query"""
+    found, misses = {}, []
+    for barcode in barcodes:
+        cached = analysis_cache.get(barcode)
+        if cached is not None:
+            analysis_cache_stats["hits"] += 1
+            found[barcode] = dict(cached)
+        else:
+            analysis_cache_stats["misses"] += 1
+            misses.append(barcode)
+
+    if misses:
+        generation = analysis_cache_generation
+        async for analysis in db.analyses.find({"barcode": {"$in": misses}}, ANALYSIS_PROJECTION):
+            if generation == analysis_cache_generation:
+                cache_analysis(analysis)
+            found[analysis["barcode"]] = dict(analysis)
+    return found
+
+async def publish_analysis_invalidation(barcode: str):
+    """Tell the other workers to drop their cached copy of a barcode"""
+    await db.analysis_invalidations.insert_one({
+        "barcode": barcode,
+        "worker": WORKER_ID,
+        "created_at": datetime.now(timezone.utc)
+    })
+
+async def sync_analysis_cache():
+    """Apply invalidations published by other workers, via change stream or polling"""
+    try:
+        async with db.analysis_invalidations.watch([{"$match": {"operationType": "insert"}}]) as stream:
+            logger.info("Analysis cache invalidations: using change stream")
+            async for change in stream:
+                invalidate_cached_analysis(change["fullDocument"]["barcode"])
+    except PyMongoError as e:
+        # Standalone mongod has no change streams
+        logger.info(f"Analysis cache invalidations: polling every {ANALYSIS_CACHE_SYNC_SECONDS}s ({str(e)})")
+
+    last_seen = ObjectId.from_datetime(datetime.now(timezone.utc))
+    while True:
+        await asyncio.sleep(ANALYSIS_CACHE_SYNC_SECONDS)
+        try:
+            async for doc in db.analysis_invalidations.find({"_id": {"$gt": last_seen}}).sort("_id", 1):
+                last_seen = doc["_id"]
+                invalidate_cached_analysis(doc["barcode"])
+        except Exception as e:
+            logger.error(f"Analysis cache sync failed: {str(e)}")
+
+def personalize_analysis(analysis: dict, user: Optional[dict]) -> dict:
+    """Add the user's allergen warnings to a (copied) analysis"""
+    if user and user.get("allergens"):
+        raw_data = analysis.get("raw_product_data", {})
+        with stage("allergens"):
+            analysis["allergen_warnings"] = check_allergens(raw_data.get("ingredients", ""), user["allergens"])
+    return analysis
+
+# ============== CATEGORY RANKING ==============
+# Products needed in a category before it is picked by default for rankings
+RANKING_MIN_PEERS = int(os.environ.get('RANKING_MIN_PEERS', '5'))
+# How often each worker picks up analyses stored by the others
+RANKING_SYNC_SECONDS = float(os.environ.get('RANKING_SYNC_SECONDS', '30'))
+RANKING_LOAD_BATCH = 1000
+
+# Per-category NumPy columns of every analysis' nutrition facts; see ranking.py
+category_ranking = CategoryRanking(min_peers=RANKING_MIN_PEERS)
+category_ranking_ready = False
+ranking_sync_task: Optional[asyncio.Task] = None
+
+RANKING_PROJECTION = {
+    "_id": 0, "barcode": 1, "categories_tags": 1, "product_summary.name": 1, "product_summary.brand": 1,
+    "nutrition_facts": 1, "nutriscore.grade": 1, "nutriscore.points": 1, "created_at": 1
+}
+
+async def load_category_ranking(since: Optional[str] = None) -> Optional[str]:
+    """Add analyses created at or after `since` (all if None); returns the newest created_at seen"""
+    query = {"created_at": {"$gte": since}} if since else {}
+    loaded = 0
+    async for analysis in db.analyses.find(query, RANKING_PROJECTION).sort("created_at", 1) \
+            .batch_size(RANKING_LOAD_BATCH):
+        category_ranking.add(analysis)
+        since = max(since or "", analysis.get("created_at") or "")
+        loaded += 1
+        if loaded % RANKING_LOAD_BATCH == 0:
+            # Keep serving requests while a large collection loads
+            await asyncio.sleep(0)
+    return since
+
+async def sync_category_ranking():
+    """Build the rankings from db.analyses, then poll for analyses stored by other workers"""
+    global category_ranking_ready
+    since = None
+    while not category_ranking_ready:
+        try:
+            started = time.monotonic()
+            since = await load_category_ranking()
+            category_ranking_ready = True
+            stats = category_ranking.stats()
+            logger.info(f"Category rankings: {stats['products']} products in {stats['categories']} categories "
+                        f"loaded in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Category ranking load failed: {str(e)}")
+            await asyncio.sleep(RANKING_SYNC_SECONDS)
+
+    while True:
+        await asyncio.sleep(RANKING_SYNC_SECONDS)
+        try:
+            # $gte re-adds the newest already-seen analyses; adding is idempotent
+            since = await load_category_ranking(since)
+        except Exception as e:
+            logger.error(f"Category ranking sync failed: {str(e)}")
+
+def category_ranking_or_503() -> CategoryRanking:
+    if not category_ranking_ready:
+        raise HTTPException(status_code=503, detail="Category rankings are still loading",
+                            headers={"Retry-After": "5"})
+    return category_ranking
+
+# ============== RAW PRODUCT STORE ==============
+# The full OFF-derived product data (nutriments map, ingredient tree) is kept out of
+# db.analyses, compressed, and only read by code that needs it
+RAW_PRODUCT_CODEC = "zstd" if zstandard is not None else "zlib"
+RAW_PRODUCT_ZSTD_LEVEL = int(os.environ.get('RAW_PRODUCT_ZSTD_LEVEL', '6'))
+
+def compress_raw_product(product_data: dict) -> dict:
+    raw = json.dumps(product_data, separators=(",", ":"), ensure_ascii=False).encode()
+    if RAW_PRODUCT_CODEC == "zstd":
+        data = zstandard.ZstdCompressor(level=RAW_PRODUCT_ZSTD_LEVEL).compress(raw)
+    else:
+        data = zlib.compress(raw, 6)
+    return {"codec": RAW_PRODUCT_CODEC, "size": len(raw), "data": data}
+
+def decompress_raw_product(doc: dict) -> dict:
+    if doc["codec"] == "zstd":
+        if zstandard is None:
+            raise RuntimeError("raw product is zstd-compressed but the 'zstandard' package is not installed")
+        raw = zstandard.ZstdDecompressor().decompress(doc["data"])
+    else:
+        raw = zlib.decompress(doc["data"])
+    return json.loads(raw)
+
+def raw_product_summary(product_data: dict) -> dict:
+    """The small part of the product data kept inline: read on every allergen check and chat"""
+    return {"ingredients": product_data.get("ingredients"), "nova_group": product_data.get("nova_group")}
+
+def raw_product_update(barcode: str, product_data: dict) -> UpdateOne:
+    return UpdateOne(
+        {"barcode": barcode},
+        {"$set": {
+            "barcode": barcode,
+            **compress_raw_product(product_data),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }},
+        upsert=True
+    )
+
+async def store_raw_products(items: List[tuple]):
+    """Upsert the compressed product data of (barcode, product_data) pairs"""
+    if items:
+        await db.raw_products.bulk_write([raw_product_update(b, data) for b, data in items], ordered=False)
+
+async def load_raw_product(barcode: str) -> Optional[dict]:
+    doc = await db.raw_products.find_one({"barcode": barcode}, {"_id": 0, "codec": 1, "data": 1})
+    if doc is None:
+        return None
+    return decompress_raw_product(doc)
+
+# ============== ANALYSIS PIPELINE ==============
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+ANALYSIS_LEASE_SECONDS = float(os.environ.get('ANALYSIS_LEASE_SECONDS', '90'))
+ANALYSIS_LEASE_POLL_SECONDS = float(os.environ.get('ANALYSIS_LEASE_POLL_SECONDS', '0.5'))
+
+# barcode -> task running the analysis in this worker; concurrent callers await the same task
+inflight_analyses: Dict[str, asyncio.Task] = {}
+
+class AnalysisEvents:
+    """The progress events of one running analysis, fanned out to every stream watching it.
+
+    A subscriber first gets the events sent before it joined, so a stream that joins
+    an analysis already in flight still starts with the facts.
+    """
+
+    def __init__(self):
+        self.history: List[tuple] = []
+        self.subscribers: List[Callable[[str, dict], None]] = []
+
+    def emit(self, event: str, data: dict):
+        self.history.append((event, data))
+        for subscriber in list(self.subscribers):
+            subscriber(event, data)
+
+    def subscribe(self, subscriber: Callable[[str, dict], None]):
+        for event, data in self.history:
+            subscriber(event, data)
+        self.subscribers.append(subscriber)
+
+# barcode -> events of the analysis in inflight_analyses
+inflight_events: Dict[str, AnalysisEvents] = {}
+
+# Copy the LLM sections of a stored analysis whose product has the same ingredients and
+# nutriments (or near-identical ingredients, see fingerprint.py) instead of calling the LLM
+ANALYSIS_REUSE = os.environ.get('ANALYSIS_REUSE', 'true').lower() in ('1', 'true', 'yes')
+ANALYSIS_REUSE_MIN_SIMILARITY = float(os.environ.get('ANALYSIS_REUSE_MIN_SIMILARITY', '0.85'))
+ANALYSIS_REUSE_CANDIDATES = 20
+LLM_SECTIONS = ("relevant_ingredients", "all_ingredients", "minority_ingredients", "nutritional_insights", "confidence_meter")
+ANALYSIS_REUSE_COUNT = Counter("nutridive_analysis_reuse_total", "Analyses that copied the LLM sections of another product",
+                               ("match",))
+
+class JsonSectionParser:
+    """Incrementally yields the top-level members of a streamed JSON object as each one completes"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.member_start = None
+
+    def feed(self, text: str) -> List[tuple]:
+        self.buffer += text
+        members = []
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif self.member_start is None:
+                # Skip any preamble (e.g. a ```json fence) up to the opening brace
+                if char == "{":
+                    self.depth = 1
+                    self.member_start = self.pos + 1
+            elif self.depth > 0:
+                if char == '"':
+                    self.in_string = True
+                elif char in "{[":
+                    self.depth += 1
+                elif char in "}]":
+                    if self.depth == 1:
+                        members.extend(self._close_member(self.pos))
+                    self.depth -= 1
+                elif char == "," and self.depth == 1:
+                    members.extend(self._close_member(self.pos))
+                    self.member_start = self.pos + 1
+            self.pos += 1
+        return members
+
+    def _close_member(self, end: int) -> List[tuple]:
+        text = self.buffer[self.member_start:end].strip()
+        if not text:
+            return []
+        try:
+            return list(json.loads("{" + text + "}").items())
+        except json.JSONDecodeError:
+            return []
+
+def build_product_data(barcode: str, product: dict) -> dict:
+    return {
+        "name": product.get("product_name", "Unknown"),
+        "brand": product.get("brands", "Unknown"),
+        "barcode": barcode,
+        "quantity": product.get("quantity", "Unknown"),
+        "ingredients": product.get("ingredients_text", "Not available"),
+        "ingredients_list": product.get("ingredients", []),
+        "nutriments": product.get("nutriments", {}),
+        "categories": product.get("categories", "").split(",") if product.get("categories") else [],
+        # Kept in raw_products so category rankings can be rebuilt without OFF
+        "categories_tags": product_categories_tags(product),
+        "nutriscore_grade": product.get("nutriscore_grade", "Unknown"),
+        "nova_group": product.get("nova_group", "Unknown"),
+    }
+
+def product_categories_tags(product: dict) -> List[str]:
+    """OFF's language-independent category tags (e.g. "en:breakfast-cereals"), for category rankings"""
+    return [tag for tag in product.get("categories_tags") or [] if isinstance(tag, str)]
+
+def product_nutriscore(product: dict) -> dict:
+    """Nutri-Score computed from the nutriments, else the grade OFF reports, else N/A"""
+    computed = score_product(product)
+    if computed is not None:
+        return computed
+    grade = str(product.get("nutriscore_grade") or "").upper()
+    if grade in GRADE_TO_SCORE_OUT_OF_5:
+        return {
+            "grade": grade,
+            "score_out_of_5": GRADE_TO_SCORE_OUT_OF_5[grade],
+            "justification": "Grade reported by Open Food Facts; the nutrition facts are incomplete.",
+            "source": "open_food_facts",
+        }
+    return {
+        "grade": "N/A",
+        "score_out_of_5": None,
+        "justification": "Not enough nutrition data to compute a Nutri-Score.",
+        "source": None,
+    }
+
+def analysis_facts(barcode: str, product: dict, product_data: dict) -> dict:
+    """The deterministic part of an analysis, available as soon as the OFF product is"""
+    return {
+        "barcode": barcode,
+        "product_summary": {
+            "name": product_data["name"],
+            "brand": product_data["brand"],
+            "barcode": barcode,
+            "quantity": product_data["quantity"],
+            "categories": [c.strip() for c in product_data["categories"]],
+            "food_type": detect_food_type(product),
+        },
+        "categories_tags": product_categories_tags(product),
+        "nutriscore": product_nutriscore(product),
+        "nutrition_facts": extract_nutrition_facts(product_data["nutriments"]),
+        "raw_product_data": raw_product_summary(product_data),
+    }
+
+async def get_analysis_facts(barcode: str, status: str = "facts_only") -> dict:
+    """A facts-only analysis (no LLM sections), served from the OFF mirror in milliseconds"""
+    product = await fetch_product_from_openfoodfacts(barcode)
+    return {**analysis_facts(barcode, product, build_product_data(barcode, product)), "status": status}
+
+def llm_product_data(product_data: dict) -> dict:
+    # Per-100g values are enough for the qualitative sections and keep the prompt short;
+    # the category tags repeat the categories
+    nutriments = {k: v for k, v in product_data["nutriments"].items() if k.endswith("_100g")}
+    return {**{k: v for k, v in product_data.items() if k != "categories_tags"}, "nutriments": nutriments}
+
+def parse_analysis_content(content: str) -> dict:
+    with stage("llm_parse"):
+        return parse_analysis_json(content)
+
+def parse_analysis_json(content: str) -> dict:
+    cleaned = content.strip()
+    if cleaned.startswith("```json"): cleaned = cleaned[7:]
+    if cleaned.startswith("```"): cleaned = cleaned[3:]
+    if cleaned.endswith("```"): cleaned = cleaned[:-3]
+
+    try:
+        return json.loads(cleaned.strip())
+    except json.JSONDecodeError:
+        logger.error(f"Invalid JSON from LLM: {cleaned}")
+        raise LLMError(status_code=500, detail="AI returned invalid JSON format")
+
+async def complete_analysis(product_data: dict, on_event: Optional[Callable[[str, dict], None]] = None) -> str:
+    """Run the analysis completion; with on_event, stream it and report each JSON section as it is parsed"""
+    messages = [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Analyze this food product (respond in ENGLISH only):\n\n{str(llm_product_data(product_data))}"}
+    ]
+    try:
+        with stage("llm_queue"):
+            await llm_slots.acquire(analysis_priority.get())
+        try:
+            with stage("llm"):
+                if on_event is None:
+                    response = await llm_completion(messages=messages, temperature=0.2)
+                else:
+                    stream = await llm_completion(
+                        messages=messages, temperature=0.2, stream=True, stream_options={"include_usage": True}
+                    )
+                    parser, parts, usage = JsonSectionParser(), [], None
+                    async for chunk in stream:
+                        if chunk.usage:
+                            usage = chunk.usage
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            parts.append(chunk.choices[0].delta.content)
+                            for name, value in parser.feed(parts[-1]):
+                                on_event("section", {"name": name, "value": value})
+        finally:
+            llm_slots.release()
+    except (CircuitOpenError, asyncio.TimeoutError, openai.OpenAIError, httpx.HTTPError) as e:
+        raise llm_error(e)
+    if on_event is None:
+        await record_llm_usage("analyze", response.usage)
+        return response.choices[0].message.content
+    await record_llm_usage("analyze_stream", usage)
+    return "".join(parts)
+
+def product_fingerprint(product_data: dict) -> Optional[dict]:
+    return ingredient_fingerprint(product_data.get("ingredients"), product_data.get("nutriments"))
+
+async def find_reusable_analysis(product_data: dict) -> Optional[dict]:
+    """LLM sections of a stored analysis of the same (or a near-identical) product, if any"""
+    fingerprint = product_fingerprint(product_data) if ANALYSIS_REUSE else None
+    if fingerprint is None:
+        return None
+    projection = {"_id": 0, "barcode": 1, **{section: 1 for section in LLM_SECTIONS}}
+    with stage("reuse_lookup"):
+        source = await db.analyses.find_one({"fingerprint.exact": fingerprint["exact"]}, projection)
+        match = "exact"
+        if source is None:
+            # Near-duplicates: same rounded nutriments and a shared LSH band, confirmed by MinHash
+            candidates = await db.analyses.find(
+                {"fingerprint.nutrients": fingerprint["nutrients"], "fingerprint.bands": {"$in": fingerprint["bands"]}},
+                {**projection, "raw_product_data.ingredients": 1}
+            ).limit(ANALYSIS_REUSE_CANDIDATES).to_list(ANALYSIS_REUSE_CANDIDATES)
+            signature = minhash(normalize_ingredients(product_data.get("ingredients")))
+            best = 0.0
+            for candidate in candidates:
+                ingredients = candidate.get("raw_product_data", {}).get("ingredients")
+                score = similarity(signature, minhash(normalize_ingredients(ingredients)))
+                if score >= ANALYSIS_REUSE_MIN_SIMILARITY and score > best:
+                    source, best = candidate, score
+            match = "near"
+    if source is None:
+        return None
+    ANALYSIS_REUSE_COUNT.inc(match=match)
+    return {**{section: source[section] for section in LLM_SECTIONS if section in source}, "reused_from": source["barcode"]}
+
+def build_analysis_document(barcode: str, product: dict, product_data: dict, analysis_data: dict) -> dict:
+    facts = analysis_facts(barcode, product, product_data)
+    # The LLM only contributes the English name/brand/categories to the summary
+    translated = {
+        key: value for key, value in analysis_data.get("product_summary", {}).items()
+        if key in ("name", "brand", "categories") and value
+    }
+    return {
+        "id": str(uuid.uuid4()),
+        "barcode": barcode,
+        "product_summary": {**facts["product_summary"], **translated},
+        "categories_tags": facts["categories_tags"],
+        "relevant_ingredients": analysis_data.get("relevant_ingredients", []),
+        "all_ingredients": analysis_data.get("all_ingredients", []),
+        "minority_ingredients": analysis_data.get("minority_ingredients", []),
+        "nutritional_insights": analysis_data.get("nutritional_insights", {}),
+        "nutriscore": facts["nutriscore"],
+        "confidence_meter": analysis_data.get("confidence_meter", {}),
+        "nutrition_facts": facts["nutrition_facts"],
+        "raw_product_data": facts["raw_product_data"],
+        **({"reused_from": analysis_data["reused_from"]} if "reused_from" in analysis_data else {}),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+async def store_analysis(analysis: dict, product_data: dict) -> dict:
+    try:
+        with stage("db_store"):
+            await store_raw_products([(analysis["barcode"], product_data)])
+            await db.analyses.insert_one({**analysis, "fingerprint": product_fingerprint(product_data)})
+    except DuplicateKeyError:
+        # Another worker outlived its lease and stored the barcode first
+        return await db.analyses.find_one({"barcode": analysis["barcode"]}, ANALYSIS_PROJECTION)
+    category_ranking.add(analysis)
+    return analysis
+
+async def run_analysis(barcode: str, events: Optional[AnalysisEvents] = None) -> dict:
+    """Fetch the product, run the LLM analysis and persist the result.
+
+    events, if given, gets ("facts", ...) right after the OFF fetch and a
+    ("section", ...) for each LLM section: as it streams in if a subscriber is
+    watching when the completion starts, else all at once when it is done.
+    """
+    product = await fetch_product_from_openfoodfacts(barcode)
+    product_data = build_product_data(barcode, product)
+    if events is not None:
+        events.emit("facts", analysis_facts(barcode, product, product_data))
+    
+    try:
+        analysis_data = await find_reusable_analysis(product_data)
+        streamed = False
+        if analysis_data is None:
+            streamed = events is not None and bool(events.subscribers)
+            content = await complete_analysis(product_data, events.emit if streamed else None)
+            analysis_data = parse_analysis_content(content)
+        if events is not None and not streamed:
+            for name in LLM_SECTIONS:
+                if name in analysis_data:
+                    events.emit("section", {"name": name, "value": analysis_data[name]})
+        return await store_analysis(build_analysis_document(barcode, product, product_data, analysis_data), product_data)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error analyzing product: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+async def acquire_analysis_lease(barcode: str) -> bool:
+    """Claim the cross-worker right to analyze a barcode; False if another worker holds a live lease"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.analysis_leases.update_one(
+            {"_id": barcode, "expires_at": {"$lt": now}},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=ANALYSIS_LEASE_SECONDS)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def release_analysis_lease(barcode: str):
+    await db.analysis_leases.delete_one({"_id": barcode, "owner": WORKER_ID})
+
+async def analyze_with_lease(barcode: str, events: Optional[AnalysisEvents] = None) -> dict:
+    while True:
+        if await acquire_analysis_lease(barcode):
+            try:
+                # Another worker may have finished between our cache miss and the lease
+                existing = await db.analyses.find_one({"barcode": barcode}, ANALYSIS_PROJECTION)
+                if existing:
+                    return existing
+                # The task is shared by every waiting request, so it runs on its own budget; each
+                # request's wait for it is bounded by that request's budget in get_or_create_analysis
+                with resilience.deadline(ANALYSIS_BUDGET_SECONDS, inherit=False):
+                    return await run_analysis(barcode, events)
+            finally:
+                await release_analysis_lease(barcode)
+
+        # Someone else is analyzing this barcode: wait for their result or for the lease to lapse
+        await asyncio.sleep(ANALYSIS_LEASE_POLL_SECONDS)
+        existing = await db.analyses.find_one({"barcode": barcode}, ANALYSIS_PROJECTION)
+        if existing:
+            return existing
+
+def start_analysis(barcode: str, on_event: Optional[Callable[[str, dict], None]] = None) -> asyncio.Task:
+    """Start an analysis task for a barcode, or return the one already running in this worker.
+
+    on_event, if given, receives every progress event of the analysis (see
+    AnalysisEvents), whether this call started it or joined it. An analysis that
+    another worker runs sends none.
+    """
+    task = inflight_analyses.get(barcode)
+    if task is None:
+        events = inflight_events[barcode] = AnalysisEvents()
+        task = asyncio.create_task(analyze_with_lease(barcode, events))
+        inflight_analyses[barcode] = task
+
+        def _finish(done: asyncio.Task):
+            if inflight_analyses.get(barcode) is done:
+                del inflight_analyses[barcode]
+                del inflight_events[barcode]
+            if not done.cancelled() and done.exception() is None:
+                cache_analysis(done.result())
+        task.add_done_callback(_finish)
+    if on_event is not None:
+        inflight_events[barcode].subscribe(on_event)
+    return task
+
+async def get_or_create_analysis(barcode: str, timeout: Optional[float] = None) -> dict:
+    """Return the stored analysis for a barcode, coalescing concurrent misses into one analysis.
+
+    Waits at most `timeout` and never past the current request budget; raises
+    asyncio.TimeoutError when either runs out. The analysis keeps running.
+    """
+    existing = await find_analysis(barcode)
+    if existing:
+        return existing
+
+    left = resilience.remaining()
+    if left is not None:
+        timeout = max(0.0, left if timeout is None else min(timeout, left))
+
+    # shield: a disconnecting (or timed-out) caller must not cancel the analysis others are awaiting
+    result = await asyncio.wait_for(asyncio.shield(start_analysis(barcode)), timeout)
+    return dict(result)
+
+# ============== BATCH ANALYSIS ==============
+BATCH_OFF_CONCURRENCY = int(os.environ.get('BATCH_OFF_CONCURRENCY', '8'))
+BATCH_LLM_CONCURRENCY = int(os.environ.get('BATCH_LLM_CONCURRENCY', '4'))
+# Analyses buffered per insert_many; also the checkpoint interval
+BATCH_WRITE_SIZE = int(os.environ.get('BATCH_WRITE_SIZE', '25'))
+
+# job id -> background task running it in this worker
+batch_tasks: Dict[str, asyncio.Task] = {}
+
+def project_off_product(product: dict) -> dict:
+    return {key: product[key] for key in OFF_PRODUCT_FIELDS if key in product}
+
+async def create_batch_job(items: List[tuple], source: str) -> dict:
+    """Register a batch of (barcode, OFF product or None) items; products skip the OFF fetch"""
+    unique = {}
+    for barcode, product in items:
+        barcode = str(barcode).strip()
+        if barcode and (barcode not in unique or product):
+            unique[barcode] = project_off_product(product) if product else None
+
+    job = {
+        "id": str(uuid.uuid4()),
+        "source": source,
+        "status": "pending",
+        "total": len(unique),
+        "done": 0, "skipped": 0, "failed": 0,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    await db.batch_jobs.insert_one(job.copy())
+    docs = [{"job_id": job["id"], "barcode": b, "product": p, "status": "pending"} for b, p in unique.items()]
+    for start in range(0, len(docs), 1000):
+        await db.batch_items.insert_many(docs[start:start + 1000])
+    return job
+
+async def get_batch_job(job_id: str) -> Optional[dict]:
+    return await db.batch_jobs.find_one({"id": job_id}, {"_id": 0})
+
+async def run_batch_job(job_id: str, on_progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """Analyze the pending items of a batch job; safe to re-run to resume after a crash"""
+    started = time.monotonic()
+    await db.batch_jobs.update_one(
+        {"id": job_id},
+        {"$set": {"status": "running", "started_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    pending = await db.batch_items.find(
+        {"job_id": job_id, "status": "pending"}, {"_id": 0, "barcode": 1, "product": 1}
+    ).to_list(None)
+
+    # Barcodes analyzed since the job was created (or by a previous run) are skipped
+    existing = set()
+    barcodes = [item["barcode"] for item in pending]
+    for start in range(0, len(barcodes), 1000):
+        async for doc in db.analyses.find({"barcode": {"$in": barcodes[start:start + 1000]}}, {"_id": 0, "barcode": 1}):
+            existing.add(doc["barcode"])
+    if existing:
+        await db.batch_items.update_many(
+            {"job_id": job_id, "barcode": {"$in": list(existing)}}, {"$set": {"status": "skipped"}}
+        )
+        await db.batch_jobs.update_one({"id": job_id}, {"$inc": {"skipped": len(existing)}})
+    pending = [item for item in pending if item["barcode"] not in existing]
+
+    off_semaphore = asyncio.Semaphore(BATCH_OFF_CONCURRENCY)
+    llm_semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+    analyzed, failures, processed = [], [], 0
+    flush_lock = asyncio.Lock()
+
+    async def flush():
+        nonlocal analyzed, failures, processed
+        async with flush_lock:
+            docs, failed = [doc for doc, _ in analyzed], failures
+            raw = [(doc["barcode"], product_data) for doc, product_data in analyzed]
+            stored = [{**doc, "fingerprint": product_fingerprint(product_data)} for doc, product_data in analyzed]
+            analyzed, failures = [], []
+            if docs:
+                await store_raw_products(raw)
+                rejected = set()
+                try:
+                    await db.analyses.insert_many(stored, ordered=False)
+                except BulkWriteError as e:
+                    # Duplicate barcodes were analyzed elsewhere meanwhile; anything else is a real failure
+                    errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+                    if errors:
+                        raise
+                    rejected = {err["index"] for err in e.details.get("writeErrors", [])}
+                for i, doc in enumerate(docs):
+                    if i not in rejected:
+                        category_ranking.add(doc)
+                await db.batch_items.update_many(
+                    {"job_id": job_id, "barcode": {"$in": [d["barcode"] for d in docs]}}, {"$set": {"status": "done"}}
+                )
+            for barcode, detail in failed:
+                await db.batch_items.update_one(
+                    {"job_id": job_id, "barcode": barcode}, {"$set": {"status": "failed", "error": detail}}
+                )
+            processed += len(docs) + len(failed)
+            elapsed = time.monotonic() - started
+            await db.batch_jobs.update_one({"id": job_id}, {
+                "$inc": {"done": len(docs), "failed": len(failed)},
+                "$set": {
+                    "per_second": round(processed / elapsed, 3) if elapsed else None,
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                }
+            })
+            if on_progress is not None:
+                on_progress(await get_batch_job(job_id))
+
+    async def worker():
+        while not queue.empty():
+            item = queue.get_nowait()
+            barcode = item["barcode"]
+            try:
+                product = item.get("product")
+                if not product:
+                    async with off_semaphore:
+                        # Each item gets its own budget, not the one of the request that started the job
+                        with resilience.deadline(OFF_TIMEOUT_SECONDS * (OFF_RETRIES + 1), inherit=False):
+                            product = await fetch_product_from_openfoodfacts(barcode)
+                product_data = build_product_data(barcode, product)
+                analysis_data = await find_reusable_analysis(product_data)
+                if analysis_data is None:
+                    async with llm_semaphore:
+                        with resilience.deadline(ANALYSIS_BUDGET_SECONDS, inherit=False):
+                            analysis_data = parse_analysis_content(await complete_analysis(product_data))
+                analyzed.append((build_analysis_document(barcode, product, product_data, analysis_data), product_data))
+            except HTTPException as e:
+                failures.append((barcode, e.detail))
+            except Exception as e:
+                logger.error(f"Batch analysis of {barcode} failed: {str(e)}")
+                failures.append((barcode, str(e)))
+            if len(analyzed) + len(failures) >= BATCH_WRITE_SIZE:
+                await flush()
+
+    # Batch completions queue behind interactive ones for the shared LLM slots
+    priority = analysis_priority.set(PRIORITY_BATCH)
+    workers = [asyncio.create_task(worker()) for _ in range(max(BATCH_OFF_CONCURRENCY, BATCH_LLM_CONCURRENCY))]
+    try:
+        await asyncio.gather(*workers)
+        await flush()
+    except BaseException:
+        # Stop the other workers first: a resume must not race writers left over from this run
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # Unflushed items stay pending and are picked up when the job is resumed
+        await db.batch_jobs.update_one({"id": job_id}, {"$set": {"status": "interrupted"}})
+        raise
+    finally:
+        analysis_priority.reset(priority)
+
+    await db.batch_jobs.update_one({"id": job_id}, {"$set": {
+        "status": "completed",
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "elapsed_seconds": round(time.monotonic() - started, 3),
+    }})
+    return await get_batch_job(job_id)
+
+def start_batch_job(job_id: str):
+    task = asyncio.create_task(run_batch_job(job_id))
+    batch_tasks[job_id] = task
+    task.add_done_callback(lambda _: batch_tasks.pop(job_id, None))
+
+# ============== ANALYSIS JOBS ==============
+# Job workers started inside each API process; 0 leaves the queue to job_worker.py
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# Renewed while a job runs; a job whose lease lapses (crashed worker) is claimed again
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '1'))
+# Finished jobs are kept this long for polling clients
+JOB_RETENTION_SECONDS = float(os.environ.get('JOB_RETENTION_SECONDS', '86400'))
+JOB_PROJECTION = {"_id": 0, "id": 1, "barcode": 1, "status": 1, "priority": 1, "attempts": 1, "analysis_id": 1,
+                  "error": 1, "created_at": 1, "updated_at": 1, "finished_at": 1}
+
+# Wakes this process's idle job workers as soon as it enqueues something
+job_available = asyncio.Event()
+job_worker_tasks: List[asyncio.Task] = []
+
+async def enqueue_analysis_job(barcode: str, priority: int = PRIORITY_INTERACTIVE, user_id: Optional[str] = None) -> dict:
+    """Queue an analysis of a barcode, or join the job already queued/running for it.
+
+    Joining never lowers a job's urgency: an interactive request moves a queued
+    batch-priority job up.
+    """
+    now = datetime.now(timezone.utc)
+    update = {
+        "$min": {"priority": priority},
+        "$set": {"updated_at": now.isoformat()},
+        "$setOnInsert": {
+            "id": str(uuid.uuid4()),
+            "status": "queued",
+            "attempts": 0,
+            "available_at": now,
+            "created_at": now.isoformat(),
+        },
+    }
+    if user_id:
+        update["$addToSet"] = {"user_ids": user_id}
+    while True:
+        try:
+            job = await db.analysis_jobs.find_one_and_update(
+                {"barcode": barcode, "active": True}, update,
+                projection=JOB_PROJECTION, upsert=True, return_document=ReturnDocument.AFTER
+            )
+            break
+        except DuplicateKeyError:
+            # A concurrent enqueue inserted the job first; the retry joins it
+            continue
+    job_available.set()
+    return job
+
+async def get_analysis_job(job_id: str) -> Optional[dict]:
+    return await db.analysis_jobs.find_one({"id": job_id}, JOB_PROJECTION)
+
+async def claim_analysis_job(worker_id: str) -> Optional[dict]:
+    """Lease the most urgent runnable job: queued and due, or running under a lapsed lease"""
+    now = datetime.now(timezone.utc)
+    return await db.analysis_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "available_at": {"$lte": now}},
+            {"status": "running", "lease_expires_at": {"$lt": now}},
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "lease_owner": worker_id,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "updated_at": now.isoformat(),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("priority", 1), ("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def renew_job_lease(job_id: str, worker_id: str):
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        result = await db.analysis_jobs.update_one(
+            {"id": job_id, "lease_owner": worker_id},
+            {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_SECONDS)}}
+        )
+        if not result.matched_count:
+            logger.error(f"Job worker {worker_id} lost the lease on job {job_id}")
+            return
+
+async def finish_analysis_job(job: dict, worker_id: str, fields: dict) -> Optional[dict]:
+    """Settle a leased job as done or failed; None if another worker has taken it over"""
+    now = datetime.now(timezone.utc)
+    return await db.analysis_jobs.find_one_and_update(
+        {"id": job["id"], "lease_owner": worker_id},
+        {
+            "$set": {
+                **fields,
+                "finished_at": now.isoformat(),
+                "updated_at": now.isoformat(),
+                "expires_at": now + timedelta(seconds=JOB_RETENTION_SECONDS),
+            },
+            "$unset": {"active": "", "lease_owner": "", "lease_expires_at": ""},
+        },
+        return_document=ReturnDocument.AFTER
+    )
+
+async def requeue_analysis_job(job: dict, worker_id: str, delay: float = 0.0, refund_attempt: bool = False):
+    now = datetime.now(timezone.utc)
+    update = {
+        "$set": {"status": "queued", "available_at": now + timedelta(seconds=delay), "updated_at": now.isoformat()},
+        "$unset": {"lease_owner": "", "lease_expires_at": ""},
+    }
+    if refund_attempt:
+        update["$inc"] = {"attempts": -1}
+    await db.analysis_jobs.update_one({"id": job["id"], "lease_owner": worker_id}, update)
+
+async def process_analysis_job(job: dict, worker_id: str):
+    """Run one leased job to done, failed, or back to the queue for a retry"""
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        # Claimed again after its workers kept dying (or hanging) mid-analysis
+        await finish_analysis_job(job, worker_id, {
+            "status": "failed", "error": {"status_code": 500, "detail": "Analysis abandoned after repeated worker failures"}
+        })
+        return
+
+    heartbeat = asyncio.create_task(renew_job_lease(job["id"], worker_id))
+    priority = analysis_priority.set(job["priority"])
+    try:
+        analysis = await get_or_create_analysis(job["barcode"])
+    except asyncio.CancelledError:
+        # Worker shutting down: hand the job straight back instead of waiting out the lease
+        await asyncio.shield(requeue_analysis_job(job, worker_id, refund_attempt=True))
+        raise
+    except Exception as e:
+        if not isinstance(e, HTTPException):
+            logger.error(f"Analysis job {job['id']} ({job['barcode']}) failed: {str(e)}")
+            e = HTTPException(status_code=500, detail="Analysis failed")
+        # Upstream trouble (5xx) is worth another attempt; a 4xx such as an unknown barcode is not
+        if e.status_code >= 500 and job["attempts"] < JOB_MAX_ATTEMPTS:
+            await requeue_analysis_job(job, worker_id, delay=resilience.backoff(job["attempts"], 2.0, 60.0))
+        else:
+            await finish_analysis_job(job, worker_id, {
+                "status": "failed", "error": {"status_code": e.status_code, "detail": e.detail}
+            })
+        return
+    finally:
+        analysis_priority.reset(priority)
+        heartbeat.cancel()
+
+    finished = await finish_analysis_job(job, worker_id, {"status": "done", "analysis_id": analysis["id"]})
+    # Everyone who asked for the job while it was queued or running gets it in their history
+    for user_id in (finished or job).get("user_ids", []):
+        await record_scan({"id": user_id}, analysis)
+
+async def run_job_worker(worker_id: str):
+    while True:
+        try:
+            job = await claim_analysis_job(worker_id)
+        except PyMongoError as e:
+            logger.error(f"Job worker {worker_id} could not claim a job: {str(e)}")
+            job = None
+        if job is None:
+            job_available.clear()
+            try:
+                await asyncio.wait_for(job_available.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        try:
+            await process_analysis_job(job, worker_id)
+        except PyMongoError as e:
+            # The lease lapses and the job is claimed again
+            logger.error(f"Job worker {worker_id} could not settle job {job['id']}: {str(e)}")
+
+def start_job_workers(count: int) -> List[asyncio.Task]:
+    tasks = [asyncio.create_task(run_job_worker(f"{WORKER_ID}/{i}")) for i in range(count)]
+    job_worker_tasks.extend(tasks)
+    return tasks
+
+async def stop_job_workers():
+    for task in job_worker_tasks:
+        task.cancel()
+    # Let cancelled workers hand their jobs back before the database client closes
+    await asyncio.gather(*job_worker_tasks, return_exceptions=True)
+    job_worker_tasks.clear()
+
+# ============== SCAN HISTORY ==============
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '20'))
+HISTORY_MAX_PAGE_SIZE = 100
+HISTORY_PROJECTION = {"_id": 0, **{field: 1 for field in ScanHistory.model_fields}}
+
+async def record_scan(user: dict, analysis: dict):
+    """Upsert the user's scan of a product, with the fields the history list shows.
+
+    One record per (user, barcode): scanning again moves it to the top of the history.
+    """
+    summary = analysis.get("product_summary", {})
+    try:
+        await db.scans.update_one(
+            {"user_id": user["id"], "barcode": analysis["barcode"]},
+            {
+                "$set": {
+                    "analysis_id": analysis.get("id", ""),
+                    "product_name": summary.get("name", "Unknown"),
+                    "brand": summary.get("brand", "Unknown"),
+                    "nutriscore": analysis.get("nutriscore", {}).get("grade", "N/A"),
+                    "food_type": summary.get("food_type", "unknown"),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                },
+                "$setOnInsert": {"id": str(uuid.uuid4())},
+                "$inc": {"scan_count": 1},
+            },
+            upsert=True
+        )
+    except PyMongoError as e:
+        logger.error(f"Could not record scan of {analysis.get('barcode')}: {str(e)}")
+
+def encode_history_cursor(scan: dict) -> str:
+    raw = json.dumps([scan["created_at"], scan["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> tuple:
+    try:
+        created_at, scan_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(scan_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
+
+async def find_scan_page(user_id: str, limit: int, cursor: Optional[str] = None) -> dict:
+    """One page of a user's scans, newest first, keyset-paginated on (created_at, id)"""
+    query = {"user_id": user_id}
+    if cursor:
+        created_at, scan_id = decode_history_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": scan_id}},
+        ]
+    # One extra row tells whether another page exists
+    scans = await db.scans.find(query, HISTORY_PROJECTION) \
+        .sort([("created_at", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    page = scans[:limit]
+    return {
+        "items": page,
+        "next_cursor": encode_history_cursor(page[-1]) if len(scans) > limit else None,
+    }
+
+# ============== CHAT CONTEXT ==============
+CHAT_TOKEN_BUDGET = int(os.environ.get('CHAT_TOKEN_BUDGET', '4000'))
+CHAT_MAX_TURN_TOKENS = int(os.environ.get('CHAT_MAX_TURN_TOKENS', '600'))
+# Left for the conversation even when the product context is large; the rest of the context is cut
+CHAT_HISTORY_RESERVE_TOKENS = int(os.environ.get('CHAT_HISTORY_RESERVE_TOKENS', '600'))
+# Rough per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# analysis id -> compact JSON context; ids change when a barcode is re-analyzed
+chat_context_cache: LRUCache = LRUCache(maxsize=int(os.environ.get('CHAT_CONTEXT_CACHE_SIZE', '1024')))
+# Loaded off the event loop at startup: tiktoken downloads its BPE table on first use unless it is
+# already in TIKTOKEN_CACHE_DIR. Token counts are estimated until it is available.
+token_encoder = None
+TOKEN_ENCODER_RETRY_SECONDS = float(os.environ.get('TOKEN_ENCODER_RETRY_SECONDS', '300'))
+token_encoder_task: Optional[asyncio.Task] = None
+
+async def load_token_encoder():
+    global token_encoder
+    while token_encoder is None:
+        try:
+            token_encoder = await anyio.to_thread.run_sync(tiktoken.get_encoding, "o200k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, estimating token counts; retrying in "
+                           f"{TOKEN_ENCODER_RETRY_SECONDS:.0f}s: {str(e)}")
+            await asyncio.sleep(TOKEN_ENCODER_RETRY_SECONDS)
+
+def count_tokens(text: str) -> int:
+    if token_encoder is not None:
+        return len(token_encoder.encode(text))
+    return len(text) // 4 + 1
+
+def count_message_tokens(message: dict) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        # Even "" counts as one token under the estimate
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    # Shrink proportionally until it fits; converges in a couple of rounds
+    while count_tokens(text) > max_tokens:
+        text = text[:int(len(text) * max_tokens / count_tokens(text) * 0.95)]
+    return text + "…"
+
+def chat_context(analysis: dict) -> str:
+    """Compact JSON of the analysis fields the chat assistant needs, cached per analysis"""
+    cached = chat_context_cache.get(analysis["id"])
+    if cached is not None:
+        return cached
+
+    summary = analysis.get("product_summary", {})
+    raw_data = analysis.get("raw_product_data", {})
+    context = {
+        "product": {k: summary.get(k) for k in ("name", "brand", "quantity", "categories", "food_type")},
+        "nutriscore": analysis.get("nutriscore", {}),
+        "nova_group": raw_data.get("nova_group"),
+        "nutrition_per_100g": {f["name"]: f"{f['value']} {f['unit']}" for f in analysis.get("nutrition_facts", [])},
+        "ingredients": [i.get("name") for i in analysis.get("all_ingredients", [])] or raw_data.get("ingredients"),
+        "key_ingredients": analysis.get("relevant_ingredients", []),
+        "ingredients_of_concern": analysis.get("minority_ingredients", []),
+        "insights": analysis.get("nutritional_insights", {}),
+        "confidence": analysis.get("confidence_meter", {}).get("confidence_percentage"),
+    }
+    cached = json.dumps(context, separators=(",", ":"), ensure_ascii=False)
+    chat_context_cache[analysis["id"]] = cached
+    return cached
+
+def fit_history(history: List[ChatMessage], budget: int) -> List[dict]:
+    """Newest turns that fit the token budget; older ones collapse into a one-line summary"""
+    kept, used = [], 0
+    turns = [m for m in history if m.role in ("user", "assistant") and m.content]
+    for index in range(len(turns) - 1, -1, -1):
+        message = {"role": turns[index].role, "content": truncate_to_tokens(turns[index].content, CHAT_MAX_TURN_TOKENS)}
+        cost = count_message_tokens(message)
+        if used + cost > budget:
+            dropped = turns[:index + 1]
+            break
+        kept.append(message)
+        used += cost
+    else:
+        dropped = []
+    kept.reverse()
+
+    if dropped:
+        questions = [m.content for m in dropped if m.role == "user"]
+        note = {"role": "system", "content": f"{len(dropped)} earlier messages omitted."}
+        if questions:
+            summary = {"role": "system", "content": f"{note['content']} Earlier the user asked: " + " | ".join(questions)}
+            # Truncate the summary to whatever budget is left
+            remaining = budget - used - MESSAGE_OVERHEAD_TOKENS
+            if remaining > 20:
+                summary["content"] = truncate_to_tokens(summary["content"], remaining)
+                note = summary
+        if used + count_message_tokens(note) <= budget:
+            kept.insert(0, note)
+    return kept
+
 # ============== AUTH ROUTES ==============
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(data: UserRegister):
@@ -336,11 +1831,14 @@ async def register(data: UserRegister):
         "id": user_id,
         "email": data.email,
         "name": data.name,
-        "password": hash_password(data.password),
+        "password": await hash_password(data.password),
         "allergens": [],
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.users.insert_one(user)
+    try:
+        await db.users.insert_one(user)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     token = create_token(user_id)
     return TokenResponse(
@@ -351,8 +1849,17 @@ async def register(data: UserRegister):
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(data: UserLogin):
     user = await db.users.find_one({"email": data.email})
-    if not user or not verify_password(data.password, user["password"]):
+    if not user or not await verify_password(data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if password_needs_rehash(user["password"]):
+        try:
+            # Conditional on the old hash so a concurrent password change is never overwritten
+            await db.users.update_one(
+                {"id": user["id"], "password": user["password"]},
+                {"$set": {"password": await hash_password(data.password)}}
+            )
+        except HTTPException:
+            pass  # saturated; retried on a later login
     
     token = create_token(user["id"])
     return TokenResponse(
@@ -372,7 +1879,63 @@ async def update_allergens(data: AllergenUpdate, user: dict = Depends(require_au
     await db.users.update_one({"id": user["id"]}, {"$set": {"allergens": data.allergens}})
     return {"message": "Allergens updated", "allergens": data.allergens}
 
+# ============== HTTP RESPONSES ==============
+# Bump when the analysis JSON changes shape, so clients holding old ETags refetch
+ANALYSIS_REPRESENTATION_VERSION = 1
+# How long browsers/CDNs may reuse a shared analysis before revalidating with its ETag
+ANALYSIS_HTTP_MAX_AGE = int(os.environ.get('ANALYSIS_HTTP_MAX_AGE', '300'))
+
+# analysis id -> serialized shared analysis; analyses never change once stored
+analysis_body_cache = LRUCache(maxsize=ANALYSIS_CACHE_SIZE)
+
+def json_bytes(data) -> bytes:
+    return orjson.dumps(data, default=str)
+
+def analysis_etag(analysis: dict) -> Optional[str]:
+    # Facts-only answers (no id) are not stored and get no validator
+    return f'"{analysis["id"]}.v{ANALYSIS_REPRESENTATION_VERSION}"' if "id" in analysis else None
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """If-None-Match check with the weak comparison RFC 9110 prescribes for it"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+def shared_analysis_body(analysis: dict) -> bytes:
+    """The analysis serialized without personal fields, memoized per stored analysis"""
+    shared = {key: value for key, value in analysis.items() if key != "allergen_warnings"}
+    if "id" not in analysis:
+        return json_bytes(shared)
+    body = analysis_body_cache.get(analysis["id"])
+    if body is None:
+        body = analysis_body_cache[analysis["id"]] = json_bytes(shared)
+    return body
+
+def analysis_response(analysis: dict, user: Optional[dict]) -> Response:
+    """An analysis with the user's allergen warnings appended to the memoized shared body.
+
+    Only an unpersonalized body carries the ETag: the validator names one exact
+    representation.
+    """
+    body = shared_analysis_body(analysis)
+    headers = {"Cache-Control": "no-store"}
+    if user and user.get("allergens"):
+        warnings = personalize_analysis({"raw_product_data": analysis.get("raw_product_data", {})}, user)
+        body = body[:-1] + b',"allergen_warnings":' + json_bytes(warnings["allergen_warnings"]) + b"}"
+    elif "id" in analysis:
+        headers["ETag"] = analysis_etag(analysis)
+    return Response(body, media_type="application/json", headers=headers)
+
 # ============== PRODUCT ROUTES ==============
+# Answer /analyze with the facts alone when the LLM takes longer than this; 0 waits for it
+ANALYSIS_FACTS_FALLBACK_SECONDS = float(os.environ.get('ANALYSIS_FACTS_FALLBACK_SECONDS', '0'))
+COMPARE_MAX_PRODUCTS = int(os.environ.get('COMPARE_MAX_PRODUCTS', '6'))
+# Uncached products analyzed at once per comparison
+COMPARE_CONCURRENCY = int(os.environ.get('COMPARE_CONCURRENCY', '3'))
+
 @api_router.get("/")
 async def root():
     return {"message": "NutriDive API"}
@@ -382,178 +1945,392 @@ async def get_product(barcode: str):
     product = await fetch_product_from_openfoodfacts(barcode)
     return {"product": product}
 
+@api_router.post("/analyze/batch", status_code=202, dependencies=[Depends(require_admin)])
+async def analyze_batch(request: BatchAnalyzeRequest):
+    items = [(barcode, None) for barcode in request.barcodes]
+    items += [(product.get("code"), product) for product in request.products if product.get("code")]
+    if not items:
+        raise HTTPException(status_code=400, detail="Provide barcodes or OFF products with a code")
+    job = await create_batch_job(items, source="api")
+    start_batch_job(job["id"])
+    return job
+
+@api_router.get("/analyze/batch/{job_id}", dependencies=[Depends(require_admin)])
+async def get_batch_status(job_id: str):
+    job = await get_batch_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+@api_router.post("/analyze/batch/{job_id}/resume", status_code=202, dependencies=[Depends(require_admin)])
+async def resume_batch(job_id: str):
+    job = await get_batch_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    if job_id in batch_tasks:
+        raise HTTPException(status_code=409, detail="Batch job is already running")
+    start_batch_job(job_id)
+    return job
+
 @api_router.post("/analyze/{barcode}")
-async def analyze_product(barcode: str, user: Optional[dict] = Depends(get_current_user)):
-    # Check cache
-    existing = await db.analyses.find_one({"barcode": barcode}, {"_id": 0})
-    if existing:
-        # Add allergen warnings if user is logged in
-        if user and user.get("allergens"):
-            raw_data = existing.get("raw_product_data", {})
-            ingredients_text = raw_data.get("ingredients", "")
-            existing["allergen_warnings"] = check_allergens(ingredients_text, user["allergens"])
-        return existing
-    
-    product = await fetch_product_from_openfoodfacts(barcode)
-    
-    product_data = {
-        "name": product.get("product_name", "Unknown"),
-        "brand": product.get("brands", "Unknown"),
-        "barcode": barcode,
-        "quantity": product.get("quantity", "Unknown"),
-        "ingredients": product.get("ingredients_text", "Not available"),
-        "ingredients_list": product.get("ingredients", []),
-        "nutriments": product.get("nutriments", {}),
-        "categories": product.get("categories", "").split(",") if product.get("categories") else [],
-        "nutriscore_grade": product.get("nutriscore_grade", "Unknown"),
-        "nova_group": product.get("nova_group", "Unknown"),
-    }
-    
-    try:
-        response = await openai_client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
-                {"role": "user", "content": f"Analyze this food product (respond in ENGLISH only):\n\n{str(product_data)}"}
-            ],
-            temperature=0.2
-        )
-        cleaned = response.choices[0].message.content.strip()
-        if cleaned.startswith("```json"): cleaned = cleaned[7:]
-        if cleaned.startswith("```"): cleaned = cleaned[3:]
-        if cleaned.endswith("```"): cleaned = cleaned[:-3]
+async def analyze_product(barcode: str, facts_only: bool = False, job: bool = False,
+                          user: Optional[dict] = Depends(get_current_user)):
+    """Full analysis; facts_only (or a slow / failing LLM) returns the deterministic facts instead.
 
+    Facts-only responses carry a "status": "facts_only" when requested, "pending" when
+    the LLM took longer than ANALYSIS_FACTS_FALLBACK_SECONDS or the request budget (it
+    keeps running and is stored), or "llm_unavailable" when it failed. With job, an analysis that is not
+    stored yet is queued and answered with 202 and the job to poll at /api/jobs/{id}.
+    """
+    if facts_only:
+        analysis = await find_analysis(barcode) or await get_analysis_facts(barcode)
+    elif job:
+        analysis = await find_analysis(barcode)
+        if analysis is None:
+            queued = await enqueue_analysis_job(barcode, PRIORITY_INTERACTIVE, user["id"] if user else None)
+            return JSONResponse(status_code=202, content=queued, headers={"Location": f"/api/jobs/{queued['id']}"})
+    else:
         try:
-            analysis_data = json.loads(cleaned.strip())
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON from LLM: {cleaned}")
-            raise HTTPException(status_code=500, detail="AI returned invalid JSON format")
+            analysis = await get_or_create_analysis(barcode, ANALYSIS_FACTS_FALLBACK_SECONDS or None)
+        except asyncio.TimeoutError:
+            left = resilience.remaining()
+            if left is not None and left <= 0 and get_off_mirror() is None:
+                # No budget left to fetch the facts from OFF
+                raise HTTPException(status_code=504, detail="Analysis did not finish within the request budget; "
+                                                            "it keeps running, retry shortly")
+            analysis = await get_analysis_facts(barcode, "pending")
+        except LLMError:
+            # OFF failures are not caught: they would fail the facts too
+            analysis = await get_analysis_facts(barcode, "llm_unavailable")
+    if user and "id" in analysis:
+        await record_scan(user, analysis)
+    # Add allergen warnings if user is logged in
+    return analysis_response(analysis, user)
 
-        food_type = detect_food_type(product)
-        nutrition_facts = extract_nutrition_facts(product.get("nutriments", {}))
+@api_router.post("/analyze/{barcode}/stream")
+async def analyze_product_stream(barcode: str, user: Optional[dict] = Depends(get_current_user)):
+    """Progressive /analyze as server-sent events.
 
-        # Ensure nutriscore has grade
-        nutriscore = analysis_data.get("nutriscore", {})
-        if "grade" not in nutriscore:
-            score = int(nutriscore.get("score_out_of_5", 3))
-            grade_map = {5: "A", 4: "B", 3: "C", 2: "D", 1: "E"}
-            nutriscore["grade"] = grade_map.get(score, "C")
+    "facts" (OFF summary, nutrition facts, allergen warnings) comes right after the
+    OFF fetch, then one "section" per LLM section as it is parsed from the streamed
+    completion, then "complete" with the stored analysis (or "error"). If the LLM
+    fails after the facts were sent, "complete" carries the facts with
+    "status": "llm_unavailable". A stream that joins an analysis already running
+    in this worker first gets the events sent before it joined.
+    """
+    existing = await find_analysis(barcode)
+    events: asyncio.Queue = asyncio.Queue()
+    task = None if existing else start_analysis(barcode, lambda event, data: events.put_nowait((event, data)))
 
-        analysis_result = {
-            "id": str(uuid.uuid4()),
-            "barcode": barcode,
-            "product_summary": {**analysis_data.get("product_summary", {}), "food_type": food_type},
-            "relevant_ingredients": analysis_data.get("relevant_ingredients", []),
-            "all_ingredients": analysis_data.get("all_ingredients", []),
-            "minority_ingredients": analysis_data.get("minority_ingredients", []),
-            "nutritional_insights": analysis_data.get("nutritional_insights", {}),
-            "nutriscore": nutriscore,
-            "confidence_meter": analysis_data.get("confidence_meter", {}),
-            "nutrition_facts": nutrition_facts,
-            "raw_product_data": product_data,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
+    async def relay():
+        if existing:
+            if user:
+                await record_scan(user, existing)
+            yield sse_event("complete", personalize_analysis(existing, user))
+            return
+        getter, facts = None, None
+        try:
+            # The analysis runs as its own task: a client disconnect ends this relay but the
+            # analysis still completes and is stored for everyone else
+            while True:
+                getter = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    break
+                event, data = getter.result()
+                if event == "facts":
+                    data = facts = personalize_analysis(dict(data), user)
+                yield sse_event(event, data)
+            while not events.empty():
+                event, data = events.get_nowait()
+                if event == "facts":
+                    data = facts = personalize_analysis(dict(data), user)
+                yield sse_event(event, data)
 
-        # Add allergen warnings
-        if user and user.get("allergens"):
-            analysis_result["allergen_warnings"] = check_allergens(product_data.get("ingredients", ""), user["allergens"])
+            try:
+                analysis = task.result()
+                if user:
+                    await record_scan(user, analysis)
+                yield sse_event("complete", personalize_analysis(dict(analysis), user))
+            except HTTPException as e:
+                if isinstance(e, LLMError) and facts is not None:
+                    # The LLM failed after the facts went out: finish with the facts alone
+                    yield sse_event("complete", {**facts, "status": "llm_unavailable"})
+                else:
+                    yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+            except Exception as e:
+                logger.error(f"Streamed analysis failed: {str(e)}")
+                yield sse_event("error", {"status_code": 500, "detail": "Analysis failed"})
+        finally:
+            if getter is not None:
+                getter.cancel()
 
-        await db.analyses.insert_one(analysis_result.copy())
-        # Remove _id if it was added by MongoDB
-        analysis_result.pop("_id", None)
-        return analysis_result
+    return StreamingResponse(
+        relay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    except Exception as e:
-        logger.error(f"Error analyzing product: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, response: Response, user: Optional[dict] = Depends(get_current_user)):
+    """Status of a queued analysis; once done it carries the (personalized) analysis"""
+    job = await get_analysis_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "done":
+        analysis = await find_analysis(job["barcode"])
+        if analysis:
+            job["analysis"] = personalize_analysis(analysis, user)
+    elif job["status"] != "failed":
+        response.headers["Retry-After"] = str(max(1, round(JOB_POLL_SECONDS)))
+    return job
 
 @api_router.post("/compare")
 async def compare_products(request: CompareRequest, user: Optional[dict] = Depends(get_current_user)):
-    if len(request.barcodes) < 2 or len(request.barcodes) > 3:
-        raise HTTPException(status_code=400, detail="Please provide 2-3 barcodes for comparison")
+    barcodes = list(dict.fromkeys(request.barcodes))
+    if len(barcodes) < 2 or len(barcodes) > COMPARE_MAX_PRODUCTS:
+        raise HTTPException(status_code=400, detail=f"Please provide 2-{COMPARE_MAX_PRODUCTS} barcodes for comparison")
     
-    products = []
-    for barcode in request.barcodes:
-        analysis = await db.analyses.find_one({"barcode": barcode}, {"_id": 0})
-        if not analysis:
-            # Trigger analysis if not exists
+    analyses = await find_analyses(barcodes)
+    errors = {}
+    semaphore = asyncio.Semaphore(COMPARE_CONCURRENCY)
+
+    async def analyze_missing(barcode: str):
+        # Triggers (or joins) an analysis; a failure only drops this product from the comparison
+        async with semaphore:
             try:
-                from fastapi import Request
-                analysis = await analyze_product(barcode, user)
-            except:
-                raise HTTPException(status_code=404, detail=f"Could not analyze product {barcode}")
-        products.append(analysis)
+                analyses[barcode] = await get_or_create_analysis(barcode)
+            except HTTPException as e:
+                errors[barcode] = {"barcode": barcode, "status_code": e.status_code, "detail": e.detail}
+            except asyncio.TimeoutError:
+                errors[barcode] = {"barcode": barcode, "status_code": 504,
+                                   "detail": "Analysis did not finish within the request budget; it keeps running"}
+            except Exception as e:
+                logger.error(f"Compare could not analyze {barcode}: {str(e)}")
+                errors[barcode] = {"barcode": barcode, "status_code": 500, "detail": f"Could not analyze product {barcode}"}
+
+    priority = analysis_priority.set(PRIORITY_COMPARE)
+    try:
+        await asyncio.gather(*(analyze_missing(b) for b in barcodes if b not in analyses))
+    finally:
+        analysis_priority.reset(priority)
     
-    return {"products": products}
+    return {
+        "products": [personalize_analysis(analyses[b], user) for b in barcodes if b in analyses],
+        "errors": [errors[b] for b in barcodes if b in errors],
+    }
 
-@api_router.post("/chat", response_model=ChatResponse)
-async def chat_with_product(request: ChatRequest):
-    analysis = await db.analyses.find_one({"barcode": request.barcode}, {"_id": 0})
+async def build_chat_messages(request: ChatRequest) -> List[dict]:
+    analysis = await find_analysis(request.barcode)
     if not analysis:
         raise HTTPException(status_code=404, detail="Product not analyzed yet")
     
-    context = f"""Product: {analysis.get('product_summary', {}).get('name', 'Unknown')}
-Brand: {analysis.get('product_summary', {}).get('brand', 'Unknown')}
-Key Ingredients: {', '.join([i.get('name', '') for i in analysis.get('relevant_ingredients', [])])}
-NutriScore: {analysis.get('nutriscore', {}).get('grade', 'N/A')} ({analysis.get('nutriscore', {}).get('score_out_of_5', 'N/A')}/5)
-Assessment: {analysis.get('nutritional_insights', {}).get('overall_assessment', 'N/A')}
-Full Data: {str(analysis)}"""
+    # Stable prefix (instructions + product context) first so provider-side prompt caching applies
+    prefix = f"{CHAT_SYSTEM_PROMPT}\n\nProduct data (JSON):\n"
+    # The context's share leaves room for the longest question and the history reserve; it does
+    # not depend on this question, so the prefix stays the same for every question on a product
+    context_budget = (CHAT_TOKEN_BUDGET - count_tokens(prefix) - CHAT_MAX_TURN_TOKENS - CHAT_HISTORY_RESERVE_TOKENS
+                      - 2 * MESSAGE_OVERHEAD_TOKENS)
+    system = {"role": "system", "content": prefix + truncate_to_tokens(chat_context(analysis), context_budget)}
+    question = {"role": "user", "content": truncate_to_tokens(request.message, CHAT_MAX_TURN_TOKENS)}
+    budget = CHAT_TOKEN_BUDGET - count_message_tokens(system) - count_message_tokens(question)
+    return [system, *fit_history(request.history, budget), question]
+
+async def record_llm_usage(route: str, usage, **extra):
+    """Store token usage of one LLM call; usage is the OpenAI usage object (None if unknown)"""
+    for kind in ("prompt", "completion"):
+        LLM_TOKENS.inc(getattr(usage, f"{kind}_tokens", None) or 0, route=route, type=kind)
+    try:
+        await db.llm_usage.insert_one({
+            "route": route,
+            "model": LLM_MODEL,
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "total_tokens": getattr(usage, "total_tokens", None),
+            **extra,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+    except PyMongoError as e:
+        logger.error(f"Could not record LLM usage: {str(e)}")
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@api_router.post("/chat", response_model=ChatResponse)
+async def chat_with_product(request: ChatRequest):
+    messages = await build_chat_messages(request)
     
     try:
-        response = await openai_client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": f"{CHAT_SYSTEM_PROMPT}\n\nContext:\n{context}"},
-                {"role": "user", "content": request.message}
-            ],
-            temperature=0.3
-        )
-        return ChatResponse(response=response.choices[0].message.content)
-    except Exception as e:
-        logger.error(f"Chat error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
-
-@api_router.get("/history", response_model=List[ScanHistory])
-async def get_scan_history(user: Optional[dict] = Depends(get_current_user)):
-    query = {}
-    if user:
-        query["user_id"] = user["id"]
+        response = await llm_completion(messages=messages, temperature=0.3)
+    except (CircuitOpenError, asyncio.TimeoutError, openai.OpenAIError) as e:
+        raise llm_error(e)
+    await record_llm_usage("chat", response.usage)
+    return ChatResponse(response=response.choices[0].message.content)
+
+@api_router.post("/chat/stream")
+async def chat_with_product_stream(request: ChatRequest):
+    """Same as /chat, but relays the completion token by token as server-sent events"""
+    messages = await build_chat_messages(request)
     
-    analyses = await db.analyses.find({}, {"_id": 0}).sort("created_at", -1).limit(50).to_list(50)
-    history = []
-    for a in analyses:
-        history.append(ScanHistory(
-            id=a.get("id", ""),
-            barcode=a.get("barcode", ""),
-            product_name=a.get("product_summary", {}).get("name", "Unknown"),
-            brand=a.get("product_summary", {}).get("brand", "Unknown"),
-            nutriscore=a.get("nutriscore", {}).get("grade", "N/A"),
-            food_type=a.get("product_summary", {}).get("food_type", "unknown"),
-            created_at=a.get("created_at", "")
-        ))
-    return history
-
-@api_router.delete("/history/{analysis_id}")
-async def delete_history_item(analysis_id: str):
-    result = await db.analyses.delete_one({"id": analysis_id})
-    if result.deleted_count == 0:
+    try:
+        stream = await llm_completion(
+            messages=messages, temperature=0.3, stream=True, stream_options={"include_usage": True}
+        )
+    except (CircuitOpenError, asyncio.TimeoutError, openai.OpenAIError) as e:
+        raise llm_error(e)
+
+    async def relay():
+        usage, chunks, finished = None, 0, False
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks += 1
+                    yield sse_event("token", {"content": chunk.choices[0].delta.content})
+            finished = True
+            yield sse_event("done", {"usage": usage.model_dump() if usage else None})
+        except Exception as e:
+            logger.error(f"Chat stream error: {str(e)}")
+            yield sse_event("error", {"detail": "Chat failed"})
+        finally:
+            # Runs on client disconnect too (the response task is cancelled): closing the
+            # upstream stream stops OpenAI from generating tokens nobody will read
+            with anyio.CancelScope(shield=True):
+                await stream.close()
+                await record_llm_usage("chat_stream", usage, completed=finished, streamed_chunks=chunks)
+
+    return StreamingResponse(
+        relay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/history", response_model=ScanHistoryPage)
+async def get_scan_history(limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None,
+                           user: dict = Depends(require_auth)):
+    # HISTORY_PROJECTION already yields ScanHistory fields only: skip per-row model validation
+    page = await find_scan_page(user["id"], max(1, min(limit, HISTORY_MAX_PAGE_SIZE)), cursor)
+    return Response(json_bytes(page), media_type="application/json", headers={"Cache-Control": "private, no-cache"})
+
+@api_router.delete("/history/{scan_id}")
+async def delete_history_item(scan_id: str, user: dict = Depends(require_auth)):
+    # Removes the user's scan only; the analysis itself is shared with other users
+    result = await db.scans.delete_one({"id": scan_id, "user_id": user["id"]})
+    if not result.deleted_count:
         raise HTTPException(status_code=404, detail="Item not found")
     return {"message": "Deleted successfully"}
 
 @api_router.get("/analysis/{barcode}")
-async def get_analysis(barcode: str, user: Optional[dict] = Depends(get_current_user)):
-    analysis = await db.analyses.find_one({"barcode": barcode}, {"_id": 0})
+async def get_analysis(barcode: str, if_none_match: Optional[str] = Header(None)):
+    """The shared analysis, cacheable by browsers and CDNs; allergen warnings are at /allergens"""
+    analysis = await find_analysis(barcode)
     if not analysis:
         raise HTTPException(status_code=404, detail="Analysis not found")
-    
-    if user and user.get("allergens"):
-        raw_data = analysis.get("raw_product_data", {})
-        analysis["allergen_warnings"] = check_allergens(raw_data.get("ingredients", ""), user["allergens"])
-    
-    return analysis
+
+    etag = analysis_etag(analysis)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={ANALYSIS_HTTP_MAX_AGE}"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(shared_analysis_body(analysis), media_type="application/json", headers=headers)
+
+@api_router.get("/analysis/{barcode}/allergens")
+async def get_analysis_allergens(barcode: str, user: Optional[dict] = Depends(get_current_user)):
+    """The current user's allergen warnings for an analysis (empty when anonymous)"""
+    analysis = await find_analysis(barcode)
+    if not analysis:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    warnings = personalize_analysis({"raw_product_data": analysis.get("raw_product_data", {})}, user)
+    return Response(
+        json_bytes({"barcode": barcode, "allergen_warnings": warnings.get("allergen_warnings", [])}),
+        media_type="application/json", headers={"Cache-Control": "private, no-store"}
+    )
+
+@api_router.delete("/admin/analysis/{barcode}", dependencies=[Depends(require_admin)])
+async def delete_analysis(barcode: str):
+    """Drop a shared analysis (e.g. a bad LLM result) so the next scan regenerates it"""
+    deleted = await db.analyses.find_one_and_delete({"barcode": barcode}, {"barcode": 1})
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    invalidate_cached_analysis(barcode)
+    await publish_analysis_invalidation(barcode)
+    return {"message": "Deleted successfully"}
+
+@api_router.get("/ranking/{barcode}")
+async def get_category_ranking(barcode: str, category: Optional[str] = None):
+    """Where the product's nutrients fall among analyzed products of its category (percent with a lower value)"""
+    ranking = category_ranking_or_503()
+    try:
+        return ranking.percentiles(barcode, category)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@api_router.get("/ranking/{barcode}/alternatives")
+async def get_healthier_alternatives(barcode: str, nutrient: str = "nutriscore_points", k: int = 5,
+                                     category: Optional[str] = None):
+    """Up to k analyzed products of the same category that do better on a nutrient (Nutri-Score points by default)"""
+    ranking = category_ranking_or_503()
+    if nutrient not in RANKING_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Unknown nutrient; use one of {', '.join(RANKING_COLUMNS)}")
+    try:
+        return ranking.alternatives(barcode, nutrient, min(max(k, 1), 50), category)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@api_router.get("/analysis/{barcode}/raw")
+async def get_analysis_raw_product(barcode: str):
+    """The full product data the analysis was built from, loaded on demand"""
+    product_data = await load_raw_product(barcode)
+    if product_data is None:
+        raise HTTPException(status_code=404, detail="Raw product data not found")
+    return product_data
+
+@api_router.get("/admin/db/diagnostics", dependencies=[Depends(require_admin)])
+async def get_db_diagnostics():
+    return await collect_db_diagnostics()
+
+@api_router.get("/health/upstreams")
+async def get_upstream_health():
+    return {"open_food_facts": off_breaker.snapshot(), "openai": llm_breaker.snapshot(), "llm_slots": llm_slots.snapshot()}
+
+@api_router.get("/admin/profile", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+async def get_profile(seconds: float = 10, interval_ms: float = 5):
+    """Sample the event-loop thread's stacks for a while; collapsed stacks, most frequent first"""
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiler is disabled (set PROFILER_ENABLED)")
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    try:
+        stacks = await anyio.to_thread.run_sync(profiler.sample, seconds, max(interval_ms, 1) / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return SamplingProfiler.render(stacks)
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    lookups = analysis_cache_stats["hits"] + analysis_cache_stats["misses"]
+    return {
+        **analysis_cache_stats,
+        "hit_ratio": round(analysis_cache_stats["hits"] / lookups, 4) if lookups else 0.0,
+        "size": len(analysis_cache),
+        "maxsize": analysis_cache.maxsize,
+        "ttl": analysis_cache.ttl,
+        "off_mirror": off_mirror.stats if off_mirror is not None else None,
+        "category_ranking": {**category_ranking.stats(), "ready": category_ranking_ready},
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # Include router and middleware
-app.include_router(api_router)
+app.include_router(api_router, dependencies=[Depends(request_budget)])
+app.add_middleware(MetricsMiddleware, duration=HTTP_REQUEST_SECONDS, in_progress=HTTP_IN_PROGRESS,
+                   route_name=route_template)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -563,8 +2340,90 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing"],
 )
 
+@app.on_event("startup")
+async def startup_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def startup_off_client():
+    global off_client
+    off_client = create_off_client()
+
+@app.on_event("startup")
+async def startup_off_mirror():
+    mirror = get_off_mirror()
+    if mirror is not None:
+        logger.info(f"Open Food Facts mirror: {mirror.describe()['products']} products at {OFF_MIRROR_PATH}")
+
+@app.on_event("startup")
+async def startup_cache_sync():
+    global cache_sync_task
+    cache_sync_task = asyncio.create_task(sync_analysis_cache())
+
+@app.on_event("startup")
+async def startup_token_encoder():
+    global token_encoder_task
+    token_encoder_task = asyncio.create_task(load_token_encoder())
+
+@app.on_event("startup")
+async def startup_category_ranking():
+    global ranking_sync_task
+    ranking_sync_task = asyncio.create_task(sync_category_ranking())
+
+@app.on_event("startup")
+async def startup_metrics():
+    global event_loop_lag_task, profiler
+    event_loop_lag_task = asyncio.create_task(
+        metrics.monitor_event_loop_lag(EVENT_LOOP_LAG, EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_LAG_INTERVAL)
+    )
+    if PROFILER_ENABLED:
+        profiler = SamplingProfiler(threading.get_ident())
+
+@app.on_event("startup")
+async def startup_job_workers():
+    start_job_workers(JOB_WORKERS)
+
+@app.on_event("shutdown")
+async def shutdown_job_workers():
+    await stop_job_workers()
+
+@app.on_event("shutdown")
+async def shutdown_metrics():
+    if event_loop_lag_task is not None:
+        event_loop_lag_task.cancel()
+
+@app.on_event("shutdown")
+async def shutdown_token_encoder():
+    if token_encoder_task is not None:
+        token_encoder_task.cancel()
+
+@app.on_event("shutdown")
+async def shutdown_category_ranking():
+    if ranking_sync_task is not None:
+        ranking_sync_task.cancel()
+
+@app.on_event("shutdown")
+async def shutdown_cache_sync():
+    if cache_sync_task is not None:
+        cache_sync_task.cancel()
+
+@app.on_event("shutdown")
+async def shutdown_off_client():
+    if off_client is not None:
+        await off_client.aclose()
+
+@app.on_event("shutdown")
+async def shutdown_off_mirror():
+    if off_mirror is not None:
+        off_mirror.close()
+
+@app.on_event("shutdown")
+async def shutdown_password_executor():
+    password_executor.shutdown(wait=False, cancel_futures=True)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+
+SECTIONS = {"relevant_ingredients": [{"name": "sugar"}], "confidence_meter": {"confidence_percentage": "80%"}}
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """A fake analysis pipeline whose completion waits for llm.release before its last section"""
+    llm = type("LLM", (), {"streamed": [], "release": None})()
+
+    async def fetch(barcode):
+        return {"product_name": "Cola", "ingredients_text": "water, sugar", "nutriments": {}}
+
+    async def no_reuse(product_data):
+        return None
+
+    async def complete(product_data, on_event=None):
+        llm.streamed.append(on_event is not None)
+        for name, value in SECTIONS.items():
+            if name == "confidence_meter":
+                await llm.release.wait()
+            if on_event is not None:
+                on_event("section", {"name": name, "value": value})
+        return json.dumps(SECTIONS)
+
+    async def store(analysis, product_data):
+        return analysis
+
+    monkeypatch.setattr(server, "fetch_product_from_openfoodfacts", fetch)
+    monkeypatch.setattr(server, "find_reusable_analysis", no_reuse)
+    monkeypatch.setattr(server, "complete_analysis", complete)
+    monkeypatch.setattr(server, "store_analysis", store)
+    # Skip the cross-worker lease: this worker runs the analysis
+    monkeypatch.setattr(server, "analyze_with_lease", server.run_analysis)
+    monkeypatch.setattr(server, "cache_analysis", lambda analysis: None)
+    return llm
+
+
+def names(events):
+    return [event if event == "facts" else data["name"] for event, data in events]
+
+
+async def until(condition):
+    while not condition():
+        await asyncio.sleep(0)
+
+
+def test_a_stream_joining_mid_analysis_gets_every_event(llm):
+    async def scenario():
+        llm.release = asyncio.Event()
+        first, joined = [], []
+        task = server.start_analysis("123", lambda event, data: first.append((event, data)))
+        await until(lambda: len(first) == 2)
+        assert server.start_analysis("123", lambda event, data: joined.append((event, data))) is task
+        llm.release.set()
+        await task
+        return first, joined
+
+    first, joined = asyncio.run(scenario())
+    assert names(first) == names(joined) == ["facts", "relevant_ingredients", "confidence_meter"]
+    assert joined == first
+    assert llm.streamed == [True]
+    assert server.inflight_events == {}
+
+
+def test_a_stream_joining_an_unstreamed_analysis_gets_the_facts_and_the_sections(llm):
+    async def scenario():
+        llm.release = asyncio.Event()
+        task = server.start_analysis("123")
+        await until(lambda: llm.streamed)
+        joined = []
+        server.start_analysis("123", lambda event, data: joined.append((event, data)))
+        facts_first = names(joined)
+        llm.release.set()
+        await task
+        return facts_first, joined
+
+    facts_first, joined = asyncio.run(scenario())
+    assert facts_first == ["facts"]
+    # The completion was not streamed: its sections come when it is done
+    assert llm.streamed == [False]
+    assert names(joined) == ["facts", "relevant_ingredients", "confidence_meter"]
+    assert joined[0][1]["product_summary"]["name"] == "Cola"
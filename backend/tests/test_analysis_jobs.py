@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    db = AsyncMongoMockClient()["nutridive_test"]
+    monkeypatch.setattr(server, "db", db)
+    return db.analysis_jobs
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def expire_lease(jobs, job_id):
+    await jobs.update_one({"id": job_id}, {"$set": {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+
+
+def test_claims_the_most_urgent_job_first(jobs):
+    async def scenario():
+        await server.enqueue_analysis_job("111", priority=server.PRIORITY_BATCH)
+        await server.enqueue_analysis_job("222", priority=server.PRIORITY_INTERACTIVE)
+        first = await server.claim_analysis_job("w1")
+        second = await server.claim_analysis_job("w1")
+        return first, second, await server.claim_analysis_job("w1")
+
+    first, second, third = run(scenario())
+    assert [first["barcode"], second["barcode"]] == ["222", "111"]
+    assert third is None
+
+
+def test_joining_a_queued_job_raises_its_priority(jobs):
+    async def scenario():
+        queued = await server.enqueue_analysis_job("111", priority=server.PRIORITY_BATCH, user_id="a")
+        joined = await server.enqueue_analysis_job("111", priority=server.PRIORITY_INTERACTIVE, user_id="b")
+        return queued, joined, await jobs.find_one({"id": queued["id"]})
+
+    queued, joined, stored = run(scenario())
+    assert joined["id"] == queued["id"]
+    assert joined["priority"] == server.PRIORITY_INTERACTIVE
+    assert stored["user_ids"] == ["a", "b"]
+
+
+def test_a_lapsed_lease_is_claimed_again(jobs):
+    async def scenario():
+        job = await server.enqueue_analysis_job("111")
+        leased = await server.claim_analysis_job("w1")
+        held = await server.claim_analysis_job("w2")
+        await expire_lease(jobs, job["id"])
+        reclaimed = await server.claim_analysis_job("w2")
+        stale = await server.finish_analysis_job(leased, "w1", {"status": "done"})
+        return leased, held, reclaimed, stale
+
+    leased, held, reclaimed, stale = run(scenario())
+    assert held is None
+    assert reclaimed["id"] == leased["id"]
+    assert (reclaimed["lease_owner"], reclaimed["attempts"]) == ("w2", 2)
+    # The worker that lost the lease cannot settle the job any more
+    assert stale is None
+
+
+def test_the_lease_is_renewed_until_another_worker_takes_it(jobs, monkeypatch):
+    monkeypatch.setattr(server, "JOB_LEASE_SECONDS", 0.06)
+
+    async def scenario():
+        job = await server.enqueue_analysis_job("111")
+        leased = await server.claim_analysis_job("w1")
+        heartbeat = asyncio.create_task(server.renew_job_lease(job["id"], "w1"))
+        await asyncio.sleep(0.1)
+        renewed = await jobs.find_one({"id": job["id"]})
+        await jobs.update_one({"id": job["id"]}, {"$set": {"lease_owner": "w2"}})
+        await asyncio.wait_for(heartbeat, 1)
+        return leased, renewed
+
+    leased, renewed = run(scenario())
+    assert renewed["lease_expires_at"] > leased["lease_expires_at"]
+    assert renewed["lease_owner"] == "w1"
+
+
+def test_a_job_past_max_attempts_fails_without_running(jobs, monkeypatch):
+    async def not_called(barcode):
+        raise AssertionError("abandoned jobs must not be analyzed again")
+
+    monkeypatch.setattr(server, "get_or_create_analysis", not_called)
+
+    async def scenario():
+        job = await server.enqueue_analysis_job("111")
+        for _ in range(server.JOB_MAX_ATTEMPTS + 1):
+            leased = await server.claim_analysis_job("w1")
+            await expire_lease(jobs, job["id"])
+        await server.process_analysis_job(leased, "w1")
+        return await server.get_analysis_job(job["id"])
+
+    job = run(scenario())
+    assert job["status"] == "failed"
+    assert job["attempts"] == server.JOB_MAX_ATTEMPTS + 1
+    assert job["error"]["detail"] == "Analysis abandoned after repeated worker failures"
+
+
+def test_upstream_errors_are_retried_until_max_attempts(jobs, monkeypatch):
+    async def unavailable(barcode):
+        raise HTTPException(status_code=503, detail="Open Food Facts is unavailable")
+
+    monkeypatch.setattr(server, "get_or_create_analysis", unavailable)
+
+    async def scenario():
+        job = await server.enqueue_analysis_job("111")
+        statuses = []
+        for _ in range(server.JOB_MAX_ATTEMPTS):
+            # Make the backoff delay due at once
+            await jobs.update_one({"id": job["id"]}, {"$set": {"available_at": datetime.now(timezone.utc)}})
+            leased = await server.claim_analysis_job("w1")
+            await server.process_analysis_job(leased, "w1")
+            statuses.append((await server.get_analysis_job(job["id"]))["status"])
+        return statuses, await server.get_analysis_job(job["id"])
+
+    statuses, job = run(scenario())
+    assert statuses == ["queued"] * (server.JOB_MAX_ATTEMPTS - 1) + ["failed"]
+    assert job["error"] == {"status_code": 503, "detail": "Open Food Facts is unavailable"}
+
+
+def test_a_client_error_fails_at_once(jobs, monkeypatch):
+    async def unknown(barcode):
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    monkeypatch.setattr(server, "get_or_create_analysis", unknown)
+
+    async def scenario():
+        job = await server.enqueue_analysis_job("111")
+        await server.process_analysis_job(await server.claim_analysis_job("w1"), "w1")
+        return await server.get_analysis_job(job["id"])
+
+    job = run(scenario())
+    assert (job["status"], job["attempts"]) == ("failed", 1)
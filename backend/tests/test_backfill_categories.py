@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+import backfill_categories
+import server
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = AsyncMongoMockClient()["nutridive_test"]
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(backfill_categories, "db", db)
+    return db
+
+
+def test_backfill_fills_tags_from_raw_products_then_off(db, monkeypatch):
+    fetched = []
+
+    async def fetch(barcode):
+        fetched.append(barcode)
+        if barcode == "404":
+            raise HTTPException(status_code=404, detail="Product not found")
+        if barcode == "503":
+            raise HTTPException(status_code=503, detail="Open Food Facts temporarily unavailable")
+        return {"categories_tags": ["en:beverages", "en:waters"]}
+
+    monkeypatch.setattr(server, "fetch_product_from_openfoodfacts", fetch)
+
+    async def scenario():
+        await db.analyses.insert_many([
+            {"barcode": "raw"}, {"barcode": "old"}, {"barcode": "404"}, {"barcode": "503"},
+            {"barcode": "new", "categories_tags": ["en:breads"]},
+        ])
+        await server.store_raw_products([
+            ("raw", server.build_product_data("raw", {"categories_tags": ["en:cheeses"]})),
+            ("old", {"name": "Water", "categories": ["Waters"]}),
+        ])
+        counts = await backfill_categories.backfill(batch_size=2)
+        tags = {doc["barcode"]: doc.get("categories_tags") async for doc in db.analyses.find()}
+        return counts, tags, await server.load_raw_product("old")
+
+    counts, tags, old_raw = asyncio.run(scenario())
+    assert tags == {"raw": ["en:cheeses"], "old": ["en:beverages", "en:waters"], "404": [], "503": None,
+                    "new": ["en:breads"]}
+    assert sorted(fetched) == ["404", "503", "old"]
+    assert counts == {"from_raw_products": 1, "fetched": 1, "without_tags": 1, "failed": 1}
+    assert old_raw == {"name": "Water", "categories": ["Waters"], "categories_tags": ["en:beverages", "en:waters"]}
+
+
+def test_product_data_keeps_the_tags_but_the_prompt_does_not():
+    product_data = server.build_product_data("1", {"categories": "Breads", "categories_tags": ["en:breads", 3]})
+    assert product_data["categories_tags"] == ["en:breads"]
+    assert "categories_tags" not in server.llm_product_data(product_data)
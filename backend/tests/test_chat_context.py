@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import server
+from server import ChatMessage, ChatRequest
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    # The estimate (4 characters a token) keeps these tests offline and deterministic
+    monkeypatch.setattr(server, "token_encoder", None)
+
+
+@pytest.mark.parametrize("max_tokens", [0, -5])
+def test_truncate_to_a_non_positive_limit_is_empty(max_tokens):
+    assert server.truncate_to_tokens("some text", max_tokens) == ""
+
+
+def test_truncate_keeps_text_within_the_limit():
+    assert server.truncate_to_tokens("short", 10) == "short"
+    cut = server.truncate_to_tokens("word " * 1000, 50)
+    assert cut.endswith("…")
+    assert server.count_tokens(cut) <= 51
+
+
+def chat_messages(monkeypatch, analysis, history):
+    async def find_analysis(barcode):
+        return analysis
+
+    monkeypatch.setattr(server, "find_analysis", find_analysis)
+    request = ChatRequest(barcode=analysis["barcode"], message="Is this healthy?", history=history)
+    return asyncio.run(server.build_chat_messages(request))
+
+
+def analysis_with_ingredients(count):
+    return {
+        "id": f"analysis-{count}", "barcode": "123", "product_summary": {"name": "Muesli"},
+        "all_ingredients": [{"name": f"ingredient number {i}"} for i in range(count)],
+    }
+
+
+HISTORY = [
+    ChatMessage(role="user", content="Does it contain nuts?"),
+    ChatMessage(role="assistant", content="Yes, hazelnuts."),
+    ChatMessage(role="user", content="How much sugar?"),
+    ChatMessage(role="assistant", content="12 g per 100 g."),
+]
+
+
+def test_small_context_is_sent_whole_with_the_history(monkeypatch):
+    analysis = analysis_with_ingredients(5)
+    messages = chat_messages(monkeypatch, analysis, HISTORY)
+    assert messages[0]["content"].endswith(server.chat_context(analysis))
+    assert [m["content"] for m in messages[1:]] == [m.content for m in HISTORY] + ["Is this healthy?"]
+
+
+def test_an_oversized_context_is_cut_to_leave_room_for_the_history(monkeypatch):
+    analysis = analysis_with_ingredients(5000)
+    assert server.count_tokens(server.chat_context(analysis)) > server.CHAT_TOKEN_BUDGET
+
+    messages = chat_messages(monkeypatch, analysis, HISTORY)
+    assert messages[0]["content"].startswith(server.CHAT_SYSTEM_PROMPT)
+    assert messages[0]["content"].endswith("…")
+    assert [m["content"] for m in messages[1:]] == [m.content for m in HISTORY] + ["Is this healthy?"]
+    assert sum(server.count_message_tokens(m) for m in messages) <= server.CHAT_TOKEN_BUDGET
+
+
+def test_a_context_limit_below_zero_sends_no_context(monkeypatch):
+    monkeypatch.setattr(server, "CHAT_TOKEN_BUDGET", 100)
+    messages = chat_messages(monkeypatch, analysis_with_ingredients(5), [])
+    assert messages[0]["content"].endswith("Product data (JSON):\n")
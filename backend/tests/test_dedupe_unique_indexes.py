@@ -0,0 +1,103 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import db_diagnostics
+import dedupe_unique_indexes
+import server
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = AsyncMongoMockClient()["nutridive_test"]
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(dedupe_unique_indexes, "db", db)
+    return db
+
+
+def run_script(dry_run=False):
+    return asyncio.run(dedupe_unique_indexes.main(SimpleNamespace(dry_run=dry_run, batch_size=2)))
+
+
+async def seed(db):
+    await db.analyses.insert_many([
+        {"id": "a1", "barcode": "111", "created_at": "2024-01-01T00:00:00+00:00"},
+        {"id": "a2", "barcode": "111", "created_at": "2024-03-01T00:00:00+00:00"},
+        {"id": "a3", "barcode": "111", "created_at": "2024-02-01T00:00:00+00:00"},
+        {"id": "a4", "barcode": "222", "created_at": "2024-01-01T00:00:00+00:00"},
+    ])
+    await db.users.insert_many([
+        {"id": "u1", "email": "a@example.com", "created_at": "2024-01-01T00:00:00+00:00"},
+        {"id": "u2", "email": "a@example.com", "created_at": "2024-05-01T00:00:00+00:00"},
+    ])
+    await db.analysis_jobs.insert_many([
+        {"id": "j1", "barcode": "111", "active": True, "created_at": "2024-01-01T00:00:00+00:00"},
+        {"id": "j2", "barcode": "111", "active": True, "created_at": "2024-02-01T00:00:00+00:00"},
+    ])
+
+
+def test_duplicates_block_the_unique_indexes(db):
+    async def scenario():
+        await seed(db)
+        await server.ensure_indexes()
+        return await server.missing_indexes()
+
+    assert set(asyncio.run(scenario())) == {
+        "analyses.barcode_unique", "users.email_unique", "analysis_jobs.barcode_active_unique"
+    }
+
+
+def test_a_partial_unique_index_only_dedupes_the_documents_it_covers(db):
+    keys, options = server.INDEX_SPECS["analysis_jobs"][1]
+
+    async def scenario():
+        await db.analysis_jobs.insert_many([
+            {"id": "done1", "barcode": "111"}, {"id": "done2", "barcode": "111"},
+            {"id": "old", "barcode": "222", "active": True}, {"id": "new", "barcode": "222", "active": True},
+        ])
+        return await dedupe_unique_indexes.duplicate_groups("analysis_jobs", keys, options)
+
+    [group] = asyncio.run(scenario())
+    assert group["_id"] == {"k0": "222"}
+    assert len(group["ids"]) == 2
+
+
+def test_dry_run_changes_nothing(db, capsys):
+    asyncio.run(seed(db))
+    assert run_script(dry_run=True) == 0
+    assert "analyses.barcode_unique: 1 keys with duplicates, 2 older documents to remove" in capsys.readouterr().out
+    assert asyncio.run(db.analyses.count_documents({})) == 4
+
+
+def test_dedupe_keeps_the_newest_document_per_key_and_builds_the_indexes(db):
+    asyncio.run(seed(db))
+    assert run_script() == 0
+
+    async def state():
+        return (
+            sorted([doc["id"] async for doc in db.analyses.find()]),
+            sorted([doc["id"] async for doc in db.analyses_duplicates.find()]),
+            [doc["id"] async for doc in db.users.find()],
+            await db.analysis_jobs.count_documents({}),
+            await server.missing_indexes(),
+        )
+
+    assert asyncio.run(state()) == (["a2", "a4"], ["a1", "a3"], ["u2"], 1, [])
+    # Nothing left to do on a second run
+    assert run_script() == 0
+    assert asyncio.run(db.analyses_duplicates.count_documents({})) == 2
+
+
+@pytest.mark.parametrize("report, code", [
+    ({"missing_indexes": [], "queries": {"history": {"collection_scan": False}}}, 0),
+    ({"missing_indexes": ["users.email_unique"], "queries": {"history": {"collection_scan": False}}}, 1),
+    ({"missing_indexes": [], "queries": {"history": {"collection_scan": True}}}, 1),
+])
+def test_diagnostics_check_fails_on_a_missing_index(monkeypatch, report, code):
+    async def collect():
+        return report
+
+    monkeypatch.setattr(db_diagnostics, "collect_db_diagnostics", collect)
+    assert asyncio.run(db_diagnostics.main(SimpleNamespace(ensure=False, check=True))) == code
@@ -0,0 +1,70 @@
+import pytest
+
+from fingerprint import BANDS, fingerprint, minhash, normalize_ingredients, nutrient_key, similarity
+
+NUTRIMENTS = {"energy-kcal_100g": 539, "sugars_100g": 56.3, "fat_100g": 30.9, "salt_100g": 0.107}
+SPREAD = ("Sugar, palm oil, hazelnuts 13%, skimmed milk powder 8.7%, fat-reduced cocoa 7.4%, "
+          "emulsifier: lecithins (soya), vanillin")
+
+
+def shared_bands(first, second):
+    return set(first["bands"]) & set(second["bands"])
+
+
+@pytest.mark.parametrize("text, normalized", [
+    ("Sugar, Palm Oil; Hazelnuts (13 %)", "sugar, palm oil, hazelnuts, 13%"),
+    ("skimmed milk powder 8,7%", "skimmed milk powder 8.7%"),
+    ("E 322, e-471, E330", "e322, e471, e330"),
+    ("Crème fraîche, fat-reduced cocoa", "creme fraiche, fat reduced cocoa"),
+    ("", ""),
+])
+def test_normalize_ingredients(text, normalized):
+    assert normalize_ingredients(text) == normalized
+
+
+def test_nutrient_key_rounds_to_two_significant_digits():
+    assert nutrient_key({"energy-kcal_100g": 512}) == nutrient_key({"energy-kcal_100g": "508"})
+    assert nutrient_key({"sugars_100g": 5.2}) != nutrient_key({"sugars_100g": 6.1})
+    assert nutrient_key({}) == "|".join(["-"] * 8)
+
+
+def test_formatting_differences_give_the_same_exact_fingerprint():
+    reformatted = SPREAD.upper().replace("8.7%", "8,7 %").replace(", ", " ; ")
+    assert fingerprint(reformatted, NUTRIMENTS)["exact"] == fingerprint(SPREAD, NUTRIMENTS)["exact"]
+
+
+def test_different_nutriments_change_the_exact_fingerprint():
+    other = {**NUTRIMENTS, "sugars_100g": 40}
+    assert fingerprint(SPREAD, other)["exact"] != fingerprint(SPREAD, NUTRIMENTS)["exact"]
+    assert fingerprint(SPREAD, other)["nutrients"] != fingerprint(SPREAD, NUTRIMENTS)["nutrients"]
+
+
+@pytest.mark.parametrize("variant", [
+    SPREAD.replace("13%", "14%"),
+    SPREAD.replace("vanillin", "vanilin"),
+    SPREAD.replace("skimmed milk powder", "skimmed milk powdr"),
+])
+def test_near_duplicates_share_a_band_and_pass_the_similarity_check(variant):
+    first, second = fingerprint(SPREAD, NUTRIMENTS), fingerprint(variant, NUTRIMENTS)
+    assert first["exact"] != second["exact"]
+    assert first["nutrients"] == second["nutrients"]
+    assert shared_bands(first, second)
+    assert similarity(minhash(normalize_ingredients(SPREAD)), minhash(normalize_ingredients(variant))) >= 0.85
+
+
+def test_unrelated_ingredient_lists_do_not_match():
+    other = "Tomatoes 80%, water, olive oil, salt, basil, garlic, black pepper"
+    assert not shared_bands(fingerprint(SPREAD, NUTRIMENTS), fingerprint(other, NUTRIMENTS))
+    assert similarity(minhash(normalize_ingredients(SPREAD)), minhash(normalize_ingredients(other))) < 0.3
+
+
+def test_signatures_are_deterministic():
+    signature = minhash(normalize_ingredients(SPREAD))
+    assert (signature == minhash(normalize_ingredients(SPREAD))).all()
+    assert similarity(signature, signature) == 1.0
+    assert len(fingerprint(SPREAD, NUTRIMENTS)["bands"]) == BANDS
+
+
+@pytest.mark.parametrize("text", [None, "", "salt", "Not available", "unknown"])
+def test_no_fingerprint_without_an_ingredient_list(text):
+    assert fingerprint(text, NUTRIMENTS) is None
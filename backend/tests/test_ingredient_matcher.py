@@ -0,0 +1,85 @@
+import pytest
+
+from ingredient_matcher import ALLERGEN_MATCHER, FOOD_TYPE_MATCHER, KeywordMatcher
+
+
+@pytest.fixture
+def matcher():
+    return KeywordMatcher(
+        {"nuts": ["nut", "peanut butter", "haselnuss*"], "dairy": ["milk", "butter"]},
+        neutral=["cocoa butter", "coconut milk"],
+    )
+
+
+def keywords(matcher, text):
+    return [(m.group, m.keyword) for m in matcher.find_all(text)]
+
+
+@pytest.mark.parametrize("text", ["nutmeg", "coconut", "walnutty", "peanuts"])
+def test_keywords_match_whole_tokens_only(matcher, text):
+    assert keywords(matcher, text) == []
+
+
+@pytest.mark.parametrize("text, keyword", [
+    ("nut", "nut"), ("nuts", "nuts"), ("(nuts)", "nuts"), ("Mixed NUTS.", "nuts"), ("nut-based", "nut"),
+])
+def test_keyword_at_token_boundaries(matcher, text, keyword):
+    # The match carries the (lowercased) text that matched, plural included
+    assert keywords(matcher, text) == [("nuts", keyword)]
+
+
+def test_match_positions_point_into_the_original_text(matcher):
+    text = "Sugar, Milk powder"
+    [match] = matcher.find_all(text)
+    assert text[match.start:match.end] == "Milk"
+
+
+def test_phrases_allow_any_whitespace_or_hyphens_and_win_over_their_first_word(matcher):
+    assert keywords(matcher, "peanut  butter") == [("nuts", "peanut  butter")]
+    assert keywords(matcher, "peanut-butter") == [("nuts", "peanut-butter")]
+
+
+def test_neutral_phrases_are_consumed(matcher):
+    assert keywords(matcher, "cocoa butter, coconut milk") == []
+    assert keywords(matcher, "cocoa butter, butter") == [("dairy", "butter")]
+
+
+def test_prefix_keywords_match_compounds(matcher):
+    assert keywords(matcher, "Haselnusskerne") == [("nuts", "haselnusskerne")]
+
+
+@pytest.mark.parametrize("text", ["milk-free", "milk free", "milkfree", "nut-free chocolate", "Haselnussfrei"])
+def test_free_negates_the_keyword(matcher, text):
+    assert keywords(matcher, text) == []
+
+
+def test_negation_only_covers_the_keyword_it_follows(matcher):
+    assert keywords(matcher, "milk-free, contains nuts") == [("nuts", "nuts")]
+    assert keywords(matcher, "free from milk") == [("dairy", "milk")]
+
+
+def test_allergen_tables():
+    found = ALLERGEN_MATCHER.groups_in("Sugar, cocoa butter, whole milk powder, hazelnuts, soy lecithin")
+    assert set(found) == {"dairy", "nuts", "soy"}
+    assert [m.keyword for m in ALLERGEN_MATCHER.find_all("gluten-free oats")] == ["oats"]
+    assert "nuts" not in ALLERGEN_MATCHER.groups_in("nutmeg, coconut milk")
+
+
+def test_food_type_tables():
+    assert "non-veg" in FOOD_TYPE_MATCHER.groups_in("Pork gelatine")
+    assert "non-veg" not in FOOD_TYPE_MATCHER.groups_in("meat substitute made from soy")
+
+
+@pytest.mark.parametrize("text", ["sugar, lemon rind, flour", "candied orange rind", "cheese (rind removed)"])
+def test_english_rind_is_not_meat(text):
+    assert "non-veg" not in FOOD_TYPE_MATCHER.groups_in(text)
+
+
+@pytest.mark.parametrize("text", ["Rindfleisch 60%, Salz", "Rinderhackfleisch", "Rindergelatine"])
+def test_german_beef_is_meat(text):
+    assert "non-veg" in FOOD_TYPE_MATCHER.groups_in(text)
+
+
+def test_nata_de_coco_is_not_dairy():
+    assert "dairy" not in ALLERGEN_MATCHER.groups_in("agua, nata de coco 30%, azúcar")
+    assert "dairy" in ALLERGEN_MATCHER.groups_in("leche, nata, azúcar")
@@ -0,0 +1,64 @@
+import json
+import random
+
+import pytest
+
+from server import JsonSectionParser
+
+DOCUMENT = {
+    "product_summary": {"name": "Choco \"Crunch\" {bar}", "categories": ["Snacks", "Sweets [mixed]"]},
+    "relevant_ingredients": [
+        {"name": "sugar", "health_impact": "Adds \\ empty calories, } and { are fine here"},
+        {"name": "palm oil", "estimated_concentration": "20%, roughly"},
+    ],
+    "nutritional_insights": {"overall_assessment": "Treat, \"occasionally\": a éclair-like \\\" snack"},
+    "confidence_meter": {"confidence_percentage": "80%"},
+}
+
+
+def feed_chunks(text, sizes):
+    parser, members, pos = JsonSectionParser(), [], 0
+    for size in sizes:
+        members.extend(parser.feed(text[pos:pos + size]))
+        pos += size
+    members.extend(parser.feed(text[pos:]))
+    return members
+
+
+def test_yields_each_top_level_member_once():
+    text = json.dumps(DOCUMENT)
+    assert feed_chunks(text, [len(text)]) == list(DOCUMENT.items())
+
+
+def test_one_character_at_a_time():
+    text = json.dumps(DOCUMENT, indent=2)
+    assert feed_chunks(text, [1] * len(text)) == list(DOCUMENT.items())
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_arbitrary_chunk_boundaries(seed):
+    rng = random.Random(seed)
+    text = json.dumps(DOCUMENT, ensure_ascii=bool(seed % 2))
+    sizes = [rng.randint(1, 12) for _ in range(len(text))]
+    assert feed_chunks(text, sizes) == list(DOCUMENT.items())
+
+
+def test_members_are_reported_as_soon_as_they_complete():
+    parser = JsonSectionParser()
+    assert parser.feed('{"a": {"x": "}"}, "b": [1, ') == [("a", {"x": "}"})]
+    assert parser.feed("2]") == []
+    assert parser.feed("}") == [("b", [1, 2])]
+
+
+def test_skips_a_code_fence_preamble():
+    text = "```json\n" + json.dumps({"a": 1, "b": "two"}) + "\n```"
+    assert feed_chunks(text, [3] * len(text)) == [("a", 1), ("b", "two")]
+
+
+def test_escaped_backslash_before_a_closing_quote():
+    # "\\\\" is an escaped backslash, so the quote after it closes the string
+    assert feed_chunks('{"a": "x\\\\", "b": 1}', [5, 5, 5]) == [("a", "x\\"), ("b", 1)]
+
+
+def test_invalid_member_is_skipped():
+    assert feed_chunks('{"a": tru, "b": 2}', [4]) == [("b", 2)]
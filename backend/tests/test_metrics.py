@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+import metrics
+from metrics import Counter, Gauge, Histogram, MetricsMiddleware, Registry, server_timing_header
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_and_gauge_render_with_help_and_type(registry):
+    requests = Counter("app_requests_total", "Requests", ("route",), registry=registry)
+    requests.inc(route="/b")
+    requests.inc(2, route="/a")
+    gauge = Gauge("app_cache_size", "Entries", function=lambda: 0.5, registry=registry)
+    assert gauge.current() == {(): 0.5}
+
+    assert registry.render() == (
+        "# HELP app_requests_total Requests\n"
+        "# TYPE app_requests_total counter\n"
+        'app_requests_total{route="/a"} 2\n'
+        'app_requests_total{route="/b"} 1\n'
+        "# HELP app_cache_size Entries\n"
+        "# TYPE app_cache_size gauge\n"
+        "app_cache_size 0.5\n"
+    )
+
+
+def test_label_values_are_escaped(registry):
+    counter = Counter("app_errors_total", "Errors", ("detail",), registry=registry)
+    counter.inc(detail='bad "quote" \\ back\nslash')
+    assert counter.samples() == ['app_errors_total{detail="bad \\"quote\\" \\\\ back\\nslash"} 1']
+
+
+def test_histogram_buckets_are_cumulative_and_end_with_inf(registry):
+    histogram = Histogram("app_seconds", "Latency", ("route",), buckets=(1, 0.1), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, route="/a")
+
+    assert histogram.samples() == [
+        'app_seconds_bucket{route="/a",le="0.1"} 2',
+        'app_seconds_bucket{route="/a",le="1"} 3',
+        'app_seconds_bucket{route="/a",le="+Inf"} 4',
+        'app_seconds_sum{route="/a"} 3.65',
+        'app_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_histogram_without_labels(registry):
+    histogram = Histogram("app_lag_seconds", "Lag", buckets=(0.5,), registry=registry)
+    histogram.observe(2)
+    assert histogram.samples() == [
+        'app_lag_seconds_bucket{le="0.5"} 0',
+        'app_lag_seconds_bucket{le="+Inf"} 1',
+        "app_lag_seconds_sum 2",
+        "app_lag_seconds_count 1",
+    ]
+
+
+def test_server_timing_sums_repeated_stages():
+    header = server_timing_header([("off", 0.1), ("llm", 1.23456), ("off", 0.05)])
+    assert header == "off;dur=150.0, llm;dur=1234.6"
+
+
+def test_record_timing_outside_a_request_is_ignored():
+    metrics.record_timing("off", 0.1)
+    assert metrics.request_timings.get() is None
+
+
+def test_middleware_sends_server_timing_and_records_the_request(registry):
+    duration = Histogram("http_seconds", "Latency", ("method", "route", "status"), registry=registry)
+    in_progress = Gauge("http_in_progress", "Running", registry=registry)
+    seen_in_progress = []
+
+    async def app(scope, receive, send):
+        seen_in_progress.append(in_progress.values[()])
+        metrics.record_timing("off", 0.02)
+        metrics.record_timing("off", 0.03)
+        await send({"type": "http.response.start", "status": 201, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    middleware = MetricsMiddleware(app, duration, in_progress, route_name=lambda scope: "/items/{id}")
+    asyncio.run(middleware({"type": "http", "method": "POST", "path": "/items/1"}, None, send))
+
+    headers = dict(messages[0]["headers"])
+    assert headers[b"content-type"] == b"text/plain"
+    stages = headers[b"server-timing"].decode().split(", ")
+    assert stages[0] == "off;dur=50.0"
+    assert stages[1].startswith("total;dur=")
+    assert messages[1]["body"] == b"ok"
+
+    assert seen_in_progress == [1]
+    assert in_progress.values[()] == 0
+    assert 'http_seconds_count{method="POST",route="/items/{id}",status="201"} 1' in duration.samples()
+    assert metrics.request_timings.get() is None
+
+
+def test_middleware_passes_other_scopes_through(registry):
+    duration = Histogram("http_seconds", "Latency", ("method", "route", "status"), registry=registry)
+    in_progress = Gauge("http_in_progress", "Running", registry=registry)
+    scopes = []
+
+    async def app(scope, receive, send):
+        scopes.append(scope["type"])
+
+    asyncio.run(MetricsMiddleware(app, duration, in_progress, route_name=str)({"type": "lifespan"}, None, None))
+    assert scopes == ["lifespan"]
+    assert duration.samples() == []
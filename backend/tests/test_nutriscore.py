@@ -0,0 +1,216 @@
+import numpy as np
+import pytest
+
+from nutriscore import (
+    BEVERAGE, BEVERAGE_ENERGY_KJ, CHEESE, ENERGY_KJ, FAT, FIBER, GENERAL, PROTEIN, SATURATED_FAT, SODIUM_MG, SUGARS,
+    WATER, category_tags, compute, product_kind, score_product, threshold_points,
+)
+
+
+def points_value(thresholds, points):
+    """A value worth exactly `points` (just above the points-th threshold)"""
+    return 0.0 if points == 0 else float(thresholds[points - 1]) + 0.01
+
+
+def compute_one(kind=GENERAL, energy_kj=0.0, sugars=0.0, saturated_fat=0.0, fat=0.0, sodium_mg=0.0,
+                fruits=0.0, fiber=0.0, proteins=0.0):
+    """compute() for a single product given as raw values"""
+    values = dict(energy_kj=energy_kj, sugars=sugars, saturated_fat=saturated_fat, fat=fat, sodium_mg=sodium_mg,
+                  fruits=fruits, fiber=fiber, proteins=proteins, kind=kind)
+    result = compute(**{key: np.array([value], dtype=float) for key, value in values.items()})
+    return {key: value[0] for key, value in result.items()}
+
+
+def score(kind=GENERAL, energy=0, sugars=0, saturated_fat=0, sodium=0, fiber=0, proteins=0, fruits=0.0):
+    """compute() for a single product given as points per component"""
+    return compute_one(
+        kind, energy_kj=points_value(ENERGY_KJ, energy), sugars=points_value(SUGARS, sugars),
+        saturated_fat=points_value(SATURATED_FAT, saturated_fat), sodium_mg=points_value(SODIUM_MG, sodium),
+        fruits=fruits, fiber=points_value(FIBER, fiber), proteins=points_value(PROTEIN, proteins),
+    )
+
+
+@pytest.mark.parametrize("thresholds", [ENERGY_KJ, SUGARS, SATURATED_FAT, SODIUM_MG, FIBER, PROTEIN])
+def test_a_threshold_value_itself_scores_the_lower_points(thresholds):
+    values = np.concatenate([thresholds, thresholds + 0.01])
+    expected = np.concatenate([np.arange(len(thresholds)), np.arange(1, len(thresholds) + 1)])
+    assert threshold_points(values, thresholds).tolist() == expected.tolist()
+
+
+def test_points_are_capped_at_the_last_threshold():
+    assert threshold_points(np.array([0.0, 10_000.0]), ENERGY_KJ).tolist() == [0, 10]
+
+
+@pytest.mark.parametrize("energy, fiber, expected_score, grade", [
+    (0, 5, -5, "A"), (0, 1, -1, "A"), (0, 0, 0, "B"), (2, 0, 2, "B"), (3, 0, 3, "C"), (10, 0, 10, "C"),
+])
+def test_general_grade_boundaries_low(energy, fiber, expected_score, grade):
+    result = score(energy=energy, fiber=fiber)
+    assert (result["score"], result["grade"]) == (expected_score, grade)
+
+
+@pytest.mark.parametrize("negative, grade", [(11, "D"), (18, "D"), (19, "E"), (40, "E")])
+def test_general_grade_boundaries_high(negative, grade):
+    energy = min(negative, 10)
+    sugars = min(negative - energy, 10)
+    saturated = min(negative - energy - sugars, 10)
+    result = score(energy=energy, sugars=sugars, saturated_fat=saturated, sodium=negative - energy - sugars - saturated)
+    assert (result["score"], result["grade"]) == (negative, grade)
+
+
+@pytest.mark.parametrize("energy, grade", [(0, "B"), (1, "B"), (2, "C"), (5, "C"), (6, "D"), (9, "D"), (10, "E")])
+def test_beverage_grade_boundaries(energy, grade):
+    # Beverages never reach A: that grade is reserved for plain water
+    result = compute_one(BEVERAGE, energy_kj=points_value(BEVERAGE_ENERGY_KJ, energy))
+    assert (result["score"], result["grade"]) == (energy, grade)
+
+
+def test_protein_stops_counting_from_eleven_negative_points():
+    assert score(energy=10, proteins=5)["score"] == 5
+    assert score(energy=10, sugars=1, proteins=5)["score"] == 11
+    # ...unless fruit/vegetables max out, or the product is a cheese
+    assert score(energy=10, sugars=1, proteins=5, fruits=85.0)["score"] == 1
+    assert score(kind=CHEESE, energy=10, sugars=1, proteins=5)["score"] == 6
+
+
+def test_fruit_points_need_strictly_more_than_each_bound():
+    assert [score(fruits=value)["fruits"] for value in (40.0, 40.1, 60.0, 60.1, 80.0, 80.1)] == [0, 1, 1, 2, 2, 5]
+
+
+def test_added_fats_score_the_saturated_share_of_fat():
+    # Unlike the other tables, reaching a ratio threshold (10%, 16%...) already scores
+    shares = (9.9, 10.0, 15.9, 16.0, 64.0, 100.0)
+    assert [compute_one(FAT, saturated_fat=share, fat=100.0)["saturated_fat"] for share in shares] == [0, 1, 1, 2, 10, 10]
+
+
+def test_missing_required_nutrient_is_invalid():
+    assert not compute_one(sugars=np.nan)["valid"]
+    # Fibre, protein and fruit/vegetables are optional
+    assert compute_one(fiber=np.nan, proteins=np.nan, fruits=np.nan)["valid"]
+
+
+# Real OFF products: their categories and the categories_tags OFF derives from them
+BREAD = (
+    "Plant-based foods and beverages, Plant-based foods, Cereals and potatoes, Breads, Sliced breads",
+    ["en:plant-based-foods-and-beverages", "en:plant-based-foods", "en:cereals-and-potatoes", "en:breads",
+     "en:sliced-breads"],
+)
+OATS = (
+    "Plant-based foods and beverages, Plant-based foods, Cereals and potatoes, Cereals and their products, "
+    "Breakfasts, Breakfast cereals, Cereal flakes, Rolled flakes, Rolled oats",
+    ["en:plant-based-foods-and-beverages", "en:plant-based-foods", "en:cereals-and-potatoes",
+     "en:cereals-and-their-products", "en:breakfasts", "en:breakfast-cereals", "en:cereal-flakes",
+     "en:rolled-flakes", "en:rolled-oats"],
+)
+OLIVE_OIL = (
+    "Plant-based foods and beverages, Plant-based foods, Fats, Vegetable fats, Olive tree products, "
+    "Vegetable oils, Olive oils, Extra-virgin olive oils",
+    ["en:plant-based-foods-and-beverages", "en:plant-based-foods", "en:fats", "en:vegetable-fats",
+     "en:olive-tree-products", "en:vegetable-oils", "en:olive-oils", "en:extra-virgin-olive-oils"],
+)
+ORANGE_JUICE = (
+    "Plant-based foods and beverages, Beverages, Plant-based beverages, Fruit-based beverages, "
+    "Juices and nectars, Fruit juices, Orange juices",
+    ["en:plant-based-foods-and-beverages", "en:beverages", "en:plant-based-beverages",
+     "en:fruit-based-beverages", "en:juices-and-nectars", "en:fruit-juices", "en:orange-juices"],
+)
+SOY_DRINK = (
+    "Plant-based foods and beverages, Beverages, Plant-based beverages, Dairy substitutes, Milk substitutes, "
+    "Plant-based milk alternatives, Soy-based drinks",
+    ["en:plant-based-foods-and-beverages", "en:beverages", "en:plant-based-beverages", "en:dairy-substitutes",
+     "en:milk-substitutes", "en:plant-based-milk-alternatives", "en:soy-based-drinks"],
+)
+CHOCOLATE_MILK = (
+    "Dairies, Beverages, Dairy drinks, Milk drinks, Flavoured milks, Chocolate milks",
+    ["en:dairies", "en:beverages", "en:dairy-drinks", "en:milk-drinks", "en:flavoured-milks",
+     "en:chocolate-milks"],
+)
+COMTE = (
+    "Dairies, Fermented foods, Fermented milk products, Cheeses, Cow cheeses, French cheeses, Comté",
+    ["en:dairies", "en:fermented-foods", "en:fermented-milk-products", "en:cheeses", "en:cow-cheeses",
+     "en:french-cheeses", "fr:comte"],
+)
+BUTTER = (
+    "Dairies, Spreads, Fats, Animal fats, Milkfat, Dairy spreads, Butters, Salted butters",
+    ["en:dairies", "en:spreads", "en:fats", "en:animal-fats", "en:milkfat", "en:dairy-spreads", "en:butters",
+     "en:salted-butters"],
+)
+PEANUT_BUTTER = (
+    "Plant-based foods and beverages, Plant-based foods, Legumes and their products, Spreads, "
+    "Plant-based spreads, Legume butters, Peanut butters",
+    ["en:plant-based-foods-and-beverages", "en:plant-based-foods", "en:legumes-and-their-products", "en:spreads",
+     "en:plant-based-spreads", "en:legume-butters", "en:peanut-butters"],
+)
+MINERAL_WATER = (
+    "Beverages, Waters, Spring waters, Mineral waters, Natural mineral waters",
+    ["en:beverages", "en:waters", "en:spring-waters", "en:mineral-waters", "en:natural-mineral-waters"],
+)
+
+KINDS = [
+    (BREAD, GENERAL), (OATS, GENERAL), (OLIVE_OIL, FAT), (ORANGE_JUICE, BEVERAGE), (SOY_DRINK, BEVERAGE),
+    (CHOCOLATE_MILK, GENERAL), (COMTE, CHEESE), (BUTTER, FAT), (PEANUT_BUTTER, GENERAL),
+    (MINERAL_WATER, WATER),
+]
+
+
+@pytest.mark.parametrize("product, kind", KINDS)
+def test_product_kind_from_categories_tags(product, kind):
+    categories, tags = product
+    # The tags decide, whatever the (possibly translated) category names say
+    assert product_kind({"categories": "Boissons", "categories_tags": tags}) == kind
+
+
+@pytest.mark.parametrize("product, kind", KINDS)
+def test_product_kind_from_english_category_names_without_tags(product, kind):
+    assert product_kind({"categories": product[0]}) == kind
+
+
+def test_category_tags_from_names():
+    assert category_tags({"categories": "Beverages, Fruit-based beverages , Chocolate milks"}) == {
+        "en:beverages", "en:fruit-based-beverages", "en:chocolate-milks"
+    }
+    assert category_tags({"categories": ""}) == set()
+
+
+def test_flavoured_water_is_a_beverage():
+    product = {"categories_tags": MINERAL_WATER[1], "nutriments": {"energy-kcal_100g": 18, "sugars_100g": 4.2}}
+    assert product_kind(product) == BEVERAGE
+
+
+def test_bread_is_scored_as_a_general_food():
+    scored = score_product({
+        "categories_tags": BREAD[1],
+        "nutriments": {"energy-kj_100g": 1065, "sugars_100g": 4.3, "saturated-fat_100g": 0.6, "fat_100g": 3.2,
+                       "salt_100g": 1.1, "fiber_100g": 3.1, "proteins_100g": 8.6},
+    })
+    # 3 energy + 0 sugars + 0 saturated fat + 4 sodium - 3 fibre - 5 protein; the beverage tables would give E
+    assert (scored["points"], scored["grade"], scored["variant"]) == (-1, "A", "general")
+
+
+def test_olive_oil_is_scored_as_an_added_fat():
+    scored = score_product({
+        "categories_tags": OLIVE_OIL[1],
+        "nutriments": {"energy-kj_100g": 3378, "sugars_100g": 0, "saturated-fat_100g": 14, "fat_100g": 100,
+                       "salt_100g": 0},
+    })
+    # 10 energy + 1 for 14% saturated fat of the fat
+    assert (scored["points"], scored["grade"], scored["variant"]) == (11, "D", "fat")
+
+
+def test_score_product_hazelnut_spread():
+    scored = score_product({
+        "categories": "Spreads, Sweet spreads, Hazelnut spreads",
+        "nutriments": {"energy_100g": 2252, "sugars_100g": 56.3, "saturated-fat_100g": 10.6, "fat_100g": 30.9,
+                       "sodium_100g": 0.0428, "proteins_100g": 6.3, "fruits-vegetables-nuts_100g": 13},
+    })
+    # 6 energy + 10 sugars + 10 saturated fat + 0 sodium; protein does not count at 26 negative points
+    assert (scored["points"], scored["grade"], scored["variant"]) == (26, "E", "general")
+
+
+def test_plain_water_is_always_a():
+    scored = score_product({"categories": "Beverages, Waters, Mineral waters", "nutriments": {}})
+    assert (scored["grade"], scored["points"], scored["variant"]) == ("A", None, "water")
+
+
+def test_insufficient_nutriments_give_no_score():
+    assert score_product({"categories": "Snacks", "nutriments": {"energy-kcal_100g": 500}}) is None
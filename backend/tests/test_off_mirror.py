@@ -0,0 +1,84 @@
+import gzip
+import json
+
+import pytest
+
+from off_mirror import ProductMirror
+
+
+def product(code, name, last_modified, **extra):
+    return {"code": code, "product_name": name, "last_modified_t": last_modified,
+            "nutriments": {"sugars_100g": 1.5, "sugars_serving": 3, "salt_100g": ""}, **extra}
+
+
+def write_jsonl(path, products):
+    path.write_text("".join(json.dumps(p) + "\n" for p in products))
+    return path
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    mirror = ProductMirror(str(tmp_path / "mirror" / "off.sqlite"))
+    yield mirror
+    mirror.close()
+
+
+def test_put_keeps_only_the_used_fields(mirror):
+    assert mirror.put("1", product("1", "Cola", 100, image_url="https://example.org/1.jpg"))
+    assert mirror.get("1") == {"product_name": "Cola", "nutriments": {"sugars_100g": 1.5}}
+    assert mirror.get("2") is None
+    assert (mirror.stats["hits"], mirror.stats["misses"]) == (1, 1)
+
+
+def test_newer_copy_wins(mirror):
+    assert mirror.put("1", product("1", "New", 200))
+    assert not mirror.put("1", product("1", "Old", 100))
+    assert mirror.get("1")["product_name"] == "New"
+    # Same timestamp: a re-import of the same data is applied again
+    assert mirror.put("1", product("1", "Same age", 200))
+    assert mirror.get("1")["product_name"] == "Same age"
+    assert mirror.put("1", product("1", "Newer", 300))
+    assert mirror.get("1")["product_name"] == "Newer"
+
+
+def test_import_file_skips_older_copies_and_rows_without_a_code(mirror, tmp_path):
+    mirror.put("1", product("1", "Already newer", 500))
+    dump = write_jsonl(tmp_path / "dump.jsonl", [
+        product("1", "Stale", 100), product("2", "Fresh", 100), {"product_name": "No code"},
+    ])
+    result = mirror.import_file(str(dump), batch_size=2)
+    assert (result["read"], result["written"], result["skipped"]) == (3, 1, 2)
+    assert mirror.get("1")["product_name"] == "Already newer"
+    assert mirror.get("2")["product_name"] == "Fresh"
+    assert json.loads(mirror.get_meta("last_import"))["file"] == "dump.jsonl"
+
+
+def test_import_gzipped_csv_export(mirror, tmp_path):
+    rows = [
+        "code\tproduct_name\tnova_group\tlast_modified_t\tsugars_100g\tsalt_100g",
+        "3\tTea\t1\t100\t0.5\t",
+        "4\tBroken\tx\t100\tnot a number\t0.1",
+    ]
+    path = tmp_path / "export.csv.gz"
+    with gzip.open(path, "wt") as f:
+        f.write("\n".join(rows) + "\n")
+    assert mirror.import_file(str(path))["written"] == 2
+    assert mirror.get("3") == {"product_name": "Tea", "nova_group": 1, "nutriments": {"sugars_100g": 0.5}}
+    assert mirror.get("4") == {"product_name": "Broken", "nutriments": {"salt_100g": 0.1}}
+
+
+def test_deltas_are_applied_once_in_name_order(mirror, tmp_path):
+    deltas = tmp_path / "deltas"
+    deltas.mkdir()
+    write_jsonl(deltas / "0001.jsonl", [product("1", "First", 100), product("2", "Two", 100)])
+    write_jsonl(deltas / "0002.jsonl", [product("1", "Second", 200)])
+
+    assert [r["file"] for r in mirror.apply_deltas(str(deltas))] == ["0001.jsonl", "0002.jsonl"]
+    assert mirror.get("1")["product_name"] == "Second"
+
+    # Re-running is a no-op; only a new file is picked up
+    assert mirror.apply_deltas(str(deltas)) == []
+    write_jsonl(deltas / "0003.jsonl", [product("2", "Updated", 300)])
+    assert [r["file"] for r in mirror.apply_deltas(str(deltas))] == ["0003.jsonl"]
+    assert mirror.get("2")["product_name"] == "Updated"
+    assert mirror.describe()["products"] == 2
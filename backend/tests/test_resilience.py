@@ -0,0 +1,372 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, PriorityLimiter, backoff, deadline, hedged
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only resilience sees the fake clock; the event loop keeps the real one
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("upstream", failure_threshold=3, reset_timeout=10)
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        breaker.allow()
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_consecutive_failures(breaker):
+    fail(breaker, 2)
+    assert breaker.state == "closed"
+    fail(breaker, 1)
+    assert breaker.state == "open"
+    assert breaker.stats["opened"] == 1
+
+
+def test_a_success_resets_the_failure_count(breaker):
+    fail(breaker, 2)
+    breaker.allow()
+    breaker.record_success()
+    fail(breaker, 2)
+    assert breaker.state == "closed"
+
+
+def test_open_circuit_rejects_with_time_left(breaker, clock):
+    fail(breaker, 3)
+    clock.now += 4
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.allow()
+    assert raised.value.retry_after == pytest.approx(6)
+    assert breaker.stats["rejected"] == 1
+
+
+def test_half_open_lets_one_probe_through(breaker, clock):
+    fail(breaker, 3)
+    clock.now += 10
+    assert breaker.state == "half_open"
+    breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_successful_probe_closes(breaker, clock):
+    fail(breaker, 3)
+    clock.now += 10
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.snapshot()["consecutive_failures"] == 0
+    breaker.allow()
+
+
+def test_failed_probe_reopens_for_a_full_timeout(breaker, clock):
+    fail(breaker, 3)
+    clock.now += 10
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.stats["opened"] == 2
+    clock.now += 9.9
+    assert breaker.state == "open"
+    clock.now += 0.1
+    assert breaker.state == "half_open"
+
+
+def test_call_counts_only_upstream_failures(breaker):
+    class NotFound(Exception):
+        pass
+
+    async def missing():
+        raise NotFound()
+
+    async def flaky():
+        raise ConnectionError()
+
+    async def run(operation):
+        await resilience.call(operation, breaker=breaker, timeout=1, retry_on=(ConnectionError,))
+
+    for _ in range(3):
+        with pytest.raises(NotFound):
+            asyncio.run(run(missing))
+    assert breaker.state == "closed"
+
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            asyncio.run(run(flaky))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(run(flaky))
+
+
+def test_call_releases_the_probe_slot_on_a_non_upstream_error(breaker, clock):
+    async def bad_request():
+        raise ValueError()
+
+    fail(breaker, 3)
+    clock.now += 10
+    with pytest.raises(ValueError):
+        asyncio.run(resilience.call(bad_request, breaker=breaker, timeout=1))
+    # The probe did not say anything about upstream health: the next call may probe
+    assert breaker.state == "half_open"
+    breaker.allow()
+
+
+def test_backoff_is_full_jitter_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(resilience, "random", SimpleNamespace(uniform=lambda low, high: (low, high)))
+    assert [backoff(attempt, 0.2, 2.0) for attempt in range(5)] == [
+        (0, 0.2), (0, 0.4), (0, 0.8), (0, 1.6), (0, 2.0)
+    ]
+
+
+def test_call_retries_upstream_failures_with_backoff(monkeypatch):
+    delays = []
+    monkeypatch.setattr(resilience, "backoff", lambda attempt, base, cap: delays.append((attempt, base, cap)) or 0)
+    breaker = CircuitBreaker("upstream", failure_threshold=5)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError()
+        return "ok"
+
+    result = asyncio.run(resilience.call(flaky, breaker=breaker, timeout=1, retries=2, retry_on=(ConnectionError,),
+                                         base_delay=0.5, max_delay=4))
+    assert result == "ok"
+    assert delays == [(0, 0.5, 4), (1, 0.5, 4)]
+    assert breaker.stats == {"successes": 1, "failures": 2, "rejected": 0, "opened": 0}
+
+
+def test_call_gives_up_after_the_last_retry(monkeypatch):
+    monkeypatch.setattr(resilience, "backoff", lambda attempt, base, cap: 0)
+    breaker = CircuitBreaker("upstream", failure_threshold=5)
+    attempts = []
+
+    async def down():
+        attempts.append(1)
+        raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(resilience.call(down, breaker=breaker, timeout=1, retries=2, retry_on=(ConnectionError,)))
+    assert len(attempts) == 3
+
+
+def test_an_upstream_timeout_trips_the_breaker():
+    breaker = CircuitBreaker("upstream", failure_threshold=1)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(resilience.call(slow, breaker=breaker, timeout=0.01))
+    assert breaker.state == "open"
+
+
+def test_a_timeout_cut_short_by_the_deadline_does_not_trip_the_breaker():
+    breaker = CircuitBreaker("upstream", failure_threshold=1)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def scenario():
+        with deadline(0.02):
+            await resilience.call(slow, breaker=breaker, timeout=5, retries=3)
+
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(scenario())
+    assert time.monotonic() - started < 0.5
+    assert breaker.state == "closed"
+    assert breaker.stats["failures"] == 0
+
+
+def test_an_exhausted_deadline_raises_deadline_exceeded():
+    breaker = CircuitBreaker("upstream")
+    calls = []
+
+    async def operation():
+        calls.append(1)
+
+    async def scenario():
+        with deadline(0):
+            await resilience.call(operation, breaker=breaker, timeout=1)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
+    assert calls == []
+
+
+def test_a_timeout_past_the_deadline_is_reported_as_deadline_exceeded():
+    breaker = CircuitBreaker("upstream", failure_threshold=1)
+
+    async def overran():
+        # Blocks past the deadline, then times out on its own
+        time.sleep(0.03)
+        raise asyncio.TimeoutError()
+
+    async def scenario():
+        with deadline(0.02):
+            await resilience.call(overran, breaker=breaker, timeout=1, retries=3)
+
+    with pytest.raises(DeadlineExceeded) as raised:
+        asyncio.run(scenario())
+    assert isinstance(raised.value, asyncio.TimeoutError)
+    assert breaker.state == "closed"
+
+
+def test_an_inner_deadline_never_outlives_the_outer_one():
+    async def scenario():
+        with deadline(0.5):
+            with deadline(60):
+                inner = resilience.remaining()
+            with deadline(60, inherit=False):
+                detached = resilience.remaining()
+        return inner, detached, resilience.remaining()
+
+    inner, detached, after = asyncio.run(scenario())
+    assert inner <= 0.5
+    assert detached > 59
+    assert after is None
+
+
+def hedge_scenario(delays, hedge_after=0.02):
+    """Run hedged() over calls that take delays[i] seconds; (result, started, cancelled)"""
+    started, cancelled = [], []
+
+    async def make_call():
+        number = len(started)
+        started.append(number)
+        try:
+            await asyncio.sleep(delays[number])
+        except asyncio.CancelledError:
+            cancelled.append(number)
+            raise
+        return number
+
+    async def scenario():
+        result = await hedged(make_call, hedge_after)
+        # Let the cancellation of the loser run
+        await asyncio.sleep(0)
+        return result
+
+    return asyncio.run(scenario()), started, cancelled
+
+
+def test_a_fast_first_call_is_not_hedged():
+    assert hedge_scenario([0, 1]) == (0, [0], [])
+
+
+def test_the_hedge_wins_over_a_slow_first_call():
+    assert hedge_scenario([1, 0]) == (1, [0, 1], [0])
+
+
+def test_the_first_call_still_wins_if_it_finishes_first():
+    assert hedge_scenario([0.05, 1]) == (0, [0, 1], [1])
+
+
+def test_hedged_raises_the_last_error_when_both_fail():
+    errors = iter([ConnectionError("first"), ConnectionError("second")])
+
+    async def make_call():
+        error = next(errors)
+        await asyncio.sleep(0.03 if str(error) == "first" else 0.05)
+        raise error
+
+    with pytest.raises(ConnectionError, match="second"):
+        asyncio.run(hedged(make_call, 0.01))
+
+
+def test_limiter_admits_the_most_urgent_waiter_first():
+    admitted = []
+
+    async def worker(limiter, name, priority):
+        await limiter.acquire(priority)
+        admitted.append(name)
+
+    async def scenario():
+        limiter = PriorityLimiter(1)
+        await limiter.acquire()
+        tasks = [asyncio.create_task(worker(limiter, name, priority))
+                 for name, priority in [("batch", 20), ("first", 0), ("compare", 10), ("second", 0)]]
+        await asyncio.sleep(0)
+        assert limiter.snapshot() == {"limit": 1, "active": 1, "waiting": 4}
+        for _ in tasks:
+            limiter.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return limiter.snapshot()
+
+    assert asyncio.run(scenario()) == {"limit": 1, "active": 1, "waiting": 0}
+    assert admitted == ["first", "second", "compare", "batch"]
+
+
+def test_limiter_runs_up_to_its_limit_without_waiting():
+    async def scenario():
+        limiter = PriorityLimiter(2)
+        await limiter.acquire(20)
+        await limiter.acquire(20)
+        third = asyncio.create_task(limiter.acquire(0))
+        await asyncio.sleep(0)
+        waiting = limiter.snapshot()
+        limiter.release()
+        await third
+        limiter.release()
+        limiter.release()
+        return waiting, limiter.snapshot()
+
+    waiting, idle = asyncio.run(scenario())
+    assert waiting == {"limit": 2, "active": 2, "waiting": 1}
+    assert idle == {"limit": 2, "active": 0, "waiting": 0}
+
+
+def test_a_cancelled_waiter_is_skipped():
+    async def scenario():
+        limiter = PriorityLimiter(1)
+        await limiter.acquire()
+        cancelled = asyncio.create_task(limiter.acquire(0))
+        waiting = asyncio.create_task(limiter.acquire(5))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.wait_for(waiting, 1)
+        return limiter.snapshot()
+
+    assert asyncio.run(scenario()) == {"limit": 1, "active": 1, "waiting": 0}
+
+
+def test_a_waiter_cancelled_after_the_hand_off_passes_the_slot_on():
+    async def scenario():
+        limiter = PriorityLimiter(1)
+        await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire(0))
+        second = asyncio.create_task(limiter.acquire(5))
+        await asyncio.sleep(0)
+        # The slot goes to first, which is cancelled before it gets to run
+        limiter.release()
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        return first.cancelled(), limiter.snapshot()
+
+    cancelled, snapshot = asyncio.run(scenario())
+    assert cancelled
+    assert snapshot == {"limit": 1, "active": 1, "waiting": 0}
@@ -4,7 +4,7 @@ import { Button } from "./ui/button";
 import { Input } from "./ui/input";
 import { ScrollArea } from "./ui/scroll-area";
 import { cn } from "../lib/utils";
-import axios from "axios";
+import { postEventStream } from "../lib/sse";
 import { toast } from "sonner";
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
@@ -19,6 +19,7 @@ export default function ChatPanel({ barcode, productName, isOpen, onToggle }) {
   const [input, setInput] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const scrollRef = useRef(null);
+  const abortRef = useRef(null);
 
   useEffect(() => {
     if (scrollRef.current) {
@@ -26,35 +27,60 @@ export default function ChatPanel({ barcode, productName, isOpen, onToggle }) {
     }
   }, [messages]);
 
+  // Abort an in-flight stream when the panel closes or unmounts so the backend stops generating
+  useEffect(() => {
+    if (!isOpen) abortRef.current?.abort();
+  }, [isOpen]);
+  useEffect(() => () => abortRef.current?.abort(), []);
+
+  const appendToLastMessage = (text) => {
+    setMessages((prev) => {
+      const last = prev[prev.length - 1];
+      return [...prev.slice(0, -1), { ...last, content: last.content + text }];
+    });
+  };
+
   const sendMessage = async () => {
     if (!input.trim() || isLoading) return;
 
     const userMessage = { role: "user", content: input.trim() };
+    const history = messages;
     setMessages((prev) => [...prev, userMessage]);
     setInput("");
     setIsLoading(true);
 
+    const controller = new AbortController();
+    abortRef.current = controller;
+    let started = false;
+
     try {
-      const response = await axios.post(`${API}/chat`, {
-        barcode,
-        message: userMessage.content,
-        history: messages,
+      await postEventStream(`${API}/chat/stream`, {
+        body: { barcode, message: userMessage.content, history },
+        signal: controller.signal,
+        onEvent: (event, data) => {
+          if (event !== "token") return;
+          if (!started) {
+            started = true;
+            setIsLoading(false);
+            setMessages((prev) => [...prev, { role: "assistant", content: data.content }]);
+          } else {
+            appendToLastMessage(data.content);
+          }
+        },
       });
-
-      setMessages((prev) => [
-        ...prev,
-        { role: "assistant", content: response.data.response },
-      ]);
     } catch (error) {
+      if (error.name === "AbortError") return;
       console.error("Chat error:", error);
       toast.error("Failed to get response. Please try again.");
-      setMessages((prev) => [
-        ...prev,
-        {
-          role: "assistant",
-          content: "Sorry, I encountered an error. Please try again.",
-        },
-      ]);
+      if (!started) {
+        setMessages((prev) => [
+          ...prev,
+          {
+            role: "assistant",
+            content: "Sorry, I encountered an error. Please try again.",
+          },
+        ]);
+      }
     } finally {
       setIsLoading(false);
     }
@@ -0,0 +1,38 @@
+import axios from "axios";
+
+// POST to a server-sent-events endpoint and call onEvent(event, data) for each event
+export async function postEventStream(url, { body, signal, onEvent }) {
+  const headers = { "Content-Type": "application/json" };
+  // Reuse the bearer token AuthContext installs on axios
+  const authorization = axios.defaults.headers.common["Authorization"];
+  if (authorization) headers.Authorization = authorization;
+
+  const response = await fetch(url, {
+    method: "POST",
+    headers,
+    body: body === undefined ? undefined : JSON.stringify(body),
+    signal,
+  });
+  if (!response.ok || !response.body) {
+    const error = await response.json().catch(() => ({}));
+    throw new Error(error.detail || `Request failed with status ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split("\n\n");
+    buffer = events.pop();
+
+    for (const raw of events) {
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "{}");
+      if (event === "error") throw new Error(data.detail);
+      onEvent(event, data);
+    }
+  }
+}
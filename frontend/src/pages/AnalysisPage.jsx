@@ -20,7 +20,7 @@ import NutriScoreBadge from "../components/NutriScoreBadge";
 import ConfidenceMeter from "../components/ConfidenceMeter";
 import ChatPanel from "../components/ChatPanel";
 import { useAuth } from "../context/AuthContext";
-import axios from "axios";
+import { postEventStream } from "../lib/sse";
 import { toast } from "sonner";
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
@@ -88,30 +88,52 @@ export default function AnalysisPage() {
   const { user } = useAuth();
   const [analysis, setAnalysis] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
+  const [isStreaming, setIsStreaming] = useState(false);
   const [error, setError] = useState(null);
   const [chatOpen, setChatOpen] = useState(false);
   const [detectedAllergens, setDetectedAllergens] = useState([]);
 
   useEffect(() => {
+    const controller = new AbortController();
+
+    // Deterministic facts arrive first, then each AI section, then the stored analysis
     const fetchAnalysis = async () => {
       setIsLoading(true);
+      setIsStreaming(true);
       setError(null);
+      setAnalysis(null);
       try {
-        const response = await axios.post(`${API}/analyze/${barcode}`);
-        setAnalysis(response.data);
-        
-        // Detect common allergens
-        const rawIngredients = response.data.raw_product_data?.ingredients || "";
-        setDetectedAllergens(detectAllergens(rawIngredients));
+        await postEventStream(`${API}/analyze/${barcode}/stream`, {
+          signal: controller.signal,
+          onEvent: (event, data) => {
+            if (event === "facts" || event === "complete") {
+              setAnalysis(data);
+              setDetectedAllergens(detectAllergens(data.raw_product_data?.ingredients || ""));
+              setIsLoading(false);
+            } else if (event === "section") {
+              setAnalysis((prev) => ({
+                ...prev,
+                [data.name]: data.name === "product_summary"
+                  ? { ...prev?.product_summary, ...data.value, food_type: prev?.product_summary?.food_type }
+                  : data.value,
+              }));
+            }
+          },
+        });
       } catch (err) {
-        const message = err.response?.data?.detail || "Failed to analyze product";
+        if (err.name === "AbortError") return;
+        const message = err.message || "Failed to analyze product";
         setError(message);
         toast.error(message);
       } finally {
-        setIsLoading(false);
+        if (!controller.signal.aborted) {
+          setIsLoading(false);
+          setIsStreaming(false);
+        }
       }
     };
     if (barcode) fetchAnalysis();
+    return () => controller.abort();
   }, [barcode]);
 
   if (isLoading) {
@@ -176,6 +198,16 @@ export default function AnalysisPage() {
                 {product_summary?.name || "Unknown Product"}
               </h1>
               <p className="text-muted-foreground">{product_summary?.brand || "Unknown Brand"} • {product_summary?.quantity || ""}</p>
+              {isStreaming && (
+                <p className="flex items-center gap-2 text-sm text-muted-foreground" data-testid="analysis-streaming">
+                  <Loader2 className="h-4 w-4 animate-spin" />AI is still analyzing ingredients...
+                </p>
+              )}
+              {analysis.status === "llm_unavailable" && (
+                <p className="text-sm text-muted-foreground" data-testid="analysis-facts-only">
+                  AI analysis is unavailable right now; showing nutrition facts and Nutri-Score only.
+                </p>
+              )}
               {product_summary?.categories?.length > 0 && (
                 <div className="flex flex-wrap gap-2">
                   {product_summary.categories.slice(0, 3).map((cat, i) => (
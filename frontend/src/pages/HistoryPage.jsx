@@ -28,23 +28,32 @@ const FoodTypeIndicator = ({ type }) => {
 
 export default function HistoryPage() {
   const [history, setHistory] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchHistory();
   }, []);
 
-  const fetchHistory = async () => {
+  const fetchHistory = async (cursor = null) => {
     try {
-      const response = await axios.get(`${API}/history`);
-      setHistory(response.data);
+      const response = await axios.get(`${API}/history`, { params: cursor ? { cursor } : {} });
+      setHistory((prev) => (cursor ? [...prev, ...response.data.items] : response.data.items));
+      setNextCursor(response.data.next_cursor);
     } catch (err) {
       toast.error("Failed to load history");
     } finally {
       setIsLoading(false);
+      setIsLoadingMore(false);
     }
   };
 
+  const loadMore = () => {
+    setIsLoadingMore(true);
+    fetchHistory(nextCursor);
+  };
+
   const deleteItem = async (id) => {
     try {
       await axios.delete(`${API}/history/${id}`);
@@ -149,6 +158,14 @@ export default function HistoryPage() {
                 </CardContent>
               </Card>
             ))}
+            {nextCursor && (
+              <div className="flex justify-center pt-2">
+                <Button variant="outline" onClick={loadMore} disabled={isLoadingMore} data-testid="history-load-more">
+                  {isLoadingMore && <Loader2 className="mr-2 h-4 w-4 animate-spin" />}
+                  Load more
+                </Button>
+              </div>
+            )}
           </div>
         )}
       </div>